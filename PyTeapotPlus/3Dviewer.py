@@ -6,19 +6,25 @@ import pygame
 from pygame.locals import *
 from OpenGL.GL import *
 from OpenGL.GLU import *
-from pywavefront import Wavefront, visualization
+from meshcache import load_mesh
+from meshrender import MeshRenderer
+from scheduler import FrameScheduler, set_mode
+from cli import package_path
 import sys
 
 # Configuration
 DISPLAY_SIZE = (800, 600)
-# Use a simple obj file, ensure you have one in the same directory
-OBJ_FILE = "PyTeapotPlus\\alfa147.obj"
+# Use a simple obj file; relative paths are looked up in the current directory, then next to this script
+OBJ_FILE = "alfa147.obj"
 COLOR = (0.1, 0.3, 0.1)
+FORCE_LOD = None  # None picks the level of detail from the model's size on screen, 0 is full detail, 1, 2, .. coarser
+FPS_LIMIT = 60  # redraw rate cap while the model is dragged or zoomed, nothing is redrawn otherwise
+VSYNC = False  # set True to flip in step with the display refresh, no tearing
 
 
 def draw():
     pygame.init()
-    pygame.display.set_mode(DISPLAY_SIZE, DOUBLEBUF | OPENGL)
+    set_mode(DISPLAY_SIZE, DOUBLEBUF | OPENGL, VSYNC)
     pygame.display.set_caption("OpenGL Model Viewer")
 
     #enable lighting
@@ -58,11 +64,12 @@ def draw():
     glEnable(GL_DEPTH_TEST)
 
     # Load the model
+    path = package_path(OBJ_FILE)
     try:
-        scene = Wavefront(OBJ_FILE, collect_faces=True, create_materials=True)
+        scene = MeshRenderer(load_mesh(path), force_lod=FORCE_LOD)  # parsed once, then loaded from the mesh cache
     except Exception as e:
         print(f"Error loading model: {e}")
-        print("Please ensure you have a 'model.obj' file in the script directory.")
+        print(f"Please ensure the model file {path} exists.")
         sys.exit()
     glColor3f(*COLOR) # Set current color
 
@@ -70,8 +77,9 @@ def draw():
     drag = False
     mouse_pos = None
 
+    scheduler = FrameScheduler(FPS_LIMIT, idle_refresh=None)
     while True:
-        for event in pygame.event.get():
+        for event in scheduler.wait():  # sleeps until there is input
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
@@ -80,8 +88,10 @@ def draw():
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == 4: # Wheel up (zoom in)
                     glScalef(1.05, 1.05, 1.05)
+                    scheduler.invalidate()
                 elif event.button == 5: # Wheel down (zoom out)
                     glScalef(0.95, 0.95, 0.95)
+                    scheduler.invalidate()
                 elif event.button == 1: # Left button down (start drag rotation)
                     drag = True
                     mouse_pos = event.pos
@@ -103,16 +113,19 @@ def draw():
                     # glRotatef applies the rotation *after* any previous transformations (like initial translation)
                     glRotatef(dx * 0.5, 0, 1, 0) # Rotate around Y-axis based on horizontal drag
                     glRotatef(dy * 0.5, 1, 0, 0) # Rotate around X-axis based on vertical drag
-                    
+                    scheduler.invalidate()
+
+        if not scheduler.ready():
+            continue  # the camera did not move, the last frame is still right
+
         # Clear the screen and depth buffer
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
         # Draw the model
-        visualization.draw(scene)
+        scene.draw()
 
         # Update the display
         pygame.display.flip()
-        pygame.time.wait(10)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,9 @@
+"""
+Entry point of the PyTeapotPlus directory: python PyTeapotPlus cube|model [options]
+"""
+
+import cli
+
+
+if __name__ == '__main__':
+    cli.main()
@@ -0,0 +1,386 @@
+"""
+Offline analysis of PyTeapotPlus session logs.
+
+Judges a long capture of a board lying still, e.g. whether the calibration
+the firmware restored from the EEPROM is still good: a magnetometer that is
+off shows as yaw drift, a noisy or badly mounted sensor as noise and a high
+Allan deviation, and the calibration timeline shows how long the BNO055
+took to trust its sensors and whether it lost them again.
+
+    python analysis.py still.ptrec
+    python analysis.py runs/*.ptrec --jobs 8 --json report.json
+    python analysis.py big.ptrec --source 1 --chunk 4000000
+
+Each log is streamed in chunks of CHUNK records straight from its memory map
+(SessionLog.chunks()), so memory use does not grow with the file, and every
+statistic is a running sum over vectorised chunks. Several files are
+analysed in parallel processes, --jobs of them at a time. Per source:
+
+- drift: slope of a least squares line through each unwrapped angle over
+  the host time, in degrees per minute, and the RMS of the angle about it
+- noise: sample to sample noise of each angle, the RMS of the successive
+  differences over sqrt(2), which slow drift does not inflate
+- Allan deviation of the angular rate for cluster times from one sample to
+  half a chunk, assuming the nominal sample period (gaps shift it slightly);
+  its minimum is the bias instability
+- gaps: intervals longer than GAP_FACTOR nominal periods, measured on the
+  device clock where the log has it, and device restarts (the clock went
+  back)
+- calibration: time spent in every state and the timeline of its changes
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
+import quat
+from session import FLAG_CAL, SessionLog
+from wire import unpack_cal
+
+
+CHUNK = 1 << 20  # records per chunk, 40 MB of log; also bounds the longest Allan cluster to CHUNK // 2 samples
+GAP_FACTOR = 2.5  # nominal periods between two samples that count as a gap
+ALLAN_PER_DECADE = 5  # cluster sizes per decade
+ALLAN_MIN_CLUSTERS = 10  # a cluster size is reported once the source has this many clusters of it
+ALLAN_OVERLAP = 8  # start points per cluster length, fewer than every sample only for clusters longer than this
+ALLAN_BLOCK = 1 << 14  # samples per block of the short clusters, small enough for the CPU cache
+MAX_EVENTS = 200  # gaps and calibration changes kept per source, the rest are only counted
+UNKNOWN = 256  # calibration state of samples the transport reported none for
+AXES = ('yaw', 'pitch', 'roll')
+
+
+def cluster_sizes(chunk):
+    """
+    Allan cluster sizes in samples, ALLAN_PER_DECADE log-spaced sizes per
+    decade from 1 up to chunk // 2
+    """
+    decades = np.log10(max(chunk // 2, 1))
+    sizes = np.unique(np.round(10.0 ** (np.arange(int(decades * ALLAN_PER_DECADE) + 1) / ALLAN_PER_DECADE)))
+    return sizes.astype(np.int64)
+
+
+def unwrap(angles, previous=None):
+    """
+    Rows of angles in degrees with the 360 degree jumps taken out, in
+    place, continuing from the column previous. Cheaper than np.unwrap()
+    when the angles rarely wrap, as for a board lying still.
+    """
+    if previous is not None:
+        angles[:, 0] -= 360.0 * np.rint((angles[:, 0] - previous) / 360.0)
+    turns = np.diff(angles, axis=1)
+    turns /= 360.0
+    np.rint(turns, out=turns)
+    if turns.any():
+        np.cumsum(turns, axis=1, out=turns)
+        turns *= 360.0
+        angles[:, 1:] -= turns
+    return angles
+
+
+class SourceStats:
+    """
+    Running statistics of one source, fed its records chunk by chunk in
+    order with update()
+    """
+    def __init__(self, name, clusters):
+        self.name = name
+        self.count = 0
+        self.period = None  # nominal sample period, median interval of the first chunk
+        self.resets = 0
+        self.gaps = 0
+        self.gap_time = 0.0
+        self.longest_gap = 0.0
+        self.missing = 0  # samples estimated lost in the gaps
+        self.gap_list = []  # (time, seconds) of the first MAX_EVENTS gaps
+        self.clusters = clusters
+        self._t0 = None  # host time of the first sample
+        self._last = None  # (t_recv, t_device, state) of the last sample
+        self._origin = None  # first angles, the drift sums are taken relative to them
+        self._tail = np.zeros((3, 0))  # last 2 * max(clusters) unwrapped angles, one row per axis
+        self._sums = np.zeros(3)  # t, t * t, and the count of the samples in the regression
+        self._angle_sums = np.zeros((3, 3))  # per axis: a, t * a, a * a
+        self._diff_sq = np.zeros(3)
+        self._diffs = 0
+        self._allan_sq = np.zeros((len(clusters), 3))
+        self._allan_terms = np.zeros(len(clusters), np.int64)
+        self._state_time = np.zeros(UNKNOWN + 1)
+        self.changes = 0
+        self.timeline = []  # (time, calibration or None) of the first MAX_EVENTS states
+        self.first_sys3 = None
+        self.first_full = None
+
+    def update(self, records, useQuat):
+        t = records['t_recv']
+        device = records['t_device']
+        if useQuat:
+            angles = quat.to_ypr(records['values'])
+        else:
+            angles = records['values'][:, :3].astype(np.float64)
+        states = records['cal'].astype(np.int64)
+        states[(records['flags'] & FLAG_CAL) == 0] = UNKNOWN
+        if self._t0 is None:
+            self._t0 = float(t[0])
+            self._origin = angles[0].copy()
+            self._last = (t[0], device[0], UNKNOWN + 1)  # no state yet, the first one is a change
+        prev_t, prev_device, prev_state = self._last
+        self._timing(np.concatenate([[prev_t], t]), np.concatenate([[prev_device], device]))
+        self._angles(t, angles)
+        self._calibration(np.concatenate([[prev_t], t]), np.concatenate([[prev_state], states]))
+        self._last = (t[-1], device[-1], int(states[-1]))
+        self.count += len(records)
+
+    def _timing(self, t, device):
+        """
+        Gaps and restarts; t and device start with the last sample of the
+        previous chunk
+        """
+        interval = np.where(np.isnan(device[1:]) | np.isnan(device[:-1]), np.diff(t), np.diff(device))
+        restarts = interval < 0
+        self.resets += int(np.count_nonzero(restarts))
+        if self.count == 0:
+            interval = interval[1:]  # the first sample has no predecessor
+            t = t[1:]
+        if self.period is None:
+            positive = interval[interval > 0]
+            if not len(positive):
+                return
+            self.period = float(np.median(positive))
+        gap = np.flatnonzero(interval > GAP_FACTOR * self.period)
+        if not len(gap):
+            return
+        seconds = interval[gap]
+        self.gaps += len(gap)
+        self.gap_time += float(seconds.sum())
+        self.longest_gap = max(self.longest_gap, float(seconds.max()))
+        self.missing += int(np.sum(np.round(seconds / self.period) - 1))
+        room = MAX_EVENTS - len(self.gap_list)
+        self.gap_list += [(float(start - self._t0), float(s)) for start, s in zip(t[gap][:room], seconds[:room])]
+
+    def _angles(self, t, angles):
+        """
+        Drift, noise and Allan sums over the unwrapped angles
+        """
+        tail = self._tail
+        angles = np.ascontiguousarray(angles.T)  # rows: whole-axis operations run over contiguous memory
+        angles = unwrap(angles, tail[:, -1] if tail.shape[1] else None)
+        a = angles - self._origin[:, None]
+        s = t - self._t0
+        self._sums += (s.sum(), s @ s, len(s))
+        self._angle_sums += (a.sum(1), a @ s, np.einsum('ij,ij->i', a, a))
+        x = np.concatenate([tail, angles], 1)
+        d = np.diff(x[:, max(tail.shape[1] - 1, 0):], axis=1)
+        self._diff_sq += np.einsum('ij,ij->i', d, d)
+        self._diffs += d.shape[1]
+        # second differences x[j] - 2 x[j - m] + x[j - 2m] for the j of this chunk. Short clusters use every
+        # sample, a cache sized block at a time; long ones only the j on a grid of every m // ALLAN_OVERLAP
+        # samples of the log, which costs little confidence and keeps the result independent of the chunks
+        first = self.count - tail.shape[1]  # sample index of x[:, 0]
+        n = x.shape[1]
+        buffer = np.empty((3, n))
+        short = int(np.count_nonzero(self.clusters < 2 * ALLAN_OVERLAP))
+        for block in range(tail.shape[1], n, ALLAN_BLOCK):
+            end = min(block + ALLAN_BLOCK, n)
+            for i, m in enumerate(self.clusters[:short]):
+                start = max(block, 2 * m)
+                if start >= end:
+                    continue
+                d = buffer[:, :end - start]
+                np.subtract(x[:, start:end], x[:, start - m:end - m], out=d)
+                np.subtract(d, x[:, start - m:end - m], out=d)
+                np.add(d, x[:, start - 2 * m:end - 2 * m], out=d)
+                self._allan_sq[i] += np.einsum('ij,ij->i', d, d)
+                self._allan_terms[i] += end - start
+        for i in range(short, len(self.clusters)):
+            m = int(self.clusters[i])
+            step = m // ALLAN_OVERLAP
+            start = max(tail.shape[1], 2 * m)
+            start += -(first + start) % step
+            terms = len(range(start, n, step))
+            if terms <= 0:
+                continue
+            d = buffer[:, :terms]
+            end = start + terms * step
+            np.subtract(x[:, start:end:step], x[:, start - m:end - m:step], out=d)
+            np.subtract(d, x[:, start - m:end - m:step], out=d)
+            np.add(d, x[:, start - 2 * m:end - 2 * m:step], out=d)
+            self._allan_sq[i] += np.einsum('ij,ij->i', d, d)
+            self._allan_terms[i] += terms
+        self._tail = x[:, -2 * int(self.clusters[-1]):].copy()
+
+    def _calibration(self, t, states):
+        """
+        Time per state and its changes; t and states start with the last
+        sample of the previous chunk
+        """
+        self._state_time += np.bincount(np.minimum(states[:-1], UNKNOWN), weights=np.diff(t), minlength=UNKNOWN + 1)
+        changed = np.flatnonzero(states[1:] != states[:-1]) + 1
+        self.changes += len(changed) - (self.count == 0)  # the first state is not a change
+        room = MAX_EVENTS - len(self.timeline)
+        for i in changed[:room]:
+            state = int(states[i])
+            self.timeline.append((float(t[i] - self._t0), None if state == UNKNOWN else unpack_cal(state)))
+        known = states[1:] < UNKNOWN
+        if self.first_sys3 is None:
+            hit = np.flatnonzero(known & (states[1:] >> 6 == 3))
+            if len(hit):
+                self.first_sys3 = float(t[hit[0] + 1] - self._t0)
+        if self.first_full is None:
+            hit = np.flatnonzero(states[1:] == 0xFF)
+            if len(hit):
+                self.first_full = float(t[hit[0] + 1] - self._t0)
+
+    def result(self):
+        """
+        The statistics as a JSON-ready dict
+        """
+        st, stt, n = self._sums
+        sa, sta, saa = self._angle_sums
+        duration = float(self._last[0] - self._t0) if self.count else 0.0
+        result = {'name': self.name, 'samples': self.count, 'duration_s': duration,
+                  'rate_hz': 1.0 / self.period if self.period else None, 'restarts': self.resets,
+                  'gaps': {'count': self.gaps, 'seconds': self.gap_time, 'missing_samples': self.missing,
+                           'longest_s': self.longest_gap, 'first': self.gap_list}}
+        spread = stt - st * st / n if n else 0.0
+        if n > 2 and spread > 0:
+            cross = sta - st * sa / n
+            slope = cross / spread
+            residual = np.maximum(saa - sa * sa / n - cross * slope, 0.0) / (n - 2)
+            result['drift_deg_per_min'] = dict(zip(AXES, (60.0 * slope).tolist()))
+            result['residual_rms_deg'] = dict(zip(AXES, np.sqrt(residual).tolist()))
+        if self._diffs:
+            result['noise_deg'] = dict(zip(AXES, np.sqrt(self._diff_sq / (2.0 * self._diffs)).tolist()))
+        if self.period:
+            allan = []
+            for m, sq, terms in zip(self.clusters, self._allan_sq, self._allan_terms):
+                if terms and self.count >= ALLAN_MIN_CLUSTERS * m:
+                    tau = m * self.period
+                    allan.append({'tau_s': tau, **dict(zip(AXES, np.sqrt(sq / (2.0 * tau * tau * terms)).tolist()))})
+            result['allan_deg_per_s'] = allan
+            if allan:
+                result['bias_instability_deg_per_s'] = {axis: min(row[axis] for row in allan) for axis in AXES}
+        total = self._state_time.sum()
+        sys_time = [float(self._state_time[i << 6:(i + 1) << 6].sum()) for i in range(4)]
+        result['calibration'] = {
+            'full_fraction': float(self._state_time[0xFF] / total) if total else None,
+            'sys_seconds': sys_time, 'unknown_seconds': float(self._state_time[UNKNOWN]),
+            'sys3_after_s': self.first_sys3, 'full_after_s': self.first_full,
+            'changes': self.changes, 'timeline': self.timeline}
+        return result
+
+
+def analyze(path, chunk=CHUNK, source=None):
+    """
+    Statistics of every source of a session log (or only source, an index
+    or name), read chunk by chunk
+    """
+    t_start = time.perf_counter()
+    log = SessionLog(path)
+    names = log.sources or ['(unnamed)']
+    if source is not None and not isinstance(source, int):
+        if source not in names:
+            raise ValueError(f"{path} has no source {source!r}, only {', '.join(names)}")
+        source = names.index(source)
+    clusters = cluster_sizes(chunk)
+    stats = {}
+    for records in log.chunks(chunk):
+        ids = records['source']
+        if ids[0] == ids[-1] and not np.any(ids != ids[0]):  # usually a single board
+            groups = [(int(ids[0]), records)]
+        else:
+            groups = [(int(i), records[ids == i]) for i in np.unique(ids)]
+        for index, group in groups:
+            if source is not None and index != source:
+                continue
+            if index not in stats:
+                stats[index] = SourceStats(names[index] if index < len(names) else str(index), clusters)
+            stats[index].update(group, log.useQuat)
+    result = {'path': path, 'samples': len(log), 'duration_s': log.duration, 'useQuat': log.useQuat,
+              'started': log.header['started'], 'bytes': os.path.getsize(path),
+              'sources': [stats[index].result() for index in sorted(stats)],
+              'seconds': time.perf_counter() - t_start}
+    log.close()
+    return result
+
+
+def since(t):
+    return "never" if t is None else f"after {t:.1f} s"
+
+
+def calibration_text(cal):
+    return "unknown" if cal is None else "sys %d gyro %d accel %d mag %d" % tuple(cal)
+
+
+def report(result, timeline=10):
+    mode = "quaternion" if result['useQuat'] else "yaw, pitch, roll"
+    print(f"{result['path']}: {result['samples']} samples, {result['duration_s']:.1f} s, {mode}"
+          f" (analysed in {result['seconds']:.2f} s)")
+    for s in result['sources']:
+        rate = f"{s['rate_hz']:.1f} Hz" if s['rate_hz'] else "rate unknown"
+        gaps = s['gaps']
+        print(f"  {s['name']}: {s['samples']} samples over {s['duration_s']:.1f} s, {rate}, {gaps['count']} gaps"
+              f" ({gaps['seconds']:.2f} s, about {gaps['missing_samples']} samples lost, longest {gaps['longest_s']:.2f} s)"
+              f", {s['restarts']} device restarts")
+        for start, seconds in gaps['first'][:timeline]:
+            print(f"    gap at {start:10.2f} s for {seconds:.3f} s")
+        if 'drift_deg_per_min' in s:
+            print("    drift     " + "  ".join("%s %+9.4f" % (axis, s['drift_deg_per_min'][axis]) for axis in AXES)
+                  + " deg/min")
+            print("    residual  " + "  ".join("%s %9.4f" % (axis, s['residual_rms_deg'][axis]) for axis in AXES)
+                  + " deg rms about the drift")
+        if 'noise_deg' in s:
+            print("    noise     " + "  ".join("%s %9.4f" % (axis, s['noise_deg'][axis]) for axis in AXES)
+                  + " deg sample to sample")
+        if s.get('allan_deg_per_s'):
+            print("    Allan deviation, deg/s:   tau s " + "".join("%12s" % axis for axis in AXES))
+            for row in s['allan_deg_per_s']:
+                print(f"    {'':<22}{row['tau_s']:10.3f}" + "".join("%12.3g" % row[axis] for axis in AXES))
+            print(f"    {'bias instability':<32}" + "".join("%12.3g" % s['bias_instability_deg_per_s'][axis]
+                                                          for axis in AXES))
+        cal = s['calibration']
+        if cal['full_fraction'] is not None:
+            print(f"    calibration: fully calibrated {100.0 * cal['full_fraction']:.1f}% of the time, sys 3"
+                  f" {since(cal['sys3_after_s'])}, all 3 {since(cal['full_after_s'])}, {cal['changes']} changes")
+            for t, state in cal['timeline'][:timeline]:
+                print(f"    {t:10.2f} s  {calibration_text(state)}")
+            if cal['changes'] > timeline:
+                print(f"    ... {cal['changes'] - timeline} more in --json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drift, noise, Allan deviation, gaps and calibration of session logs")
+    parser.add_argument('path', nargs='+', help="session log files")
+    parser.add_argument('--chunk', type=int, default=CHUNK, help=f"records per chunk (default {CHUNK})")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help="files analysed in parallel (default: one per CPU)")
+    parser.add_argument('--source', help="only this source, index or name")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args()
+    source = int(args.source) if args.source is not None and args.source.isdigit() else args.source
+    t_start = time.perf_counter()
+    jobs = max(1, min(args.jobs, len(args.path)))
+    try:
+        if jobs == 1:
+            results = list(map(analyze, args.path, repeat(args.chunk), repeat(source)))
+        else:
+            with ProcessPoolExecutor(jobs) as pool:
+                results = list(pool.map(analyze, args.path, repeat(args.chunk), repeat(source)))
+    except (OSError, ValueError) as e:  # missing file, not a session log, unknown source
+        parser.error(str(e))
+    for result in results:
+        report(result)
+    total = sum(result['bytes'] for result in results)
+    seconds = time.perf_counter() - t_start
+    print(f"{len(results)} files, {total / 1e6:.1f} MB in {seconds:.2f} s ({total / 1e6 / seconds:.0f} MB/s)")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'analysis': 'pyteapotplus', 'version': 1, 'results': results}, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
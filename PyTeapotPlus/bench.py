@@ -0,0 +1,464 @@
+"""
+Headless end-to-end benchmark for PyTeapotPlus.
+
+Runs simdevice.py in a separate process, either on a pseudo-terminal with
+the firmware's exact serial output (calibration lines included) or as UDP
+datagrams on the loopback interface. The real ingest, parse and convert
+pipeline and the viewer's own drawing code then run against it for a fixed
+time. Without a display the frames are rendered offscreen on an EGL pbuffer
+(Mesa renders them in software if there is no GPU).
+
+Each run reports samples/s, frames/s, sensor to photon latency percentiles,
+per-stage timings and the CPU time the viewer process spent per sample. Use
+--json to keep the results, and compare two result files to spot
+regressions between commits:
+
+    python bench.py suite --json before.json
+    python bench.py run --transport udp --binary --sensors 8 --rate 100 --duration 10
+    python bench.py startup
+    python bench.py compare before.json after.json
+
+The suite also times the imports of the viewers in fresh interpreters
+(startup), and 'startup' on its own fails when importing cli.py, which
+checks the options before pygame and OpenGL load, exceeds STARTUP_BUDGET or
+pulls in one of the HEAVY packages, or when one of the LIBRARIES the tools
+share exceeds LIBRARY_BUDGET or pulls in more than numpy.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+UDP_PORT = 5599  # loopback port of the simulated boards
+WARMUP = 1.0  # seconds run before measuring
+FPS = 60  # frame rate cap like the viewers' FPS_LIMIT, 0 renders as fast as possible
+THRESHOLD = 10.0  # percent a metric may get worse before compare() calls it a regression
+SUITE = (
+    dict(transport='serial', rate=100.0),
+    dict(transport='serial', rate=100.0, binary=True),
+    dict(transport='udp', rate=100.0),
+    dict(transport='udp', rate=100.0, binary=True, batch=10),
+    dict(transport='udp', rate=100.0, binary=True, sensors=8),
+    dict(transport='udp', rate=100.0, binary=True, fps=0),
+    dict(transport='udp', rate=200.0, binary=True, render='none'),
+)
+# compared metrics, True where higher is better
+COMPARED = (('samples_per_s', True), ('frames_per_s', True), ('latency_ms.p50', False),
+            ('latency_ms.p99', False), ('cpu_us_per_sample', False))
+STARTUP = ('cli', 'quat', 'frameparser', 'ingest', 'session', 'pyteapotplus', 'pyteapot_3dm')  # modules timed by startup()
+STARTUP_REPEAT = 5  # fresh interpreters per module, the fastest counts
+STARTUP_BUDGET = 100.0  # ms the import of cli may take, it parses the options before anything heavy loads
+LIBRARIES = ('quat', 'frameparser')  # modules of the offline tools, they may load numpy and nothing else HEAVY
+LIBRARY_BUDGET = 200.0  # ms the import of each of LIBRARIES may take, numpy's own (most of it) included
+HEAVY = ('pygame', 'OpenGL', 'numpy', 'pywavefront', 'serial')  # packages cli must not import
+
+
+def has_display():
+    return sys.platform in ('win32', 'darwin') or bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
+
+class Renderer:
+    """
+    The drawing code of pyteapotplus.py (render='board') or pyteapot_3dm.py
+    (render='model') on a hidden window or an EGL pbuffer. render='none'
+    skips drawing but still converts the samples every frame.
+    """
+    def __init__(self, render='board', gl='auto', size=(640, 480), obj=None):
+        self.render = render
+        self.size = size
+        if gl == 'auto':
+            gl = 'window' if has_display() else 'egl'
+        self.gl = gl if render != 'none' else 'none'
+        if self.gl == 'egl':
+            os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+            os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+            os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+        import pygame
+        self.pygame = pygame
+        if render == 'model':
+            import pyteapot_3dm as viewer
+            if obj:
+                viewer.OBJ_FILE = obj
+        else:
+            import pyteapotplus as viewer
+        self.viewer = viewer
+        self.scene = ()
+        self.gl_renderer = None
+        pygame.init()
+        if self.gl == 'none':
+            return
+        if self.gl == 'egl':
+            from offscreen import egl_context
+            egl_context(*size)
+        else:
+            pygame.display.set_mode(size, pygame.OPENGL | pygame.DOUBLEBUF | pygame.HIDDEN)
+        from OpenGL.GL import GL_RENDERER, glGetString
+        self.gl_renderer = glGetString(GL_RENDERER).decode('utf-8', 'replace')
+        viewer.resizewin(*size)
+        scene = viewer.init()
+        self.scene = (scene,) if render == 'model' else ()
+
+    def configure(self, useQuat, smoothing, metrics):
+        viewer = self.viewer
+        viewer.useQuat = useQuat
+        viewer.SMOOTHING = smoothing
+        viewer.metrics = metrics
+        viewer.smoothers.clear()
+
+    def frame(self, sensors, metrics):
+        """
+        Converts and draws one frame of the (key, slot) sensors
+        """
+        viewer = self.viewer
+        viewer.shown.clear()
+        with metrics.timer('convert'):
+            poses = [viewer.smoothed(key, slot.get()) for key, slot in sensors]
+        if self.gl != 'none':
+            with metrics.timer('draw'):
+                if len(sensors) > 1:
+                    streams = [stream for stream, slot in sensors]
+                    viewer.draw_sensors(*self.scene, streams, poses, *self.size)
+                else:
+                    values = poses[0] or ((1, 0, 0, 0) if viewer.useQuat else (0, 0, 0))
+                    if viewer.useQuat:
+                        viewer.draw(*self.scene, *values)
+                    else:
+                        viewer.draw(*self.scene, 1, *values)
+            with metrics.timer('flip'):
+                if self.gl == 'egl':
+                    from OpenGL.GL import glFinish
+                    glFinish()
+                else:
+                    self.pygame.display.flip()
+        metrics.frame_shown(time.monotonic(), viewer.shown.values())
+
+    def close(self):
+        self.pygame.quit()
+
+
+def start_device(transport, rate, binary, useQuat, batch, sensors, port):
+    """
+    Starts simdevice.py in its own process, so its CPU time is not counted;
+    returns the process and the serial port it opened (None for UDP)
+    """
+    command = [sys.executable, '-u', os.path.join(HERE, 'simdevice.py'), '--rate', str(rate)]
+    if binary:
+        command.append('--binary')
+    if not useQuat:
+        command.append('--euler')
+    if transport == 'serial':
+        if not hasattr(os, 'openpty'):
+            raise RuntimeError("The serial benchmark needs pseudo-terminals (Linux or macOS)")
+        command.append('--pty')
+    else:
+        command += ['--udp', f"127.0.0.1:{port}", '--batch', str(batch), '--sensors', str(sensors)]
+    device = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = device.stdout.readline()
+    if transport == 'serial':
+        if ':' not in line:
+            device.kill()
+            raise RuntimeError(f"simdevice.py did not report its port: {line!r}")
+        return device, line.rsplit(':', 1)[1].strip()
+    return device, None
+
+
+def run_name(config):
+    name = [config['transport'], 'binary' if config['binary'] else 'text', 'quat' if config['useQuat'] else 'euler',
+            "%gHz" % config['rate']]
+    if config['batch'] > 1:
+        name.append("batch%d" % config['batch'])
+    if config['sensors'] > 1:
+        name.append("x%d" % config['sensors'])
+    name.append(config['render'])
+    name.append("%gfps" % config['fps'] if config['fps'] else 'maxfps')
+    return '-'.join(name)
+
+
+def run(renderer, transport='udp', rate=100.0, binary=False, useQuat=True, batch=1, sensors=1,
+        smoothing='interpolate', duration=10.0, fps=FPS, port=UDP_PORT):
+    """
+    One benchmark run against a fresh simulated device, returns the result dict
+    """
+    from fanin import FanInReceiver
+    from ingest import IngestWorker, LatestSlot, SerialSource, UdpSource
+    from metrics import Metrics
+
+    if sensors > 1 and transport != 'udp':
+        raise ValueError("Several sensors need the UDP transport")
+    config = dict(transport=transport, rate=rate, binary=binary, useQuat=useQuat, batch=batch, sensors=sensors,
+                  smoothing=smoothing, render=renderer.render, duration=duration, fps=fps)
+    metrics = Metrics()
+    renderer.configure(useQuat, smoothing, metrics)
+    device, serial_port = start_device(transport, rate, binary, useQuat, batch, sensors, port)
+    try:
+        if sensors > 1:
+            worker = FanInReceiver('127.0.0.1', port, useQuat, binary=binary, metrics=metrics)
+            metrics.sensors = worker.sensors
+            current = lambda: [(stream, stream.slot) for stream in worker.sensors()]
+        else:
+            slot = LatestSlot()
+            if transport == 'serial':
+                source = SerialSource(serial_port, 115200, useQuat, binary=binary, metrics=metrics)
+            else:
+                source = UdpSource('127.0.0.1', port, useQuat, binary=binary, metrics=metrics)
+            worker = IngestWorker(source, slot)
+            metrics.sensors = lambda: (worker,)
+            current = lambda: [(None, slot)]
+        worker.start()
+        _frames(renderer, current, metrics, WARMUP, fps)
+        for histogram in metrics.histograms.values():
+            histogram.reset()
+        received = sum(s.received for s in metrics.sensors())
+        frames = metrics.frames
+        cpu = time.process_time()
+        start = time.perf_counter()
+        _frames(renderer, current, metrics, duration, fps)
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu
+        received = sum(s.received for s in metrics.sensors()) - received
+        frames = metrics.frames - frames
+        worker.stop()
+        worker.join()
+        if sensors == 1:
+            source.close()
+    finally:
+        device.terminate()
+        device.wait()
+
+    latency = metrics['latency']
+    return {
+        'name': run_name(config),
+        'config': config,
+        'elapsed': elapsed,
+        'samples': received,
+        'samples_per_s': received / elapsed,
+        'expected_per_s': rate * sensors,
+        'dropped': sum(s.dropped for s in metrics.sensors()),
+        'parse_errors': sum(s.parse_errors for s in metrics.sensors()),
+        'frames': frames,
+        'frames_per_s': frames / elapsed,
+        'cpu_percent': 100.0 * cpu / elapsed,
+        'cpu_us_per_sample': 1e6 * cpu / received if received else None,
+        'cpu_us_per_frame': 1e6 * cpu / frames if frames else None,
+        'latency_basis': 'device' if binary else 'receive',
+        'latency_ms': {'p50': latency.percentile(50) * 1e3, 'p99': latency.percentile(99) * 1e3,
+                       'max': latency.max * 1e3},
+        'stages_ms': {name: {'p50': h.percentile(50) * 1e3, 'p99': h.percentile(99) * 1e3, 'count': h.count}
+                      for name, h in metrics.histograms.items() if h.count and name != 'latency'},
+    }
+
+
+def _frames(renderer, current, metrics, duration, fps):
+    end = time.perf_counter() + duration
+    period = 1.0 / fps if fps else 0.0
+    deadline = time.perf_counter()
+    while time.perf_counter() < end:
+        sensors = current()
+        if sensors:
+            renderer.frame(sensors, metrics)
+        else:
+            time.sleep(0.001)
+        if period:
+            deadline += period
+            time.sleep(max(0.0, deadline - time.perf_counter()))
+
+
+def import_time(module, repeat=STARTUP_REPEAT):
+    """
+    Fastest cumulative import time of module in ms over repeat fresh
+    interpreters, and the HEAVY packages importing it loaded
+    """
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=HERE,
+                              capture_output=True, text=True, timeout=60)
+        if proc.returncode:
+            raise RuntimeError(f"import {module} failed: {proc.stderr.strip().splitlines()[-1]}")
+        loaded = {}
+        for line in proc.stderr.splitlines():
+            fields = line[len('import time:'):].split('|')
+            if line.startswith('import time:') and len(fields) == 3 and fields[1].strip().isdigit():
+                loaded[fields[2].strip()] = int(fields[1]) / 1000.0
+        best = loaded[module] if best is None else min(best, loaded[module])
+    return best, sorted({name.split('.')[0] for name in loaded} & set(HEAVY))
+
+
+def startup(repeat=STARTUP_REPEAT):
+    """
+    Import times of the STARTUP modules, the cost of starting a viewer before
+    its window opens
+    """
+    result = {'name': 'startup', 'import_ms': {}, 'heavy': {}}
+    for module in STARTUP:
+        result['import_ms'][module], result['heavy'][module] = import_time(module, repeat)
+    return result
+
+
+def startup_problems(result, budget=STARTUP_BUDGET, library_budget=LIBRARY_BUDGET):
+    """
+    Why the startup result breaks the rules for cli and LIBRARIES, empty if
+    it does not
+    """
+    problems = []
+    rules = [('cli', budget, ())] + [(module, library_budget, ('numpy',)) for module in LIBRARIES]
+    for module, limit, allowed in rules:
+        ms = result['import_ms'][module]
+        if ms > limit:
+            problems.append(f"import {module} took {ms:.1f} ms, the budget is {limit:g} ms")
+        heavy = [name for name in result['heavy'][module] if name not in allowed]
+        if heavy:
+            problems.append(f"import {module} loads {', '.join(heavy)}")
+    return problems
+
+
+def environment(renderer=None):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'gl': renderer and renderer.gl,
+        'gl_renderer': renderer and renderer.gl_renderer,
+    }
+
+
+def report(result):
+    if result['name'] == 'startup':
+        for module, ms in result['import_ms'].items():
+            print(f"import {module:<34} {ms:8.1f} ms  {', '.join(result['heavy'][module])}")
+        return
+    latency = result['latency_ms']
+    stages = "  ".join("%s %.2f/%.2f" % (name, s['p50'], s['p99']) for name, s in result['stages_ms'].items())
+    print(f"{result['name']:<40} {result['samples_per_s']:8.1f} samples/s ({result['expected_per_s']:g})"
+          f" {result['frames_per_s']:7.1f} fps  latency p50 {latency['p50']:6.1f} p99 {latency['p99']:6.1f} ms"
+          f"  CPU {result['cpu_percent']:5.1f}% {result['cpu_us_per_sample'] or 0:7.1f} us/sample")
+    print(f"{'':<40} stages p50/p99 ms: {stages}  lost {result['dropped']}  parse errors {result['parse_errors']}")
+
+
+def _get(result, path):
+    for key in path.split('.'):
+        result = result.get(key) if isinstance(result, dict) else None
+    return result
+
+
+def compare(base_path, new_path, threshold=THRESHOLD):
+    """
+    Prints the change of the key metrics of every run present in both files,
+    returns the number of regressions beyond threshold percent
+    """
+    with open(base_path) as f:
+        base = {r['name']: r for r in json.load(f)['runs']}
+    with open(new_path) as f:
+        new = json.load(f)['runs']
+    regressions = 0
+    for result in new:
+        old = base.get(result['name'])
+        if old is None:
+            print(f"{result['name']}: not in {base_path}")
+            continue
+        print(result['name'])
+        compared = COMPARED + tuple(('import_ms.' + module, False) for module in result.get('import_ms', ()))
+        for path, higher_is_better in compared:
+            a, b = _get(old, path), _get(result, path)
+            if not a or b is None:
+                continue
+            change = 100.0 * (b - a) / a
+            worse = -change if higher_is_better else change
+            flag = "  REGRESSION" if worse > threshold else ""
+            regressions += bool(flag)
+            print(f"  {path:<20} {a:10.2f} -> {b:10.2f}  {change:+7.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PyTeapotPlus headless benchmark")
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name in ('run', 'suite'):
+        p = sub.add_parser(name)
+        p.add_argument('--duration', type=float, default=10.0, help="measured seconds per run (default 10)")
+        p.add_argument('--gl', choices=['auto', 'window', 'egl'], default='auto',
+                       help="hidden window or EGL pbuffer (default: window if there is a display)")
+        p.add_argument('--obj', help="OBJ file for --render model")
+        p.add_argument('--fps', type=float, default=FPS, help="frame rate cap, 0 renders as fast as possible (default %d)" % FPS)
+        p.add_argument('--port', type=int, default=UDP_PORT, help="loopback UDP port (default %d)" % UDP_PORT)
+        p.add_argument('--json', help="write the results to this file")
+        if name == 'run':
+            p.add_argument('--transport', choices=['serial', 'udp'], default='udp')
+            p.add_argument('--rate', type=float, default=100.0, help="samples per second per sensor (default 100)")
+            p.add_argument('--binary', action='store_true', help="binary wire protocol")
+            p.add_argument('--euler', action='store_true', help="yaw, pitch, roll instead of quaternions")
+            p.add_argument('--batch', type=int, default=1, help="samples per UDP datagram, needs --binary")
+            p.add_argument('--sensors', type=int, default=1, help="simulated boards, UDP only")
+            p.add_argument('--render', choices=['board', 'model', 'none'], default='board')
+            p.add_argument('--smoothing', choices=['none', 'interpolate', 'extrapolate'], default='interpolate')
+    p = sub.add_parser('startup')
+    p.add_argument('--repeat', type=int, default=STARTUP_REPEAT, help="fresh interpreters per module (default %d)" % STARTUP_REPEAT)
+    p.add_argument('--budget', type=float, default=STARTUP_BUDGET, help="ms import cli may take (default %g)" % STARTUP_BUDGET)
+    p.add_argument('--library-budget', type=float, default=LIBRARY_BUDGET,
+                   help="ms the import of %s may take each (default %g)" % (' and '.join(LIBRARIES), LIBRARY_BUDGET))
+    p.add_argument('--json', help="write the results to this file")
+    p = sub.add_parser('compare')
+    p.add_argument('base', help="results of the reference commit")
+    p.add_argument('new', help="results to check")
+    p.add_argument('--threshold', type=float, default=THRESHOLD, help="regression threshold in percent")
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        sys.exit(1 if compare(args.base, args.new, args.threshold) else 0)
+    if args.command == 'startup':
+        result = startup(args.repeat)
+        report(result)
+        problems = startup_problems(result, args.budget, args.library_budget)
+        for problem in problems:
+            print("STARTUP REGRESSION: " + problem)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'bench': 'pyteapotplus', 'version': 1, 'environment': environment(), 'runs': [result]}, f,
+                          indent=2)
+            print(f"Results written to {args.json}")
+        sys.exit(1 if problems else 0)
+    if args.command == 'run':
+        runs = [dict(transport=args.transport, rate=args.rate, binary=args.binary, useQuat=not args.euler,
+                     batch=args.batch, sensors=args.sensors, render=args.render,
+                     smoothing=None if args.smoothing == 'none' else args.smoothing)]
+    else:
+        runs = [dict(run) for run in SUITE]
+        if not hasattr(os, 'openpty'):
+            runs = [run for run in runs if run['transport'] != 'serial']
+    renderers = {}
+    results = []
+    if args.command == 'suite':
+        results.append(startup())
+        report(results[-1])
+    for config in runs:
+        render = config.pop('render', 'board')
+        config.setdefault('fps', args.fps)
+        if render not in renderers:
+            renderers[render] = Renderer(render, args.gl, obj=args.obj)
+        result = run(renderers[render], duration=args.duration, port=args.port, **config)
+        report(result)
+        results.append(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'bench': 'pyteapotplus', 'version': 1, 'environment': environment(next(iter(renderers.values()))),
+                       'runs': results}, f, indent=2)
+        print(f"Results written to {args.json}")
+    for renderer in renderers.values():
+        renderer.close()
+
+
+if __name__ == '__main__':
+    main()
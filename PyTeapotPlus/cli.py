@@ -0,0 +1,235 @@
+"""
+Command line and config file options for the PyTeapotPlus viewers.
+
+Every name in a viewer's "User Configurations" block can be set without
+editing the script: from a JSON config file, with --set NAME=VALUE, or with
+the shortcuts below. Options are checked against the block before pygame,
+OpenGL or the transport are imported, so a mistyped port or name fails
+right away and tools that only want the parser start quickly.
+
+    python PyTeapotPlus cube --serial /dev/ttyUSB0
+    python PyTeapotPlus model --udp 0.0.0.0:5555 --binary --obj car.obj
+    python PyTeapotPlus cube --config desk.json --set FPS_LIMIT=30
+    python PyTeapotPlus model --config desk.json --print-config > desk.json
+    python pyteapotplus.py --replay session.ptrec       # the viewers take the same options
+
+A config file is a JSON object of configuration names and values, e.g.
+{"SERIAL_PORT": "/dev/ttyUSB0", "useQuat": false}. Command line options
+override it. Relative paths of files shipped with the viewers, such as the
+model, are looked up in the current directory first, then next to the
+scripts (package_path()).
+"""
+
+import argparse
+import ast
+import importlib
+import json
+import logging
+import os
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VIEWERS = {'cube': 'pyteapotplus', 'model': 'pyteapot_3dm'}  # command line name -> module
+BLOCK_START = '# User Configurations\n'
+BLOCK_END = '# User Configurations ends here'
+TRANSPORTS = ('REPLAY_FILE', 'BUS_NAME', 'RELAY_ADDRESS')  # cleared when the command line picks another transport
+OPTIONAL = {'RECORD_FILE': str, 'REPLAY_FILE': str, 'BUS_NAME': str, 'RELAY_ADDRESS': str, 'METRICS_FILE': str,
+            'SMOOTHING_DELAY': float, 'METRICS_PORT': int, 'FORCE_LOD': int}  # type of the names that default to None, str if not listed
+CHOICES = {'SMOOTHING': (None, 'interpolate', 'extrapolate')}  # the only values these names take
+RANGES = {'FPS_LIMIT': (0, None), 'REPLAY_SPEED': (0, None), 'SMOOTHING_DELAY': (0, None), 'SERIAL_BAUD': (1, None),
+          'UDP_PORT': (0, 65535), 'METRICS_PORT': (0, 65535), 'FORCE_LOD': (0, None), 'BUS_SENSOR': (0, None),
+          'DISPLAY_SIZE': (1, None), 'COLOR': (0, 1)}  # lowest and highest value, of every item of a tuple
+
+
+def package_path(path):
+    """
+    path itself if it is absolute or exists from the current directory,
+    otherwise the same path next to the PyTeapotPlus scripts
+    """
+    if os.path.isabs(path) or os.path.exists(path):
+        return path
+    return os.path.join(HERE, path)
+
+
+def defaults(module):
+    """
+    Names and values of the User Configurations block of a viewer module,
+    read from its source without importing it
+    """
+    with open(os.path.join(HERE, module + '.py'), encoding='utf-8') as f:
+        source = f.read()
+    start = source.index(BLOCK_START)
+    block = source[start:source.index(BLOCK_END, start)]
+    config = {}
+    for node in ast.parse(block).body:
+        if isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name):
+            config[node.targets[0].id] = ast.literal_eval(node.value)
+    return config
+
+
+def coerce(name, value, default):
+    """
+    value converted to the type of default, or of OPTIONAL when the default
+    is None, and checked against CHOICES, RANGES and, for LOG_LEVEL, the
+    logging level names; ValueError if it does not fit. None passes unless
+    one of those checks rules it out.
+    """
+    value = _coerce_type(name, value, default)
+    if name in CHOICES and value not in CHOICES[name]:
+        raise ValueError(f"{name} should be one of {', '.join(map(repr, CHOICES[name]))}, not {value!r}")
+    if name == 'LOG_LEVEL' and not (isinstance(value, str) and isinstance(logging.getLevelName(value.upper()), int)):
+        raise ValueError(f"{name} should be a logging level such as 'INFO' or 'DEBUG', not {value!r}")
+    if name in RANGES and value is not None:
+        low, high = RANGES[name]
+        for item in value if isinstance(value, tuple) else (value,):
+            numeric = isinstance(item, (int, float)) and not isinstance(item, bool)
+            if not (numeric and low <= item and (high is None or item <= high)):  # NaN fails too
+                bounds = f"from {low} to {high}" if high is not None else f"at least {low}"
+                raise ValueError(f"{name} should be {bounds}, not {value!r}")
+    return value
+
+
+def _coerce_type(name, value, default):
+    if value is None:
+        return value
+    if default is None:
+        kind = OPTIONAL.get(name, str)
+        if isinstance(value, kind) and not isinstance(value, bool):
+            return value
+        if kind is float and isinstance(value, int) and not isinstance(value, bool):
+            return float(value)
+        raise ValueError(f"{name} should be None or {kind.__name__}, not {value!r}")
+    if isinstance(default, bool):
+        if isinstance(value, bool):
+            return value
+    elif isinstance(default, (int, float)):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value) if isinstance(default, float) else value
+    elif isinstance(default, tuple):
+        if isinstance(value, (list, tuple)) and len(value) == len(default):
+            return tuple(value)
+    elif isinstance(value, type(default)):
+        return value
+    raise ValueError(f"{name} should be like {default!r}, not {value!r}")
+
+
+def literal(text):
+    """
+    A --set value: a Python literal such as 30, False, None or (0, 0, 0), or
+    else the text itself
+    """
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def add_options(parser, viewer=None):
+    """
+    Adds the viewer options to parser; the model options only for 'model' or
+    when the viewer is chosen on the command line (viewer None)
+    """
+    parser.add_argument('--config', metavar='FILE', help="JSON file of configuration names and values")
+    parser.add_argument('--set', metavar='NAME=VALUE', action='append', default=[],
+                        help="any name of the User Configurations block, e.g. --set FPS_LIMIT=30")
+    parser.add_argument('--print-config', action='store_true', help="print the resulting configuration as JSON and exit")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--serial', metavar='PORT', help="serial port of the board, e.g. COM19 or /dev/ttyUSB0")
+    group.add_argument('--udp', metavar='[IP:]PORT', help="receive the board's datagrams on this address")
+    group.add_argument('--replay', metavar='FILE', help="play back a recorded session")
+    group.add_argument('--bus', metavar='NAME', help="follow a running 'shmbus.py publish'")
+    group.add_argument('--relay', metavar='ADDRESS', help="follow a running 'relay.py', host:port or socket path")
+    parser.add_argument('--baud', type=int, help="serial baud rate")
+    parser.add_argument('--binary', action='store_true', default=None, help="binary wire protocol")
+    angles = parser.add_mutually_exclusive_group()
+    angles.add_argument('--euler', dest='useQuat', action='store_false', default=None,
+                        help="yaw, pitch, roll instead of quaternions")
+    angles.add_argument('--quat', dest='useQuat', action='store_true', help="quaternions")
+    parser.add_argument('--multi', action='store_true', default=None, help="every board sending to the UDP port side by side")
+    parser.add_argument('--reference', metavar=('YAW', 'PITCH', 'ROLL'), type=float, nargs=3,
+                        help="sensor pose that reads as level, heading 0 (REFERENCE_YPR)")
+    parser.add_argument('--record', metavar='FILE', help="record every received sample")
+    parser.add_argument('--fps', type=float, help="frame rate cap")
+    parser.add_argument('--hud', action='store_true', default=None, help="start with the HUD shown")
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    if viewer in (None, 'model'):
+        parser.add_argument('--obj', metavar='FILE', help="model to show (model viewer)")
+
+
+def overrides(args, config):
+    """
+    The configuration names args change, checked against config (the
+    defaults() of the viewer); raises ValueError on unknown names and values
+    that do not fit
+    """
+    changes = {}
+    if args.config:
+        with open(args.config, encoding='utf-8') as f:
+            changes.update(json.load(f))
+    for item in args.set:
+        name, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError(f"--set expects NAME=VALUE, not {item!r}")
+        changes[name.strip()] = literal(value.strip())
+    if args.serial or args.udp or args.replay or args.bus or args.relay:
+        changes.update(dict.fromkeys(TRANSPORTS))
+    if args.serial:
+        changes.update(useSerial=True, SERIAL_PORT=args.serial)
+    if args.udp:
+        ip, sep, port = args.udp.rpartition(':')
+        if not port.isdigit():
+            raise ValueError(f"--udp expects [IP:]PORT, not {args.udp!r}")
+        changes.update(useSerial=False, UDP_IP=ip if sep else "", UDP_PORT=int(port))
+    if args.replay:
+        changes['REPLAY_FILE'] = args.replay
+    if args.bus:
+        changes['BUS_NAME'] = args.bus
+    if args.relay:
+        changes['RELAY_ADDRESS'] = args.relay
+    shortcuts = {'SERIAL_BAUD': args.baud, 'useBinary': args.binary, 'useQuat': args.useQuat,
+                 'multiSensor': args.multi, 'REFERENCE_YPR': args.reference, 'RECORD_FILE': args.record,
+                 'FPS_LIMIT': args.fps, 'SHOW_HUD': args.hud, 'LOG_LEVEL': args.log_level,
+                 'OBJ_FILE': getattr(args, 'obj', None)}
+    changes.update((name, value) for name, value in shortcuts.items() if value is not None)
+    if args.multi and args.serial:
+        raise ValueError("--multi receives the boards over UDP, not from a serial port")
+    for name, value in changes.items():
+        if name not in config:
+            raise ValueError(f"Unknown configuration name {name!r} for this viewer")
+        changes[name] = coerce(name, value, config[name])
+    return changes
+
+
+def configure(module, changes):
+    """
+    Sets the configuration names of an imported viewer module
+    """
+    for name, value in changes.items():
+        setattr(module, name, value)
+
+
+def main(argv=None, viewer=None, module=None):
+    """
+    Parses argv and runs a viewer. viewer and module are given when a viewer
+    script runs itself; otherwise the viewer is the first argument and its
+    module is only imported once the options were checked.
+    """
+    parser = argparse.ArgumentParser(prog='pyteapotplus' if viewer is None else None,
+                                     description="PyTeapotPlus orientation viewer")
+    if viewer is None:
+        parser.add_argument('viewer', choices=sorted(VIEWERS), help="cube: the board, model: an OBJ model")
+    add_options(parser, viewer)
+    args = parser.parse_args(argv)
+    viewer = viewer or args.viewer
+    config = defaults(VIEWERS[viewer])
+    try:
+        changes = overrides(args, config)
+    except (OSError, ValueError) as e:  # json.JSONDecodeError is a ValueError
+        parser.error(str(e))
+    if args.print_config:
+        print(json.dumps({**config, **changes}, indent=2))
+        return
+    if module is None:
+        module = importlib.import_module(VIEWERS[viewer])  # pygame, OpenGL and the model loader load from here on
+    configure(module, changes)
+    module.main()
@@ -0,0 +1,219 @@
+"""
+Multi-sensor UDP ingest for PyTeapotPlus.
+
+Several ESP32 boards broadcast to the same UDP port. One asyncio datagram
+endpoint, run by a single background thread, receives all of them and sorts
+the datagrams by sender address into per-sensor streams, each with its own
+latest-value slot, sequence tracker and rate and loss counters. There is no
+thread or socket per sensor, so thousands of datagrams per second from any
+number of boards cost one recvfrom() and one decode each.
+
+    receiver = FanInReceiver("", 5555, useQuat=True, binary=True)
+    receiver.start()
+    for stream in receiver.sensors():
+        sample = stream.slot.get()
+
+Losses are only known with the binary wire protocol, which numbers the
+samples. Test without hardware with
+
+    python simdevice.py --udp 127.0.0.1:5555 --binary --sensors 8 --rate 100
+"""
+
+import asyncio
+import math
+import socket
+import threading
+import time
+
+from frameparser import FrameError
+from ingest import RATE_INTERVAL, LatestSlot, decode_udp
+from wire import SeqTracker
+
+
+RECV_BUFFER = 1 << 20  # socket receive buffer, absorbs bursts while the GIL is busy
+
+
+class SensorStream:
+    """
+    Samples and counters of one sensor, written by the receiver thread only
+    """
+    def __init__(self, key):
+        self.key = key
+        self.name = "%s:%d" % key if isinstance(key, tuple) else str(key)
+        self.slot = LatestSlot()
+        self.seq = SeqTracker()
+        self.received = 0  # samples
+        self.datagrams = 0
+        self.parse_errors = 0
+        self.calibration = None  # last status reported in a text datagram
+        self.timing = None  # last framer.DeviceTiming reported
+        self.rate = 0.0  # samples per second over the last RATE_INTERVAL
+        self.last_seen = None
+        self.source_id = None  # index in the session recorder
+        self._rate_count = 0
+        self._rate_time = None
+
+    @property
+    def dropped(self):
+        return self.seq.dropped
+
+    @property
+    def loss(self):
+        """
+        Fraction of samples lost in transit so far
+        """
+        total = self.received + self.seq.dropped
+        return self.seq.dropped / total if total else 0.0
+
+    def update_rate(self, now):
+        if self._rate_time is not None and now > self._rate_time:
+            self.rate = (self.received - self._rate_count) / (now - self._rate_time)
+        self._rate_count = self.received
+        self._rate_time = now
+
+
+class FanInProtocol(asyncio.DatagramProtocol):
+    """
+    Demultiplexes datagrams into SensorStreams by sender. by_host=True keys
+    sensors by IP address only, for boards whose source port changes when
+    they reboot. Samples also go to a session.Recorder if one is given, and
+    decode times to a metrics.Metrics. notify is called without arguments
+    after new samples were published.
+    """
+    def __init__(self, useQuat=True, binary=False, by_host=False, recorder=None, metrics=None, notify=None):
+        self.useQuat = useQuat
+        self.binary = binary
+        self.by_host = by_host
+        self.recorder = recorder
+        self.metrics = metrics
+        self.notify = notify
+        self.streams = {}
+        self.sensors = ()  # replaced, never mutated, so other threads can iterate it
+        self.errors = 0
+
+    def stream(self, key):
+        stream = self.streams.get(key)
+        if stream is None:
+            stream = self.streams[key] = SensorStream(key)
+            if self.recorder is not None:
+                stream.source_id = self.recorder.source_id(stream.name)
+            self.sensors = self.sensors + (stream,)
+        return stream
+
+    def datagram_received(self, data, addr):
+        t_recv = time.monotonic()
+        stream = self.stream(addr[0] if self.by_host else addr[:2])
+        stream.datagrams += 1
+        stream.last_seen = t_recv
+        t0 = time.perf_counter()
+        try:
+            readings = decode_udp(data, self.useQuat, self.binary, stream.seq, stream)
+        except FrameError:
+            stream.parse_errors += 1
+            return
+        finally:
+            if self.metrics is not None:
+                self.metrics['parse'].record(time.perf_counter() - t0)
+        for reading in readings:
+            stream.slot.publish(reading.values, t_recv, reading.t_device, reading.cal)
+            if self.recorder is not None:
+                self.recorder.write(reading.values, t_recv, reading.t_device, reading.cal, stream.source_id)
+        stream.received += len(readings)
+        if readings and self.notify is not None:
+            self.notify()
+
+    def error_received(self, exc):
+        self.errors += 1
+
+    def update_rates(self):
+        now = time.monotonic()
+        for stream in self.sensors:
+            stream.update_rate(now)
+
+
+def open_socket(ip, port, recv_buffer=RECV_BUFFER):
+    """
+    UDP socket bound to (ip, port) that also receives broadcasts; bind to ""
+    to hear every board on the network
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buffer)
+    except OSError:  # capped by the OS, the default still works
+        pass
+    sock.bind((ip, port))
+    sock.setblocking(False)
+    return sock
+
+
+class FanInReceiver(threading.Thread):
+    """
+    Daemon thread running the asyncio loop of a FanInProtocol until stopped
+    """
+    def __init__(self, ip, port, useQuat=True, binary=False, by_host=False, rate_interval=RATE_INTERVAL,
+                 recorder=None, metrics=None, notify=None):
+        super().__init__(name="pyteapot-fanin", daemon=True)
+        self.protocol = FanInProtocol(useQuat, binary, by_host, recorder, metrics, notify)
+        self.sock = open_socket(ip, port)
+        self.rate_interval = rate_interval
+        self._loop = None
+        self._stop_event = None
+        self._stopping = False  # stop() was called, possibly before the loop ran
+
+    def sensors(self):
+        """
+        SensorStreams in the order the sensors were first heard
+        """
+        return self.protocol.sensors
+
+    def run(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self._stop_event = asyncio.Event()
+        self._loop = asyncio.get_running_loop()  # after the event, stop() uses both once it sees the loop
+        if self._stopping:
+            self._stop_event.set()
+        transport, _ = await self._loop.create_datagram_endpoint(lambda: self.protocol, sock=self.sock)
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    await asyncio.wait_for(self._stop_event.wait(), self.rate_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.protocol.update_rates()
+        finally:
+            transport.close()
+
+    def stop(self):
+        """
+        Ends the loop; join() returns soon after, also when the thread had
+        not got as far as starting its loop
+        """
+        self._stopping = True
+        if not self.is_alive():
+            self.sock.close()
+            return
+        loop = self._loop
+        if loop is None:  # _serve() sees _stopping once it has its loop
+            return
+        try:
+            loop.call_soon_threadsafe(self._stop_event.set)
+        except RuntimeError:  # the loop already ended
+            pass
+
+
+def tile(count, width, height):
+    """
+    Splits a width x height window into count viewports (x, y, w, h) on a near
+    square grid, first one top left
+    """
+    if count < 1:
+        return []
+    cols = round(math.sqrt(count * width / height))
+    cols = max(1, min(cols, count))
+    rows = math.ceil(count / cols)
+    w, h = width // cols, height // rows
+    return [((i % cols) * w, height - (i // cols + 1) * h, w, h) for i in range(count)]
@@ -0,0 +1,112 @@
+"""
+Parser for the text frames sent by 'bno055_udp_miniC3.ino'.
+
+    quaternion:          b"w0.7071w a0.0000a b0.7071b c0.0000c t123456t "
+    yaw, pitch, roll:    b"y12.3456y p-1.2345p r0.5000r t123456t "
+
+The "t..t" field, the device millis() the sample was taken at, is optional;
+firmware before the deadline scheduled loop did not send it.
+
+A frame is decoded in one regular expression pass directly over the bytes,
+without decoding to str or splitting it first. Malformed frames raise
+FrameError instead of turning into a fake orientation. decode_log() converts a
+whole captured serial or UDP dump into an (N, 4) or (N, 3) array at once.
+"""
+
+import mmap
+import re
+
+import numpy as np
+
+
+class FrameError(ValueError):
+    """
+    Raised for a frame that does not match the expected layout
+    """
+
+
+_NUM = rb'[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?'
+
+
+def _frame_pattern(tags, group):
+    num = b'(' + _NUM + b')' if group else _NUM
+    return re.compile(rb'\s*'.join(bytes([t]) + num + bytes([t]) for t in tags))
+
+
+QUAT_TAGS = b'wabc'
+YPR_TAGS = b'ypr'
+_QUAT_FRAME = _frame_pattern(QUAT_TAGS, True)
+_YPR_FRAME = _frame_pattern(YPR_TAGS, True)
+_QUAT_SCAN = _frame_pattern(QUAT_TAGS, False)
+_YPR_SCAN = _frame_pattern(YPR_TAGS, False)
+_QUAT_BLANK = bytes.maketrans(QUAT_TAGS, b' ' * len(QUAT_TAGS))
+_YPR_BLANK = bytes.maketrans(YPR_TAGS, b' ' * len(YPR_TAGS))
+
+
+def parse_quat(frame):
+    """
+    Returns (w, x, y, z) from a quaternion frame
+    """
+    m = _QUAT_FRAME.search(frame)
+    if m is None:
+        raise FrameError(f"Malformed quaternion frame: {bytes(frame)!r}")
+    return (float(m[1]), float(m[2]), float(m[3]), float(m[4]))
+
+
+def parse_ypr(frame):
+    """
+    Returns (yaw, pitch, roll) in degrees from an Euler angles frame
+    """
+    m = _YPR_FRAME.search(frame)
+    if m is None:
+        raise FrameError(f"Malformed Euler angles frame: {bytes(frame)!r}")
+    return (float(m[1]), float(m[2]), float(m[3]))
+
+
+_MILLIS = re.compile(rb't([0-9]+)t')
+
+
+def parse_time(frame):
+    """
+    Device time in seconds of a frame's "t..t" field, None without one
+    """
+    m = _MILLIS.search(frame)
+    return int(m[1]) / 1000.0 if m is not None else None
+
+
+def parse_frame(frame, useQuat):
+    if(useQuat):
+        return parse_quat(frame)
+    return parse_ypr(frame)
+
+
+def decode_log(data, useQuat=True):
+    """
+    Decodes every well-formed frame in a captured serial or UDP dump.
+    data is any bytes-like object (bytes, bytearray, mmap); calibration lines,
+    banners and malformed frames are skipped. Returns a float64 array of shape
+    (N, 4) for quaternions or (N, 3) for yaw, pitch, roll.
+    """
+    if(useQuat):
+        scan, blank, width = _QUAT_SCAN, _QUAT_BLANK, 4
+    else:
+        scan, blank, width = _YPR_SCAN, _YPR_BLANK, 3
+    # The scan only accepts valid numbers between the tags, so once the tags are
+    # blanked out the joined frames are a plain whitespace separated float list.
+    text = b' '.join(scan.findall(data)).translate(blank)
+    if not text:
+        return np.empty((0, width))
+    return np.fromstring(text, sep=' ').reshape(-1, width)
+
+
+def decode_log_file(path, useQuat=True):
+    """
+    Memory-maps a capture file and decodes it with decode_log()
+    """
+    with open(path, 'rb') as f:
+        try:
+            view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return decode_log(b'', useQuat)
+        with view:
+            return decode_log(view, useQuat)
@@ -0,0 +1,113 @@
+"""
+Incremental line framer for the serial stream of 'bno055_udp_miniC3.ino'.
+
+The firmware interleaves status lines with the data frames
+("w..w a..a b..b c..c t..t " or "y..y p..p r..r t..t ", t being the device
+millis() of the sample): the calibration status when it changes or once a
+second ("\tSys:3 G:3 A:3 M:3", prefixed by "! " while uncalibrated), and its
+sampling loop timing every second ("\tRate:100.00 Jitter:12 Max:85 Missed:0").
+The framer pulls whatever bytes are waiting in one call, splits complete lines
+out of a reusable buffer, keeps the partial tail for the next read, hands data
+frames to the consumer and records the status lines instead of passing them on.
+"""
+
+from collections import namedtuple
+
+KEEP_ALL = 'all'  # hand every complete frame to the consumer
+KEEP_LATEST = 'latest'  # hand only the newest frame of each read to the consumer
+
+CAL_TAG = b'Sys:'
+TIMING_TAG = b'Rate:'
+FRAME_TAGS = b'wy'  # first byte of a quaternion or Euler angles frame
+
+DeviceTiming = namedtuple('DeviceTiming', ['rate', 'jitter', 'jitter_max', 'missed'])
+DeviceTiming.__doc__ = """
+Sampling loop timing reported by the firmware every TIMING_INTERVAL_MS: the
+achieved sample rate in Hz, the mean and maximum time samples were taken
+after their deadlines in microseconds, and the deadlines missed since boot
+"""
+
+
+def parse_calibration(line):
+    """
+    (sys, gyro, accel, mag) of a "Sys:3 G:3 A:3 M:3" line, digits are single
+    characters 0..3
+    """
+    i = line.find(CAL_TAG) + len(CAL_TAG)
+    return tuple(int(line[j:j + 1]) for j in (i, i + 4, i + 8, i + 12))
+
+
+def parse_timing(line):
+    """
+    DeviceTiming of a "Rate:100.00 Jitter:12 Max:85 Missed:0" line
+    """
+    fields = dict(bytes(item).split(b':', 1) for item in line[line.find(TIMING_TAG):].split())
+    return DeviceTiming(float(fields[b'Rate']), float(fields[b'Jitter']), float(fields[b'Max']),
+                        int(fields[b'Missed']))
+
+
+def update_status(status, line):
+    """
+    Records a calibration or timing line on status, anything with calibration
+    and timing attributes (a LineFramer, a UDP source or sensor stream).
+    False if line is neither, or malformed.
+    """
+    try:
+        if CAL_TAG in line:
+            status.calibration = parse_calibration(line)
+        elif TIMING_TAG in line:
+            status.timing = parse_timing(line)
+        else:
+            return False
+    except (ValueError, KeyError):
+        return False
+    return True
+
+
+class LineFramer:
+    """
+    Splits a byte stream into data frames without dropping any complete line
+    """
+    def __init__(self, policy=KEEP_ALL, max_line=256):
+        if policy not in (KEEP_ALL, KEEP_LATEST):
+            raise ValueError(f"Unknown framing policy: {policy!r}")
+        self.policy = policy
+        self.max_line = max_line
+        self.calibration = None  # last (sys, gyro, accel, mag) seen on the port
+        self.timing = None  # last DeviceTiming seen on the port
+        self.skipped = 0  # non-frame lines dropped so far (banner, setup text, ...)
+        self._buf = bytearray()
+
+    def feed(self, data):
+        """
+        Appends raw bytes and returns the list of complete data frames
+        """
+        buf = self._buf
+        buf += data
+        end = buf.rfind(b'\n')
+        if end < 0:
+            if len(buf) > self.max_line:  # no line break in sight, resynchronise
+                self.skipped += 1
+                buf.clear()
+            return []
+        frames = []
+        start = 0
+        while start <= end:
+            stop = buf.index(b'\n', start)
+            line = buf[start:stop].strip()
+            start = stop + 1
+            if line and line[0] in FRAME_TAGS:
+                frames.append(bytes(line))
+            elif line and not update_status(self, line):
+                self.skipped += 1
+        del buf[:end + 1]  # keep only the partial tail
+        if self.policy == KEEP_LATEST:
+            return frames[-1:]
+        return frames
+
+    def read_from(self, ser):
+        """
+        Reads everything waiting on a pyserial port in bulk and frames it.
+        When nothing is waiting, blocks for at most the port timeout on one byte.
+        """
+        return self.feed(ser.read(ser.in_waiting or 1))
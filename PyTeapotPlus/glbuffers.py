@@ -0,0 +1,200 @@
+"""
+Retained-mode geometry for the PyTeapotPlus viewers.
+
+Vertex data is built once as interleaved numpy arrays and uploaded into a
+vertex buffer object, so a frame draws it with a handful of GL calls instead
+of one Python call per vertex. Contexts without buffer objects (OpenGL < 1.5,
+some remote or software setups) get a display list compiled from the same
+arrays instead.
+"""
+
+import ctypes
+
+import numpy as np
+from OpenGL.GL import *
+
+from meshcache import VERTEX_COMPONENTS
+
+
+# glInterleavedArrays formats used here and their float count per vertex
+FORMAT_FLOATS = {
+    GL_V3F: 3,
+    GL_C3F_V3F: 6,
+    GL_N3F_V3F: 6,
+    GL_T2F_V3F: 5,
+    GL_T2F_N3F_V3F: 8,
+}
+
+
+def set_pointers(vertex_format, base):
+    """
+    Enables the client arrays of a pywavefront vertex format with base either
+    a numpy array or a buffer offset. Unlike glInterleavedArrays() this also
+    covers C3F_N3F_V3F and T2F_C3F_N3F_V3F.
+    """
+    components = vertex_format.split('_')
+    stride = 4 * sum(VERTEX_COMPONENTS[c] for c in components)
+    if not isinstance(base, ctypes.c_void_p):
+        base = ctypes.c_void_p(base.ctypes.data)
+    offset = 0
+    for component in components:
+        pointer = ctypes.c_void_p((base.value or 0) + offset)
+        if component == 'T2F':
+            glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+            glTexCoordPointer(2, GL_FLOAT, stride, pointer)
+        elif component == 'C3F':
+            glEnableClientState(GL_COLOR_ARRAY)
+            glColorPointer(3, GL_FLOAT, stride, pointer)
+        elif component == 'N3F':
+            glEnableClientState(GL_NORMAL_ARRAY)
+            glNormalPointer(GL_FLOAT, stride, pointer)
+        else:
+            glEnableClientState(GL_VERTEX_ARRAY)
+            glVertexPointer(3, GL_FLOAT, stride, pointer)
+        offset += 4 * VERTEX_COMPONENTS[component]
+
+
+def has_vbo():
+    """
+    True if the current context supports vertex buffer objects
+    """
+    try:
+        return bool(glGenBuffers)
+    except Exception:  # PyOpenGL raises NullFunctionError for missing entry points
+        return False
+
+
+class StaticMesh:
+    """
+    Interleaved geometry drawn as a few glDrawArrays ranges. Add every part with
+    add(), then call upload() once the GL context exists.
+    """
+    def __init__(self, fmt=GL_C3F_V3F, use_vbo=None):
+        self.fmt = fmt
+        self.use_vbo = use_vbo
+        self.parts = []  # (mode, first, count, line_width)
+        self._chunks = []
+        self._count = 0
+        self.vbo = None
+        self.display_list = None
+
+    def add(self, mode, vertices, line_width=None):
+        vertices = np.asarray(vertices, np.float32).reshape(-1, FORMAT_FLOATS[self.fmt])
+        self.parts.append((mode, self._count, len(vertices), line_width))
+        self._chunks.append(vertices)
+        self._count += len(vertices)
+
+    def upload(self):
+        data = np.ascontiguousarray(np.concatenate(self._chunks))
+        self._chunks = []
+        if self.use_vbo is None:
+            self.use_vbo = has_vbo()
+        if self.use_vbo:
+            self.vbo = glGenBuffers(1)
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+            glBufferData(GL_ARRAY_BUFFER, data.nbytes, data, GL_STATIC_DRAW)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+        else:
+            self.display_list = glGenLists(1)
+            glNewList(self.display_list, GL_COMPILE)
+            self._draw_parts(data)
+            glEndList()
+
+    def draw(self):
+        if self.vbo is None:
+            glCallList(self.display_list)
+            return
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        self._draw_parts(ctypes.c_void_p(0))
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def _draw_parts(self, pointer):
+        glPushClientAttrib(GL_CLIENT_VERTEX_ARRAY_BIT)
+        glInterleavedArrays(self.fmt, 0, pointer)
+        for mode, first, count, line_width in self.parts:
+            if line_width is not None:
+                glLineWidth(line_width)
+            glDrawArrays(mode, first, count)
+        glPopClientAttrib()
+
+    def delete(self):
+        if self.vbo is not None:
+            glDeleteBuffers(1, [self.vbo])
+            self.vbo = None
+        if self.display_list is not None:
+            glDeleteLists(self.display_list, 1)
+            self.display_list = None
+
+
+class IndexedMesh:
+    """
+    Indexed triangles in a vertex buffer and an index buffer (VBO/IBO pair), or
+    display lists where buffer objects are missing. ranges splits the indices
+    into (first, count) runs that can be drawn separately, e.g. one per
+    material, while the vertex pointers are set up only once with bind().
+    """
+    def __init__(self, vertex_format, vertices, indices, use_vbo=None, ranges=None):
+        self.vertex_format = vertex_format
+        self.count = len(indices)
+        self.ranges = list(ranges) if ranges is not None else [(0, self.count)]
+        self.vbo = self.ibo = self.display_list = None
+        vertices = np.ascontiguousarray(vertices, np.float32)
+        indices = np.ascontiguousarray(indices, np.uint32)
+        if use_vbo is None:
+            use_vbo = has_vbo()
+        if use_vbo:
+            self.vbo, self.ibo = glGenBuffers(2)
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+            glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ibo)
+            glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        else:
+            self.display_list = glGenLists(len(self.ranges))
+            for i, (first, count) in enumerate(self.ranges):
+                glNewList(self.display_list + i, GL_COMPILE)
+                glPushClientAttrib(GL_CLIENT_VERTEX_ARRAY_BIT)
+                set_pointers(vertex_format, vertices)
+                glDrawElements(GL_TRIANGLES, count, GL_UNSIGNED_INT, indices[first:first + count])
+                glPopClientAttrib()
+                glEndList()
+
+    def bind(self):
+        """
+        Sets up the vertex pointers, call before draw_range()
+        """
+        if self.display_list is not None:
+            return
+        glPushClientAttrib(GL_CLIENT_VERTEX_ARRAY_BIT)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ibo)
+        set_pointers(self.vertex_format, ctypes.c_void_p(0))
+
+    def unbind(self):
+        if self.display_list is not None:
+            return
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glPopClientAttrib()
+
+    def draw_range(self, i):
+        if self.display_list is not None:
+            glCallList(self.display_list + i)
+            return
+        first, count = self.ranges[i]
+        glDrawElements(GL_TRIANGLES, count, GL_UNSIGNED_INT, ctypes.c_void_p(4 * first))
+
+    def draw(self):
+        self.bind()
+        for i in range(len(self.ranges)):
+            self.draw_range(i)
+        self.unbind()
+
+    def delete(self):
+        if self.vbo is not None:
+            glDeleteBuffers(2, [self.vbo, self.ibo])
+            self.vbo = self.ibo = None
+        if self.display_list is not None:
+            glDeleteLists(self.display_list, len(self.ranges))
+            self.display_list = None
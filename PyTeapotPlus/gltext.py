@@ -0,0 +1,193 @@
+"""
+Cached text rendering for the PyTeapotPlus viewers.
+
+Fonts are loaded once per size. Static strings (titles, help text) are
+rendered by pygame once and kept as GL textures; changing strings (the yaw,
+pitch, roll readout) are laid out from a prebuilt glyph atlas as textured
+quads. Each string is compiled into a display list, so GL work is only redone
+when the string actually changes.
+
+Text is anchored like glRasterPos3d(): the 3D position is projected with the
+current matrices and the text is drawn in window pixels from there.
+"""
+
+import numpy as np
+import pygame
+from OpenGL.GL import *
+from OpenGL.GLU import *
+
+
+FONT_NAME = "Courier"
+FOREGROUND = (255, 255, 255, 255)
+BACKGROUND = (0, 0, 0, 255)
+ATLAS_CHARS = ''.join(chr(c) for c in range(32, 127))
+MAX_STATIC = 64  # cached static strings before the oldest ones are released
+
+
+def upload_texture(surface):
+    """
+    Uploads a pygame surface as an RGBA texture, returns the texture id
+    """
+    data = pygame.image.tobytes(surface, "RGBA", True)
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, texture)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, surface.get_width(), surface.get_height(), 0,
+                 GL_RGBA, GL_UNSIGNED_BYTE, data)
+    return texture
+
+
+def compile_quads(texture, vertices):
+    """
+    Compiles textured quads into a display list.
+    vertices is an (N, 4) float32 array of (s, t, x, y) rows, four per quad.
+    """
+    display_list = glGenLists(1)
+    glNewList(display_list, GL_COMPILE)
+    glBindTexture(GL_TEXTURE_2D, texture)
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+    glTexCoordPointer(2, GL_FLOAT, 0, np.ascontiguousarray(vertices[:, :2]))
+    glVertexPointer(2, GL_FLOAT, 0, np.ascontiguousarray(vertices[:, 2:]))
+    glDrawArrays(GL_QUADS, 0, len(vertices))
+    glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+    glEndList()
+    return display_list
+
+
+def quad(x, y, w, h, s0=0.0, s1=1.0):
+    return np.array([[s0, 0, x, y], [s1, 0, x + w, y], [s1, 1, x + w, y + h], [s0, 1, x, y + h]], np.float32)
+
+
+class GlyphAtlas:
+    """
+    One texture holding every printable ASCII glyph of a font in a row
+    """
+    def __init__(self, font):
+        glyphs = [font.render(ch, True, FOREGROUND, BACKGROUND) for ch in ATLAS_CHARS]
+        self.height = font.get_height()
+        self.advance = np.zeros(256, np.float32)
+        self.s0 = np.zeros(256, np.float32)
+        self.s1 = np.zeros(256, np.float32)
+        width = sum(g.get_width() for g in glyphs)
+        surface = pygame.Surface((width, self.height), pygame.SRCALPHA)
+        surface.fill(BACKGROUND)
+        x = 0
+        for ch, glyph in zip(ATLAS_CHARS, glyphs):
+            c = ord(ch)
+            surface.blit(glyph, (x, 0))
+            self.advance[c] = glyph.get_width()
+            self.s0[c] = x / width
+            self.s1[c] = (x + glyph.get_width()) / width
+            x += glyph.get_width()
+        unknown = ord('?')
+        for table in (self.advance, self.s0, self.s1):
+            missing = np.ones(256, bool)
+            missing[32:127] = False
+            table[missing] = table[unknown]
+        self.texture = upload_texture(surface)
+
+    def layout(self, text):
+        """
+        Returns the (4 * len(text), 4) vertex array of a string
+        """
+        codes = np.frombuffer(text.encode('latin-1', 'replace'), np.uint8)
+        advance = self.advance[codes]
+        x1 = np.cumsum(advance)
+        x0 = x1 - advance
+        vertices = np.empty((len(codes), 4, 4), np.float32)
+        vertices[:, :, 0] = np.stack([self.s0[codes], self.s1[codes], self.s1[codes], self.s0[codes]], 1)
+        vertices[:, :, 1] = (0, 0, 1, 1)
+        vertices[:, :, 2] = np.stack([x0, x1, x1, x0], 1)
+        vertices[:, :, 3] = (0, 0, self.height, self.height)
+        return vertices.reshape(-1, 4)
+
+
+class TextRenderer:
+    """
+    Draws text at projected 3D positions, caching fonts, textures and display
+    lists. Create it once; GL resources are made lazily on first use, so the
+    GL context must exist by then.
+    """
+    def __init__(self, font_name=FONT_NAME, bold=True):
+        self.font_name = font_name
+        self.bold = bold
+        self._fonts = {}
+        self._atlases = {}
+        self._static = {}  # (text, size) -> (texture, display list)
+        self._dynamic = {}  # (position or name, size) -> (text, display list)
+
+    def font(self, size):
+        font = self._fonts.get(size)
+        if font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            font = self._fonts[size] = pygame.font.SysFont(self.font_name, size, self.bold)
+        return font
+
+    def draw(self, position, textString, size, dynamic=False):
+        """
+        Draws textString with its lower left corner at the projected position.
+        Use dynamic=True for strings that change often at a fixed position, or
+        a hashable key naming the string when several share one position
+        (e.g. the same label in tiled viewports).
+        """
+        if dynamic:
+            display_list = self._dynamic_list(position, textString, size, dynamic)
+        else:
+            display_list = self._static_list(textString, size)
+        x, y, z = gluProject(*position)
+        viewport = glGetIntegerv(GL_VIEWPORT)
+        glPushAttrib(GL_ENABLE_BIT | GL_CURRENT_BIT | GL_TEXTURE_BIT)
+        glDisable(GL_LIGHTING)
+        glDisable(GL_DEPTH_TEST)
+        glEnable(GL_TEXTURE_2D)
+        glTexEnvi(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_REPLACE)
+        glMatrixMode(GL_PROJECTION)
+        glPushMatrix()
+        glLoadIdentity()
+        glOrtho(viewport[0], viewport[0] + viewport[2], viewport[1], viewport[1] + viewport[3], -1, 1)
+        glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
+        glLoadIdentity()
+        glTranslatef(round(x), round(y), 0)
+        glCallList(display_list)
+        glPopMatrix()
+        glMatrixMode(GL_PROJECTION)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glPopAttrib()
+
+    def _static_list(self, textString, size):
+        key = (textString, size)
+        cached = self._static.get(key)
+        if cached is None:
+            if len(self._static) >= MAX_STATIC:
+                self._release(*self._static.pop(next(iter(self._static))))
+            surface = self.font(size).render(textString, True, FOREGROUND, BACKGROUND)
+            texture = upload_texture(surface)
+            cached = self._static[key] = (texture, compile_quads(texture, quad(0, 0, *surface.get_size())))
+        return cached[1]
+
+    def _dynamic_list(self, position, textString, size, name=True):
+        key = (tuple(position) if name is True else name, size)
+        cached = self._dynamic.get(key)
+        if cached is not None and cached[0] == textString:
+            return cached[1]
+        atlas = self._atlases.get(size)
+        if atlas is None:
+            atlas = self._atlases[size] = GlyphAtlas(self.font(size))
+        if cached is not None:
+            glDeleteLists(cached[1], 1)
+        display_list = compile_quads(atlas.texture, atlas.layout(textString))
+        self._dynamic[key] = (textString, display_list)
+        return display_list
+
+    def _release(self, texture, display_list):
+        glDeleteLists(display_list, 1)
+        glDeleteTextures([texture])
@@ -0,0 +1,270 @@
+"""
+Background ingest for PyTeapotPlus.
+
+A worker thread owns the serial port or UDP socket, decodes every incoming
+frame and publishes it into a latest-value slot. The render loop only reads
+the newest sample from the slot, so it keeps running at display rate even
+when the ESP32 stalls or Wi-Fi drops packets.
+"""
+
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import logs
+from frameparser import FrameError, parse_frame, parse_time
+from framer import KEEP_ALL, LineFramer, update_status
+from wire import (BATCH_MAGIC, KIND_QUAT, KIND_TIMING, BinaryFramer, SeqTracker, decode_batch, decode_datagram,
+                  device_timing)
+
+
+RATE_INTERVAL = 1.0  # seconds between receive rate updates
+
+serial_log = logs.get('serial')  # raw text frames, DEBUG
+ingest_log = logs.get('ingest')
+
+
+Sample = namedtuple('Sample', ['seq', 't_recv', 'values', 't_device', 'cal'], defaults=[None, None])
+Sample.__doc__ = """
+Decoded sample: host sequence number, host receive time (time.monotonic()),
+(w, x, y, z) quaternion or (yaw, pitch, roll) angles, device time in seconds
+and (sys, gyro, accel, mag) calibration status when the transport carries them.
+"""
+
+Reading = namedtuple('Reading', ['values', 't_device', 'cal'], defaults=[None, None])
+Reading.__doc__ = """
+What a transport decoded from one frame, before the host stamps it
+"""
+
+
+class LatestSlot:
+    """
+    Single-writer, many-reader latest-value slot.
+    The writer replaces an immutable Sample reference; rebinding an attribute is
+    atomic in CPython, so readers never see a half-written sample and no lock
+    is needed on either side.
+    """
+    def __init__(self):
+        self._sample = None
+        self._seq = 0
+
+    def publish(self, values, t_recv=None, t_device=None, cal=None):
+        if t_recv is None:
+            t_recv = time.monotonic()
+        self._seq += 1
+        self._sample = Sample(self._seq, t_recv, values, t_device, cal)
+
+    def get(self):
+        """
+        Returns the newest Sample, or None if nothing was received yet
+        """
+        return self._sample
+
+
+def binary_reading(frame, useQuat):
+    """
+    Converts a wire.BinaryFrame, rejecting frames of the other angle mode
+    """
+    if (frame.kind == KIND_QUAT) != bool(useQuat):
+        raise FrameError(f"Binary frame kind {frame.kind} does not match useQuat={useQuat}")
+    return Reading(frame.values, None if frame.millis is None else frame.millis / 1000.0, frame.cal)
+
+
+class SerialSource:
+    """
+    Serial transport. Bytes are pulled in bulk and split by a LineFramer (text
+    frames) or a BinaryFramer (binary frames), so no frame is thrown away; the
+    short timeout only bounds how long the ingest worker waits before it
+    re-checks its stop flag.
+    """
+    def __init__(self, port, baudrate=115200, useQuat=True, timeout=0.1, policy=KEEP_ALL, binary=False,
+                 metrics=None):
+        import serial
+        self.useQuat = useQuat
+        self.binary = binary
+        self.metrics = metrics
+        self.parse_errors = 0
+        self.framer = BinaryFramer(policy) if binary else LineFramer(policy)
+        self.name = port
+        self.ser = serial.Serial(port, baudrate, dsrdtr=False, timeout=timeout)
+
+    @property
+    def dropped(self):
+        """
+        Frames lost before reaching the host, only known in binary mode
+        """
+        return self.framer.seq.dropped if self.binary else 0
+
+    @property
+    def timing(self):
+        """
+        Last framer.DeviceTiming the firmware reported, None before the first
+        """
+        return self.framer.timing
+
+    def read(self):
+        """
+        Returns a list of Readings, empty if nothing complete arrived
+        """
+        t0 = time.perf_counter()
+        waiting = self.ser.in_waiting
+        data = self.ser.read(waiting or 1)
+        t1 = time.perf_counter()
+        readings = []
+        for frame in self.framer.feed(data):
+            try:
+                if self.binary:
+                    readings.append(binary_reading(frame, self.useQuat))
+                else:
+                    if serial_log.isEnabledFor(logging.DEBUG):
+                        serial_log.debug(frame.decode('UTF-8', 'replace'))
+                    readings.append(Reading(parse_frame(frame, self.useQuat), parse_time(frame), self.framer.calibration))
+            except FrameError:
+                self.parse_errors += 1
+        if self.binary:
+            self.parse_errors += self.framer.crc_errors
+            self.framer.crc_errors = 0
+        if self.metrics is not None:
+            if waiting:  # a read that blocked for the first byte would time the wait
+                self.metrics['read'].record(t1 - t0)
+            if data:
+                self.metrics['parse'].record(time.perf_counter() - t1)
+        return readings
+
+    def close(self):
+        self.ser.close()
+
+
+class UdpSource:
+    """
+    UDP transport, receives the datagrams broadcast by the ESP32 access point
+    """
+    def __init__(self, ip, port, useQuat=True, timeout=0.1, binary=False, metrics=None):
+        import socket
+        self.useQuat = useQuat
+        self.binary = binary
+        self.metrics = metrics
+        self.parse_errors = 0
+        self.seq = SeqTracker()
+        self.calibration = None  # last status reported in a text datagram
+        self.timing = None  # last framer.DeviceTiming reported
+        self.name = f"{ip}:{port}"
+        self.sock = socket.socket(socket.AF_INET, # Internet
+                                  socket.SOCK_DGRAM) # UDP
+        self.sock.bind((ip, port))
+        self.sock.settimeout(timeout)
+
+    @property
+    def dropped(self):
+        return self.seq.dropped
+
+    def read(self):
+        try:
+            data, addr = self.sock.recvfrom(1024) # buffer size is 1024 bytes
+        except TimeoutError:
+            return []
+        t0 = time.perf_counter()
+        try:
+            return decode_udp(data, self.useQuat, self.binary, self.seq, self)
+        except FrameError:
+            self.parse_errors += 1
+            return []
+        finally:
+            if self.metrics is not None:
+                self.metrics['parse'].record(time.perf_counter() - t0)
+
+    def close(self):
+        self.sock.close()
+
+
+def decode_udp(data, useQuat, binary, seq, status=None):
+    """
+    Decodes one datagram into Readings, seq being the wire.SeqTracker of its
+    sender. Status datagrams update the calibration and timing attributes of
+    status (the source or sensor stream) if given. Raises FrameError for
+    malformed data.
+    """
+    if not binary:
+        if status is not None and update_status(status, data):
+            return []
+        return [Reading(parse_frame(data, useQuat), parse_time(data), getattr(status, 'calibration', None))]
+    if data.startswith(BATCH_MAGIC):
+        return batch_readings(decode_batch(data), useQuat, seq)
+    readings = []
+    for frame in decode_datagram(data):
+        if frame.kind == KIND_TIMING:
+            if status is not None:
+                status.timing = device_timing(frame)
+            continue
+        seq.update(frame.seq)
+        readings.append(binary_reading(frame, useQuat))
+    return readings
+
+
+def batch_readings(batch, useQuat, seq):
+    if (batch.kind == KIND_QUAT) != bool(useQuat):
+        raise FrameError(f"Batch kind {batch.kind} does not match useQuat={useQuat}")
+    seq.update(batch.seq, len(batch.millis))
+    return [Reading(tuple(values), millis / 1000.0, batch.cal)
+            for millis, values in zip(batch.millis.tolist(), batch.values.tolist())]
+
+
+class IngestWorker(threading.Thread):
+    """
+    Daemon thread that drains a source into a LatestSlot until stopped, and
+    into a session.Recorder if one is given. Counts samples and their rate
+    like a fanin.SensorStream. notify is called without arguments after new
+    samples were published, e.g. scheduler.FrameScheduler.wake.
+    """
+    def __init__(self, source, slot, retry_delay=0.5, recorder=None, notify=None):
+        # the thread is named after the source, as its sensor in metrics and recordings
+        super().__init__(name=str(getattr(source, 'name', "pyteapot-ingest")), daemon=True)
+        self.source = source
+        self.slot = slot
+        self.retry_delay = retry_delay
+        self.recorder = recorder
+        self.notify = notify
+        self.received = 0  # samples
+        self.rate = 0.0  # samples per second over the last RATE_INTERVAL
+        self._stop_event = threading.Event()
+
+    @property
+    def dropped(self):
+        return getattr(self.source, 'dropped', 0)
+
+    @property
+    def parse_errors(self):
+        return getattr(self.source, 'parse_errors', 0)
+
+    @property
+    def timing(self):
+        return getattr(self.source, 'timing', None)
+
+    def run(self):
+        if self.recorder is not None:
+            source_id = self.recorder.source_id(getattr(self.source, 'name', type(self.source).__name__))
+        rate_time = time.monotonic()
+        rate_count = 0
+        while not self._stop_event.is_set():
+            try:
+                readings = self.source.read()
+            except OSError as e:  # serial.SerialException is an OSError too
+                ingest_log.warning("Ingest error: %s", e)
+                self._stop_event.wait(self.retry_delay)
+                continue
+            t_recv = time.monotonic()
+            for reading in readings:
+                self.slot.publish(reading.values, t_recv, reading.t_device, reading.cal)
+                if self.recorder is not None:
+                    self.recorder.write(reading.values, t_recv, reading.t_device, reading.cal, source_id)
+            self.received += len(readings)
+            if readings and self.notify is not None:
+                self.notify()
+            if t_recv - rate_time >= RATE_INTERVAL:
+                self.rate = (self.received - rate_count) / (t_recv - rate_time)
+                rate_time = t_recv
+                rate_count = self.received
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,144 @@
+"""
+Non-blocking, rate-limited logging for PyTeapotPlus.
+
+Printing every sample from the render loop costs frames: a console write
+blocks until the terminal (a Windows console, an SSH session) has taken the
+text. Here the hot paths log through the standard logging module into a
+bounded queue, and a background thread does the formatting and writing.
+Each kind of message has its own logger under 'pyteapot', and RATES caps how
+many lines per second each one may produce; the rest are counted and the
+count is shown on the next line that gets through. When the queue is full
+records are dropped, never waited for.
+
+    logs.setup('INFO', rates={'sample': 5.0})   # once, at startup
+    log = logs.get('sample')
+    log.info("Yaw=%.4f", yaw)                    # formatted on the writer thread
+    logs.shutdown()                              # flushes what is queued
+
+Messages below the configured level cost one cached level check and are
+never formatted. Pass immutable arguments (numbers, strings): they are
+formatted later, on the writer thread.
+"""
+
+import logging
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+ROOT = 'pyteapot'  # parent logger of every logger from get()
+QUEUE_SIZE = 1000  # records waiting for the writer thread at most
+RATES = {'sample': 5.0, 'serial': 5.0}  # lines per second per logger, loggers not listed are not limited
+FORMAT = '%(message)s'
+# record attributes FORMAT does not use; the stack walk behind _srcfile is the most expensive part of a record
+UNUSED = {'_srcfile': None, 'logThreads': False, 'logProcesses': False, 'logMultiprocessing': False}
+
+_handler = None
+_listener = None
+_saved = None  # the logging module's own values of UNUSED while setup() is in effect
+
+
+def get(name):
+    """
+    The logger for one kind of message, e.g. get('sample')
+    """
+    return logging.getLogger(ROOT + '.' + name)
+
+
+class RateLimit(logging.Filter):
+    """
+    Token bucket per logger: lets through rate records per second on average
+    and bursts of up to one second's worth. Suppressed records are counted
+    and the next record let through says how many were skipped.
+    """
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = {ROOT + '.' + name: rate for name, rate in rates.items()}
+        self._buckets = {}  # logger name -> [tokens, last refill time, suppressed]
+
+    def filter(self, record):
+        rate = self.rates.get(record.name)
+        if not rate:
+            return True
+        now = time.monotonic()
+        bucket = self._buckets.get(record.name)
+        if bucket is None:
+            bucket = self._buckets[record.name] = [max(rate, 1.0), now, 0]
+        bucket[0] = min(bucket[0] + (now - bucket[1]) * rate, max(rate, 1.0))
+        bucket[1] = now
+        if bucket[0] < 1.0:
+            bucket[2] += 1
+            return False
+        bucket[0] -= 1.0
+        if bucket[2]:
+            record.msg = "%s (%d similar suppressed)" % (record.msg, bucket[2])
+            bucket[2] = 0
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that drops records when the queue is full instead of
+    blocking, and leaves formatting to the writer thread
+    """
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup(level='INFO', rates=None, stream=None, queue_size=QUEUE_SIZE):
+    """
+    Routes the 'pyteapot' loggers through the background writer. level is a
+    logging level or its name, rates overrides RATES, stream defaults to
+    sys.stdout. Calling it again reconfigures. Until shutdown() the logging
+    module skips the record attributes in UNUSED, for every logger.
+    """
+    global _handler, _listener, _saved
+    shutdown()
+    _saved = {name: getattr(logging, name) for name in UNUSED}
+    for name, value in UNUSED.items():
+        setattr(logging, name, value)
+    root = logging.getLogger(ROOT)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.propagate = False
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(logging.Formatter(FORMAT))
+    _handler = DroppingQueueHandler(queue.Queue(queue_size))
+    _handler.addFilter(RateLimit(RATES if rates is None else rates))
+    root.addHandler(_handler)
+    _listener = QueueListener(_handler.queue, writer)
+    _listener.start()
+
+
+def dropped():
+    """
+    Records lost to a full queue since setup()
+    """
+    return _handler.dropped if _handler is not None else 0
+
+
+def shutdown():
+    """
+    Writes the queued records, stops the writer thread and gives the logging
+    module its settings back
+    """
+    global _handler, _listener, _saved
+    if _listener is not None:
+        _listener.stop()
+        logging.getLogger(ROOT).removeHandler(_handler)
+        _listener = None
+        _handler = None
+    if _saved is not None:
+        for name, value in _saved.items():
+            setattr(logging, name, value)
+        _saved = None
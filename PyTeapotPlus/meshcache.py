@@ -0,0 +1,317 @@
+"""
+On-disk cache of preprocessed OBJ meshes for the PyTeapotPlus viewers.
+
+Parsing a detailed OBJ with pywavefront takes seconds. On first load every
+material is turned into deduplicated float32 vertices and uint32 triangle
+indices and written to one binary file; later launches memory-map that file
+and hand the arrays straight to the GPU buffers.
+
+File layout: b'PTMESH01', uint32 header length, JSON header, then the arrays,
+each 16 byte aligned. The header records the source file's size, mtime and
+SHA-1 and the material libraries it used, any change rebuilds the cache.
+Besides the full model the file holds the coarser levels of detail made by
+meshlod.py, each part entry names the level it belongs to.
+
+    python meshcache.py build PyTeapotPlus/alfa147.obj   # prebuild caches
+    python meshcache.py bench PyTeapotPlus/alfa147.obj   # cold vs warm startup
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from collections import namedtuple
+
+import numpy as np
+
+
+MAGIC = b'PTMESH01'
+VERSION = 2
+ALIGN = 16
+
+log = logging.getLogger(__name__)
+
+MeshPart = namedtuple('MeshPart', ['name', 'vertex_format', 'vertices', 'indices', 'material'])
+MeshPart.__doc__ = """
+One material of a mesh: pywavefront vertex format (e.g. 'T2F_N3F_V3F'),
+(N, k) float32 interleaved vertices, (M,) uint32 triangle indices and a dict
+of material properties (diffuse, ambient, specular, emissive, shininess,
+texture)
+"""
+
+# Components of a pywavefront vertex format string such as 'T2F_N3F_V3F' and their float count
+VERTEX_COMPONENTS = {'T2F': 2, 'C3F': 3, 'N3F': 3, 'V3F': 3}
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pyteapotplus')
+
+
+def cache_path(obj_path, cache_dir=None):
+    obj_path = os.path.abspath(obj_path)
+    tag = hashlib.sha1(obj_path.encode('utf-8')).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(obj_path))[0]
+    return os.path.join(cache_dir or default_cache_dir(), f"{stem}-{tag}.mesh")
+
+
+def file_sha1(path, chunk=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_key(path, with_hash=True):
+    st = os.stat(path)
+    key = {'path': os.path.abspath(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if with_hash:
+        key['sha1'] = file_sha1(path)
+    return key
+
+
+class CachedMesh:
+    """
+    Mesh loaded from a cache file. The arrays are views into a read-only
+    memory map, which stays open as long as this object lives.
+    levels[0] is the full model (also available as parts), further levels
+    are coarser; lod_errors holds their geometric error in model units.
+    """
+    def __init__(self, levels, header, mapping=None):
+        self.levels = levels
+        self.parts = levels[0] if levels else []
+        self.header = header
+        self.lod_errors = [lod['error'] for lod in header.get('lods', [{'error': 0.0}])]
+        self.bounds = header.get('bounds')
+        self._mapping = mapping
+
+    @property
+    def triangle_count(self):
+        return sum(len(part.indices) // 3 for part in self.parts)
+
+    @property
+    def vertex_count(self):
+        return sum(len(part.vertices) for part in self.parts)
+
+    def close(self):
+        """
+        Drops the arrays; the map is unmapped once no array view is left
+        """
+        self.levels = []
+        self.parts = []
+        self._mapping = None
+
+
+def deduplicate(vertices):
+    """
+    Returns (unique vertices, uint32 indices) for an (N, k) float32 array of
+    unindexed triangle corners
+    """
+    rows = np.ascontiguousarray(vertices).view(np.dtype((np.void, vertices.dtype.itemsize * vertices.shape[1])))
+    _, first, inverse = np.unique(rows.ravel(), return_index=True, return_inverse=True)
+    return vertices[first], inverse.astype(np.uint32).ravel()
+
+
+def _texture_path(texture):
+    if texture is None:
+        return None
+    try:
+        return os.path.abspath(texture.find())
+    except Exception:  # missing texture file, the part is drawn untextured
+        return None
+
+
+def parts_from_scene(scene):
+    """
+    Converts a pywavefront.Wavefront scene into MeshParts
+    """
+    parts = []
+    for name, material in scene.materials.items():
+        if not material.vertices:
+            continue
+        vertices = np.asarray(material.vertices, np.float32).reshape(-1, material.vertex_size)
+        vertices, indices = deduplicate(vertices)
+        properties = {
+            'diffuse': list(material.diffuse),
+            'ambient': list(material.ambient),
+            'specular': list(material.specular),
+            'emissive': list(material.emissive),
+            'shininess': float(material.shininess),
+            'texture': _texture_path(material.texture or material.texture_ambient),
+        }
+        parts.append(MeshPart(name, material.vertex_format, vertices, indices, properties))
+    return parts
+
+
+def write_cache(path, levels, source, lod_errors=None, bounds=None):
+    """
+    Writes levels of MeshParts (full model first) and the source description
+    to a cache file atomically
+    """
+    blobs = []
+    entries = []
+    offset = 0
+    for lod, parts in enumerate(levels):
+        for part in parts:
+            entry = {'name': part.name, 'vertex_format': part.vertex_format, 'material': part.material, 'lod': lod}
+            for field, array in (('vertices', part.vertices), ('indices', part.indices)):
+                array = np.ascontiguousarray(array)
+                entry[field] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+                blobs.append((offset, array))
+                offset += -(-array.nbytes // ALIGN) * ALIGN
+            entries.append(entry)
+    lod_errors = lod_errors or [0.0] * len(levels)
+    header = {'version': VERSION, 'source': source, 'parts': entries,
+              'lods': [{'error': float(error)} for error in lod_errors]}
+    if bounds is not None:
+        header['bounds'] = [[float(v) for v in corner] for corner in bounds]
+    header = json.dumps(header).encode('utf-8')
+    data_start = -(-(len(MAGIC) + 4 + len(header)) // ALIGN) * ALIGN
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for blob_offset, array in blobs:
+            f.seek(data_start + blob_offset)
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp, path)
+
+
+def read_cache(path):
+    """
+    Memory-maps a cache file, returns a CachedMesh
+    """
+    with open(path, 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapping[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a mesh cache file")
+    (length,) = struct.unpack_from('<I', mapping, len(MAGIC))
+    header = json.loads(mapping[len(MAGIC) + 4:len(MAGIC) + 4 + length])
+    data_start = -(-(len(MAGIC) + 4 + length) // ALIGN) * ALIGN
+    levels = [[] for _ in header.get('lods', [None])]
+    for entry in header['parts']:
+        arrays = []
+        for field in ('vertices', 'indices'):
+            spec = entry[field]
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape']))
+            array = np.frombuffer(mapping, dtype, count, data_start + spec['offset'])
+            arrays.append(array.reshape(spec['shape']))
+        levels[entry.get('lod', 0)].append(MeshPart(entry['name'], entry['vertex_format'], *arrays, entry['material']))
+    return CachedMesh(levels, header, mapping)
+
+
+def is_fresh(header, obj_path):
+    """
+    True if the cached source and material libraries are unchanged. Matching
+    size and mtime are trusted, a changed mtime falls back to the content hash.
+    """
+    if header.get('version') != VERSION:
+        return False
+    source = header['source']
+    for path, recorded in [(obj_path, source)] + [(lib['path'], lib) for lib in source.get('mtllibs', [])]:
+        try:
+            current = file_key(path, with_hash=False)
+        except OSError:
+            return False
+        if current['size'] != recorded['size']:
+            return False
+        if current['mtime_ns'] != recorded['mtime_ns'] and file_sha1(path) != recorded['sha1']:
+            return False
+    return True
+
+
+def build(obj_path, cache_dir=None, lods=True):
+    """
+    Parses an OBJ with pywavefront, builds the levels of detail and writes its
+    cache, returns the cache path
+    """
+    from pywavefront import Wavefront
+    import meshlod
+    scene = Wavefront(obj_path, collect_faces=True, create_materials=True)
+    source = file_key(obj_path)
+    obj_dir = os.path.dirname(os.path.abspath(obj_path))
+    source['mtllibs'] = [file_key(os.path.join(obj_dir, name)) for name in getattr(scene, 'mtllibs', [])
+                         if os.path.exists(os.path.join(obj_dir, name))]
+    path = cache_path(obj_path, cache_dir)
+    parts = parts_from_scene(scene)
+    coarse = meshlod.build_levels(parts) if lods else []
+    write_cache(path, [parts] + [level for _, level in coarse], source,
+                [0.0] + [error for error, _ in coarse], meshlod.mesh_bounds(parts))
+    return path
+
+
+def load_mesh(obj_path, cache_dir=None, rebuild=False):
+    """
+    Returns the CachedMesh of an OBJ file, building the cache when it is
+    missing, stale or unreadable
+    """
+    path = cache_path(obj_path, cache_dir)
+    if not rebuild and os.path.exists(path):
+        try:
+            mesh = read_cache(path)
+        except (ValueError, KeyError, OSError) as e:
+            log.warning("Ignoring unreadable mesh cache %s: %s", path, e)
+        else:
+            if is_fresh(mesh.header, obj_path):
+                return mesh
+            mesh.close()
+    return read_cache(build(obj_path, cache_dir))
+
+
+def bench(obj_path, cache_dir=None, repeat=3):
+    """
+    Times pywavefront parsing, the cold cache build and warm cache loads
+    """
+    from pywavefront import Wavefront
+    t = time.perf_counter()
+    Wavefront(obj_path, collect_faces=True, create_materials=True)
+    parse = time.perf_counter() - t
+    t = time.perf_counter()
+    load_mesh(obj_path, cache_dir, rebuild=True).close()
+    cold = time.perf_counter() - t
+    warm = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        mesh = load_mesh(obj_path, cache_dir)
+        for part in mesh.parts:  # touch the pages like a GPU upload would
+            part.vertices.sum()
+            part.indices.max()
+        warm.append(time.perf_counter() - t)
+        triangles, vertices = mesh.triangle_count, mesh.vertex_count
+        mesh.close()
+    print(f"{obj_path}: {triangles} triangles, {vertices} unique vertices")
+    print(f"  pywavefront parse:      {parse * 1000:9.1f} ms")
+    print(f"  cold (parse + cache):   {cold * 1000:9.1f} ms")
+    print(f"  warm (mmap cache):      {min(warm) * 1000:9.1f} ms")
+    print(f"  speedup:                {parse / min(warm):9.1f} x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PyTeapotPlus mesh cache")
+    parser.add_argument('command', choices=['build', 'bench'])
+    parser.add_argument('obj', nargs='+', help="OBJ files")
+    parser.add_argument('--cache-dir', help=f"cache directory (default {default_cache_dir()})")
+    args = parser.parse_args()
+    for obj_path in args.obj:
+        if args.command == 'build':
+            path = build(obj_path, args.cache_dir)
+            print(f"{obj_path} -> {path}")
+            mesh = read_cache(path)
+            for lod, (parts, error) in enumerate(zip(mesh.levels, mesh.lod_errors)):
+                triangles = sum(len(part.indices) // 3 for part in parts)
+                print(f"  LOD {lod}: {triangles:9d} triangles, error {error:.4g}")
+            mesh.close()
+        else:
+            bench(obj_path, args.cache_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+Level-of-detail generation for the cached meshes of meshcache.py.
+
+Coarser levels are made by vertex clustering with quadric error placement
+(Lindstrom, "Out-of-core simplification of large polygonal models", 2000):
+the model's bounding box is cut into a grid, all vertices of a cell are merged
+into one and placed where the summed squared distance to the planes of their
+triangles is smallest. Unlike iterative edge collapse this is a handful of
+numpy passes, so a level of a few hundred thousand triangles takes well under
+a second to build. The grid is shared by all materials, merged vertices sit at
+the same place in every material and no cracks open between them.
+
+Each level records its cell size as geometric error, the renderer picks the
+coarsest level whose error projects to less than about a pixel.
+"""
+
+import numpy as np
+
+from meshcache import VERTEX_COMPONENTS, MeshPart
+
+
+LOD_RATIOS = (0.25, 0.0625, 0.015625)  # triangle budget of the coarser levels
+MIN_TRIANGLES = 256  # no level is made below this
+SVD_CUTOFF = 1e-3  # relative singular value below which a quadric direction is free
+
+
+def component_slices(vertex_format):
+    """
+    Returns {'N3F': slice, ...} of the columns of a pywavefront vertex format
+    """
+    slices = {}
+    offset = 0
+    for component in vertex_format.split('_'):
+        slices[component] = slice(offset, offset + VERTEX_COMPONENTS[component])
+        offset += VERTEX_COMPONENTS[component]
+    return slices
+
+
+def mesh_bounds(parts):
+    lo = np.full(3, np.inf, np.float32)
+    hi = np.full(3, -np.inf, np.float32)
+    for part in parts:
+        positions = part.vertices[:, component_slices(part.vertex_format)['V3F']]
+        if len(positions):
+            lo = np.minimum(lo, positions.min(0))
+            hi = np.maximum(hi, positions.max(0))
+    return lo, hi
+
+
+def _quadrics(positions, triangles, cluster, count):
+    """
+    Sums the area weighted plane quadrics of the triangles into their
+    clusters, returns (count, 10) upper-triangle entries of the 4x4 matrices
+    """
+    p0, p1, p2 = (positions[triangles[:, k]] for k in range(3))
+    normal = np.cross(p1 - p0, p2 - p0)
+    area = np.linalg.norm(normal, axis=1)
+    valid = area > 0
+    normal[valid] /= area[valid, None]
+    plane = np.concatenate([normal, -np.einsum('ij,ij->i', normal, p0)[:, None]], 1)
+    rows, cols = np.triu_indices(4)
+    entries = plane[:, rows] * plane[:, cols] * (0.5 * area)[:, None]
+    q = np.zeros((count, 10))
+    for k in range(3):
+        owner = cluster[triangles[:, k]]
+        for e in range(10):
+            q[:, e] += np.bincount(owner, entries[:, e], count)
+    return q
+
+
+def _place(q, centroid, lo, hi):
+    """
+    Minimises each cluster quadric, directions it does not constrain keep the
+    centroid; the result is clamped to the cluster's cell
+    """
+    a = np.empty((len(q), 3, 3))
+    a[:, 0, 0], a[:, 0, 1], a[:, 0, 2] = q[:, 0], q[:, 1], q[:, 2]
+    a[:, 1, 1], a[:, 1, 2], a[:, 2, 2] = q[:, 4], q[:, 5], q[:, 7]
+    a[:, 1, 0], a[:, 2, 0], a[:, 2, 1] = q[:, 1], q[:, 2], q[:, 5]
+    b = -q[:, [3, 6, 8]]
+    u, s, vt = np.linalg.svd(a)
+    keep = s > SVD_CUTOFF * s[:, :1]
+    inv_s = np.where(keep, 1.0 / np.where(keep, s, 1.0), 0.0)
+    residual = b - np.einsum('nij,nj->ni', a, centroid)
+    step = np.einsum('nji,nj,nj->ni', vt, inv_s, np.einsum('nji,nj->ni', u, residual))
+    return np.clip(centroid + step, lo, hi)
+
+
+def cluster_level(parts, lo, cell):
+    """
+    Simplifies MeshParts on a grid of the given cell size
+    """
+    slices = [component_slices(part.vertex_format) for part in parts]
+    positions = np.concatenate([p.vertices[:, s['V3F']] for p, s in zip(parts, slices)]).astype(np.float64)
+    offsets = np.cumsum([0] + [len(p.vertices) for p in parts])
+    cells = np.floor((positions - lo) / cell).astype(np.int64)
+    span = cells.max(0) + 1
+    _, cluster = np.unique((cells[:, 0] * span[1] + cells[:, 1]) * span[2] + cells[:, 2], return_inverse=True)
+    cluster = cluster.ravel()
+    count = cluster.max() + 1
+    triangles = np.concatenate([p.indices.reshape(-1, 3).astype(np.int64) + offsets[i]
+                                for i, p in enumerate(parts)])
+    weight = np.bincount(cluster, minlength=count).astype(np.float64)
+    centroid = np.stack([np.bincount(cluster, positions[:, k], count) for k in range(3)], 1) / weight[:, None]
+    cell_lo = np.stack([np.bincount(cluster, cells[:, k], count) for k in range(3)], 1) / weight[:, None]
+    cell_lo = lo + cell_lo * cell
+    placed = _place(_quadrics(positions, triangles, cluster, count), centroid, cell_lo, cell_lo + cell)
+
+    level = []
+    for i, (part, s) in enumerate(zip(parts, slices)):
+        local = cluster[offsets[i]:offsets[i + 1]]
+        tris = local[part.indices.reshape(-1, 3)]
+        tris = tris[(tris[:, 0] != tris[:, 1]) & (tris[:, 1] != tris[:, 2]) & (tris[:, 0] != tris[:, 2])]
+        if not len(tris):
+            continue
+        # the same triangle can come out of several source triangles
+        ordered = np.sort(tris, 1)
+        if count < 1 << 21:
+            ordered = (ordered[:, 0] * count + ordered[:, 1]) * count + ordered[:, 2]
+        _, first = np.unique(ordered, axis=0, return_index=True)
+        tris = tris[np.sort(first)]
+        used, indices = np.unique(tris, return_inverse=True)
+        remap = np.full(count, -1, np.int64)
+        remap[used] = np.arange(len(used))
+        member = remap[local]
+        inside = member >= 0
+        members = member[inside]
+        source = part.vertices[inside]
+        vertices = np.stack([np.bincount(members, source[:, k], len(used)) for k in range(source.shape[1])], 1)
+        vertices /= np.bincount(members, minlength=len(used))[:, None]
+        vertices[:, s['V3F']] = placed[used]
+        if 'N3F' in s:
+            normals = vertices[:, s['N3F']]
+            length = np.linalg.norm(normals, axis=1, keepdims=True)
+            vertices[:, s['N3F']] = np.divide(normals, length, out=normals, where=length > 0)
+        level.append(MeshPart(part.name, part.vertex_format, vertices.astype(np.float32),
+                              indices.astype(np.uint32).ravel(), part.material))
+    return level
+
+
+def triangle_count(parts):
+    return sum(len(part.indices) // 3 for part in parts)
+
+
+def build_levels(parts, ratios=LOD_RATIOS, min_triangles=MIN_TRIANGLES):
+    """
+    Returns [(error, parts)] of the coarser levels, error being the grid cell
+    size in model units. The grid of each level is tuned over a few passes to
+    land near its triangle budget.
+    """
+    lo, hi = mesh_bounds(parts)
+    size = float((hi - lo).max())
+    total = triangle_count(parts)
+    if size <= 0 or not total:
+        return []
+    levels = []
+    resolution = None
+    for ratio in ratios:
+        target = total * ratio
+        if target < min_triangles:
+            break
+        if resolution is None:
+            resolution = max(2.0, np.sqrt(target / 2.0))  # a closed surface has ~2 triangles per cell face
+        for _ in range(4):
+            cell = size / resolution
+            level = cluster_level(parts, lo.astype(np.float64), cell)
+            got = triangle_count(level)
+            if abs(got - target) < 0.15 * target or not got:
+                break
+            resolution *= np.sqrt(target / got)
+        if not got or (levels and got >= triangle_count(levels[-1][1])):
+            break
+        levels.append((cell, level))
+        resolution *= 0.5
+    return levels
@@ -0,0 +1,289 @@
+"""
+GPU-resident rendering of cached OBJ meshes (see meshcache.py).
+
+All materials sharing a vertex format are uploaded once into one VBO/IBO pair
+(display lists on legacy contexts), each material being a range of the index
+buffer. Draws are sorted by material state, so a frame binds the buffers once,
+changes lighting, texture and material state only where it differs from the
+previous draw and issues one glDrawElements() per material. Material state is
+applied the same way pywavefront.visualization.draw() applies it.
+
+    python meshrender.py bench PyTeapotPlus/alfa147.obj   # FPS against pywavefront
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+import pygame
+from OpenGL.GL import *
+from OpenGL.GLU import *
+
+from glbuffers import IndexedMesh
+from meshlod import mesh_bounds
+
+
+LOD_PIXEL_ERROR = 1.0  # screen error in pixels a coarser level of detail may introduce
+
+log = logging.getLogger(__name__)
+
+
+def load_texture(path):
+    """
+    Loads an image file into a repeating RGBA texture
+    """
+    surface = pygame.image.load(path)
+    data = pygame.image.tobytes(surface, "RGBA", True)
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, texture)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, surface.get_width(), surface.get_height(), 0,
+                 GL_RGBA, GL_UNSIGNED_BYTE, data)
+    return texture
+
+
+def _material_state(material):
+    return (tuple(material['diffuse']), tuple(material['ambient']), tuple(material['specular']),
+            tuple(material['emissive']), min(128.0, material['shininess']))
+
+
+class MeshRenderer:
+    """
+    Draws a meshcache.CachedMesh from GPU buffers. The mesh arrays are only
+    needed while the buffers are created.
+
+    Every level of detail of the mesh is uploaded; each frame draws the
+    coarsest one whose geometric error projects to at most pixel_error
+    pixels with the current matrices. Set force_lod to pin a level, 0 being
+    the full model.
+    """
+    def __init__(self, mesh, use_vbo=None, lighting=True, textures=True,
+                 pixel_error=LOD_PIXEL_ERROR, force_lod=None):
+        self.lighting = lighting
+        self.textures = textures
+        self.pixel_error = pixel_error
+        self.force_lod = force_lod
+        self.buffers = []
+        self.levels = []  # per level of detail, (buffers, range index, (lit, texture, material)) in drawing order
+        self._textures = {}
+        levels = getattr(mesh, 'levels', None) or [mesh.parts]
+        self.lod_errors = list(getattr(mesh, 'lod_errors', [0.0]))[:len(levels)]
+        bounds = getattr(mesh, 'bounds', None) or mesh_bounds(mesh.parts)
+        lo, hi = np.asarray(bounds, np.float64)
+        self.center = (lo + hi) / 2
+        self.radius = float(np.linalg.norm(hi - lo)) / 2
+        self.lod = 0
+        for parts in levels:
+            self.levels.append(self._upload(parts, use_vbo))
+
+    @property
+    def draws(self):
+        return self.levels[self.lod] if self.levels else []
+
+    def _upload(self, mesh_parts, use_vbo):
+        groups = {}
+        for part in mesh_parts:
+            texture = 0
+            path = part.material.get('texture')
+            if self.textures and path and 'T2F' in part.vertex_format:
+                texture = self._texture(path) or 0
+            lit = self.lighting and 'N3F' in part.vertex_format
+            state = (lit, texture, _material_state(part.material))
+            groups.setdefault(part.vertex_format, {}).setdefault(state, []).append(part)
+        draws = []
+        order = {}
+        for vertex_format, by_state in groups.items():
+            vertices, indices, ranges, states = [], [], [], []
+            base = first = 0
+            for state, parts in by_state.items():
+                count = 0
+                for part in parts:
+                    vertices.append(part.vertices)
+                    indices.append(np.add(part.indices, base, dtype=np.uint32))
+                    base += len(part.vertices)
+                    count += len(part.indices)
+                ranges.append((first, count))
+                states.append(state)
+                first += count
+            buffers = IndexedMesh(vertex_format, np.concatenate(vertices), np.concatenate(indices),
+                                  use_vbo, ranges)
+            order[id(buffers)] = len(order)
+            self.buffers.append(buffers)
+            draws += [(buffers, i, state) for i, state in enumerate(states)]
+        # lit before unlit so glColor4f() of unlit materials cannot leak into
+        # GL_COLOR_MATERIAL lighting, then by texture, buffers and material
+        return sorted(draws, key=lambda d: (not d[2][0], d[2][1], order[id(d[0])], d[2][2]))
+
+    def select_lod(self):
+        """
+        Picks the level of detail for the current modelview, projection and
+        viewport
+        """
+        if self.force_lod is not None:
+            return max(0, min(self.force_lod, len(self.levels) - 1))
+        if len(self.levels) < 2:
+            return 0
+        # PyOpenGL returns the column-major matrices transposed: row vectors times matrix
+        modelview = glGetDoublev(GL_MODELVIEW_MATRIX)
+        projection = glGetDoublev(GL_PROJECTION_MATRIX)
+        viewport = glGetIntegerv(GL_VIEWPORT)
+        scale = float(np.linalg.norm(modelview[:3, :3], axis=1).max())
+        pixels = projection[1][1] * viewport[3] / 2.0  # per eye-space unit at distance 1
+        if projection[3][3] == 0.0:  # perspective, measure at the nearest point of the bounding sphere
+            distance = -(self.center @ modelview[:3, :3] + modelview[3, :3])[2] - self.radius * scale
+            if distance <= 0:
+                return 0
+            pixels /= distance
+        lod = 0
+        for level, error in enumerate(self.lod_errors):
+            if error * scale * pixels <= self.pixel_error:
+                lod = level
+        return lod
+
+    def _texture(self, path):
+        if path not in self._textures:
+            try:
+                self._textures[path] = load_texture(path)
+            except (pygame.error, OSError) as e:
+                log.warning("Cannot load texture %s: %s", path, e)
+                self._textures[path] = None
+        return self._textures[path]
+
+    def draw(self, face=GL_FRONT_AND_BACK):
+        glPushAttrib(GL_CURRENT_BIT | GL_ENABLE_BIT | GL_LIGHTING_BIT | GL_TEXTURE_BIT)
+        glEnable(GL_CULL_FACE)
+        glEnable(GL_DEPTH_TEST)
+        glCullFace(GL_BACK)
+        self.lod = self.select_lod()
+        bound = None
+        current = (None, None, None)
+        for buffers, i, state in self.draws:
+            if buffers is not bound:
+                if bound is not None:
+                    bound.unbind()
+                buffers.bind()
+                bound = buffers
+            self._apply(state, current, face)
+            current = state
+            buffers.draw_range(i)
+        if bound is not None:
+            bound.unbind()
+        glPopAttrib()
+
+    @staticmethod
+    def _apply(state, current, face):
+        """
+        Sets the parts of state that differ from the current state
+        """
+        lit, texture, material = state
+        if texture != current[1]:
+            if texture:
+                glEnable(GL_TEXTURE_2D)
+                glBindTexture(GL_TEXTURE_2D, texture)
+            else:
+                glDisable(GL_TEXTURE_2D)
+        if lit != current[0]:
+            if lit:
+                glEnable(GL_LIGHT0)
+                glEnable(GL_LIGHTING)
+            else:
+                glDisable(GL_LIGHTING)
+        if lit and (material != current[2] or not current[0]):
+            diffuse, ambient, specular, emissive, shininess = material
+            glMaterialfv(face, GL_DIFFUSE, diffuse)
+            glMaterialfv(face, GL_AMBIENT, ambient)
+            glMaterialfv(face, GL_SPECULAR, specular)
+            glMaterialfv(face, GL_EMISSION, emissive)
+            glMaterialf(face, GL_SHININESS, shininess)
+        elif not lit and (material != current[2] or current[0] is not False):
+            glColor4f(*material[1])
+
+    def delete(self):
+        for buffers in self.buffers:
+            buffers.delete()
+        textures = [t for t in self._textures.values() if t is not None]
+        if textures:
+            glDeleteTextures(textures)
+        self.buffers = []
+        self.levels = []
+        self._textures = {}
+
+
+def bench(obj_path, frames=300, size=(640, 480)):
+    """
+    Renders a spinning model with pywavefront.visualization.draw() and with
+    MeshRenderer and prints the frame rates
+    """
+    import pyglet
+    pyglet.options['debug_gl'] = False  # pyglet's error checks need a pyglet window
+    from pywavefront import Wavefront, visualization
+    from meshcache import load_mesh
+
+    pygame.init()
+    pygame.display.set_mode(size, pygame.DOUBLEBUF | pygame.OPENGL)
+    pygame.display.set_caption("PyTeapotPlus renderer bench")
+    mesh = load_mesh(obj_path)
+    bounds = np.array([[np.inf] * 3, [-np.inf] * 3], np.float32)
+    for part in mesh.parts:
+        positions = part.vertices[:, -3:]
+        bounds = np.array([np.minimum(bounds[0], positions.min(0)), np.maximum(bounds[1], positions.max(0))])
+    center = bounds.mean(0)
+    scale = 4.0 / max(float((bounds[1] - bounds[0]).max()), 1e-6)
+
+    glMatrixMode(GL_PROJECTION)
+    gluPerspective(45, size[0] / size[1], 0.1, 100.0)
+    glMatrixMode(GL_MODELVIEW)
+    glEnable(GL_DEPTH_TEST)
+    glEnable(GL_LIGHTING)
+    glEnable(GL_LIGHT0)
+
+    def run(name, draw):
+        times = []
+        for i in range(frames):
+            pygame.event.pump()
+            t = time.perf_counter()
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            glLoadIdentity()
+            glTranslatef(0.0, 0.0, -8.0)
+            glRotatef(360.0 * i / frames, 0.3, 1.0, 0.0)
+            glScalef(scale, scale, scale)
+            glTranslatef(*-center)
+            draw()
+            glFinish()
+            times.append(time.perf_counter() - t)
+            pygame.display.flip()
+        times = np.array(times[frames // 10:])  # skip warm-up frames
+        print(f"  {name:<28} {1.0 / times.mean():8.1f} fps   {times.mean() * 1000:7.2f} ms/frame"
+              f"   p95 {np.percentile(times, 95) * 1000:7.2f} ms")
+        return times.mean()
+
+    print(f"{obj_path}: {mesh.triangle_count} triangles, {len(mesh.parts)} materials, {frames} frames")
+    scene = Wavefront(obj_path, collect_faces=True, create_materials=True)
+    before = run("pywavefront draw()", lambda: visualization.draw(scene))
+    renderer = MeshRenderer(mesh, force_lod=0)
+    after = run("MeshRenderer (GPU buffers)", renderer.draw)
+    print(f"  speedup {before / after:.1f} x")
+    for lod in range(1, len(renderer.levels)):
+        renderer.force_lod = lod
+        triangles = sum(len(part.indices) // 3 for part in mesh.levels[lod])
+        run(f"MeshRenderer LOD {lod} ({triangles})", renderer.draw)
+    renderer.delete()
+    pygame.quit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PyTeapotPlus mesh renderer")
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('obj', help="OBJ file")
+    parser.add_argument('--frames', type=int, default=300)
+    args = parser.parse_args()
+    bench(args.obj, args.frames)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+"""
+Latency and throughput instrumentation for PyTeapotPlus.
+
+Every pipeline stage records its durations into a Histogram with HDR-style
+log-linear buckets (about 1% resolution from a microsecond up to a minute in
+under 1500 counters), so recording is one bucket increment and percentiles
+cost nothing to keep. The stages are
+
+    read     pulling bytes that were already waiting off the serial port
+    parse    decoding frames or datagrams into samples
+    convert  turning the newest samples into the pose to draw (smoothing)
+    draw     issuing the frame's GL commands
+    flip     pygame.display.flip(), the GPU finishing the frame and vsync
+    latency  sensor to photon: the sample's device time, moved onto the host
+             clock by ClockOffset, to the end of the flip that showed it
+
+Sensor counters (samples, rate, drops, parse errors) are read from the
+ingest objects when metrics are exported, nothing extra runs per sample.
+
+    metrics = Metrics()
+    with metrics.timer('draw'):
+        draw(...)
+    metrics.serve(9105)             # http://127.0.0.1:9105/metrics, Prometheus text format
+    metrics.write_histograms(path)  # HdrHistogram percentile distributions
+
+Each histogram must be recorded from one thread only; readers may run on
+any thread.
+"""
+
+import math
+import threading
+import time
+from array import array
+from collections import deque
+
+import numpy as np
+
+
+STAGES = {
+    'read': "Serial port reads of waiting bytes",
+    'parse': "Decoding frames into samples",
+    'convert': "Samples to the pose to draw",
+    'draw': "Issuing the GL commands of a frame",
+    'flip': "Buffer swap including GPU finish and vsync",
+    'latency': "Sensor sample to photon",
+}
+SUB_BUCKET_BITS = 7  # 2**7 linear sub-buckets per power of two, under 1% error
+MAX_VALUE = 60.0  # seconds, larger values land in the top bucket
+EXPORT_BUCKETS = tuple(m * 10.0 ** e for e in range(-5, 1) for m in (1, 2, 5)) + (10.0,)  # Prometheus 'le' bounds
+HUD_INTERVAL = 1.0  # seconds the HUD percentiles are computed over
+CLOCK_WINDOW = 30.0  # seconds of samples the device clock offset is the minimum over
+PERCENTILES = (0, 10, 20, 30, 40, 50, 60, 70, 75, 80, 85, 90, 95, 97.5, 99, 99.5, 99.9, 99.99, 100)
+
+_HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+
+def _bucket(us):
+    """
+    Log-linear bucket of a non-negative integer value in microseconds
+    """
+    shift = us.bit_length() - SUB_BUCKET_BITS
+    if shift <= 0:
+        return us
+    return _HALF * shift + (us >> shift)
+
+
+def _bucket_range(index):
+    """
+    Lowest value and width in microseconds of a bucket
+    """
+    if index < 2 * _HALF:
+        return index, 1
+    shift = index // _HALF - 1
+    return (index - _HALF * shift) << shift, 1 << shift
+
+
+class Histogram:
+    """
+    HDR-style histogram of durations in seconds
+    """
+    def __init__(self, name, help=""):
+        self.name = name
+        self.help = help
+        size = _bucket(int(MAX_VALUE * 1e6)) + 1
+        self._counts = array('q', bytes(8 * size))  # cheap to increment from Python
+        self.counts = np.frombuffer(self._counts, np.int64)  # numpy view of the same memory
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._top = len(self.counts) - 1
+        index = np.arange(len(self.counts))
+        lows, widths = zip(*(_bucket_range(i) for i in index))
+        self.lows = np.array(lows, np.float64) / 1e6  # bucket lower bounds in seconds
+        self.mids = self.lows + np.array(widths, np.float64) / 2e6
+
+    def record(self, seconds):
+        if seconds < 0.0:
+            seconds = 0.0
+        self._counts[min(_bucket(int(seconds * 1e6)), self._top)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def record_many(self, seconds):
+        """
+        Records an array of durations at once
+        """
+        us = (np.clip(np.asarray(seconds, np.float64), 0.0, MAX_VALUE) * 1e6).astype(np.int64)
+        shift = np.maximum(np.frexp(us.astype(np.float64))[1] - SUB_BUCKET_BITS, 0)
+        index = np.where(shift > 0, _HALF * shift + (us >> shift), us)
+        self.counts += np.bincount(np.minimum(index, self._top), minlength=len(self.counts))
+        self.count += len(us)
+        self.sum += float(np.sum(seconds))
+        self.max = max(self.max, float(np.max(seconds, initial=0.0)))
+
+    def timer(self):
+        return Timer(self)
+
+    def percentile(self, p, counts=None):
+        """
+        Value in seconds below which p percent of the recorded values fall,
+        of all values or of a counts snapshot difference
+        """
+        counts = self.counts if counts is None else counts
+        cumulative = np.cumsum(counts)
+        return float(self.mids[self._index(p, cumulative)]) if cumulative[-1] else 0.0
+
+    @staticmethod
+    def _index(p, cumulative):
+        rank = max(1, math.ceil(cumulative[-1] * p / 100.0))
+        return int(np.searchsorted(cumulative, rank))
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def reset(self):
+        self.counts[:] = 0
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def cumulative(self, bounds=EXPORT_BUCKETS):
+        """
+        Counts of values up to each bound, for Prometheus 'le' buckets
+        """
+        cumulative = np.cumsum(self.counts)
+        ends = np.searchsorted(self.lows, bounds, side='right')
+        return [int(cumulative[end - 1]) if end else 0 for end in ends]
+
+    def percentile_distribution(self, unit=1e-3):
+        """
+        HdrHistogram's text percentile distribution, values divided by unit
+        (milliseconds by default)
+        """
+        lines = ["%12s %14s %10s %14s" % ('Value', 'Percentile', 'TotalCount', '1/(1-Percentile)'), ""]
+        cumulative = np.cumsum(self.counts)
+        for p in PERCENTILES:
+            index = self._index(p, cumulative) if self.count else 0
+            value = self.mids[index] / unit if self.count else 0.0
+            rank = int(cumulative[index])
+            inverse = "%14.2f" % (1.0 / (1.0 - p / 100.0)) if p < 100 else "%14s" % 'inf'
+            lines.append("%12.3f %2.12f %10d %s" % (value, p / 100.0, rank, inverse))
+        if self.count:
+            variance = float(np.sum(self.counts * (self.mids - self.mean()) ** 2)) / self.count
+        else:
+            variance = 0.0
+        lines.append("#[Mean    = %12.3f, StdDeviation   = %12.3f]" % (self.mean() / unit, math.sqrt(variance) / unit))
+        lines.append("#[Max     = %12.3f, Total count    = %12d]" % (self.max / unit, self.count))
+        return "\n".join(lines)
+
+
+class Timer:
+    """
+    Context manager recording the time spent in its block
+    """
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter() - self.start)
+
+
+class ClockOffset:
+    """
+    Estimates host time minus device time as the lower envelope of
+    (receive time - device time) over the last window seconds. The minimum
+    transport delay is folded into the offset, so latencies measured with it
+    leave out that constant part; jitter, queueing and drawing are included.
+    """
+    def __init__(self, window=CLOCK_WINDOW):
+        self.window = window
+        self._candidates = deque()  # (t_recv, offset) with increasing offsets
+
+    def update(self, t_recv, t_device):
+        offset = t_recv - t_device
+        candidates = self._candidates
+        while candidates and candidates[-1][1] >= offset:
+            candidates.pop()
+        candidates.append((t_recv, offset))
+        while candidates[0][0] < t_recv - self.window:
+            candidates.popleft()
+
+    @property
+    def offset(self):
+        return self._candidates[0][1] if self._candidates else None
+
+    def host_time(self, sample):
+        """
+        Host time a Sample was taken at, its receive time if it carries no
+        device time
+        """
+        if sample.t_device is None:
+            return sample.t_recv
+        self.update(sample.t_recv, sample.t_device)
+        return sample.t_device + self.offset
+
+
+class Metrics:
+    """
+    The stage histograms, frame counter and the sensors of one viewer.
+    sensors is a callable returning objects with name, received, rate,
+    dropped and parse_errors, such as fanin.SensorStreams or an IngestWorker.
+    """
+    def __init__(self, sensors=tuple):
+        self.histograms = {name: Histogram(name, help) for name, help in STAGES.items()}
+        self.sensors = sensors
+        self.frames = 0
+        self.fps = 0.0
+        self.started = time.monotonic()
+        self._clocks = {}
+        self._hud = []
+        self._hud_time = None
+        self._hud_frames = 0
+        self._hud_counts = {}
+        self._server = None
+
+    def __getitem__(self, name):
+        return self.histograms[name]
+
+    def timer(self, name):
+        return Timer(self.histograms[name])
+
+    def clock(self, key):
+        """
+        ClockOffset of one sensor
+        """
+        clock = self._clocks.get(key)
+        if clock is None:
+            clock = self._clocks[key] = ClockOffset()
+        return clock
+
+    def frame_shown(self, t_photon, shown):
+        """
+        Counts a flipped frame and records the latency of each sensor time
+        in shown (host times of the sensor poses drawn in it)
+        """
+        self.frames += 1
+        latency = self.histograms['latency']
+        for t in shown:
+            latency.record(t_photon - t)
+
+    def hud_lines(self):
+        """
+        Overlay text: frame rate, recent p50/p99 per stage and sensor counters,
+        refreshed every HUD_INTERVAL
+        """
+        now = time.monotonic()
+        if self._hud_time is not None and now - self._hud_time < HUD_INTERVAL:
+            return self._hud
+        if self._hud_time is not None:
+            self.fps = (self.frames - self._hud_frames) / (now - self._hud_time)
+        self._hud_time = now
+        self._hud_frames = self.frames
+        lines = ["%.1f fps      p50 / p99 ms" % self.fps]
+        for name, histogram in self.histograms.items():
+            counts = histogram.counts.copy()
+            recent = counts - self._hud_counts.get(name, 0)
+            self._hud_counts[name] = counts
+            if recent.any():
+                lines.append("%-8s %7.2f %7.2f" % (name, histogram.percentile(50, recent) * 1e3,
+                                                   histogram.percentile(99, recent) * 1e3))
+        sensors = self.sensors()
+        if len(sensors) == 1:
+            s = sensors[0]
+            lines.append("%s %.1f Hz" % (s.name, s.rate))
+        elif sensors:
+            lines.append("%d sensors %.1f Hz" % (len(sensors), sum(s.rate for s in sensors)))
+        if sensors:
+            lines.append("lost %d, parse errors %d" % (sum(s.dropped for s in sensors),
+                                                      sum(s.parse_errors for s in sensors)))
+        timings = [t for t in (getattr(s, 'timing', None) for s in sensors) if t is not None]
+        if len(timings) == 1:
+            t = timings[0]
+            lines.append("device %.1f Hz, jitter %.0f / %.0f us" % (t.rate, t.jitter, t.jitter_max))
+        elif timings:
+            lines.append("device jitter max %.0f us" % max(t.jitter_max for t in timings))
+        self._hud = lines
+        return lines
+
+    def prometheus(self):
+        """
+        Metrics in the Prometheus text exposition format
+        """
+        out = []
+        for name, histogram in self.histograms.items():
+            metric = 'pyteapot_%s_seconds' % name
+            out.append("# HELP %s %s" % (metric, histogram.help))
+            out.append("# TYPE %s histogram" % metric)
+            for bound, count in zip(EXPORT_BUCKETS, histogram.cumulative()):
+                out.append('%s_bucket{le="%g"} %d' % (metric, bound, count))
+            out.append('%s_bucket{le="+Inf"} %d' % (metric, histogram.count))
+            out.append("%s_sum %.9f" % (metric, histogram.sum))
+            out.append("%s_count %d" % (metric, histogram.count))
+        out.append("# TYPE pyteapot_frames_total counter")
+        out.append("pyteapot_frames_total %d" % self.frames)
+        out.append("# TYPE pyteapot_uptime_seconds gauge")
+        out.append("pyteapot_uptime_seconds %.3f" % (time.monotonic() - self.started))
+        sensors = self.sensors()
+        for metric, kind, attribute in (('samples_total', 'counter', 'received'),
+                                        ('dropped_total', 'counter', 'dropped'),
+                                        ('parse_errors_total', 'counter', 'parse_errors'),
+                                        ('sample_rate_hertz', 'gauge', 'rate')):
+            out.append("# TYPE pyteapot_%s %s" % (metric, kind))
+            for s in sensors:
+                out.append('pyteapot_%s{sensor="%s"} %s' % (metric, s.name, getattr(s, attribute)))
+        # sampling loop timing the firmware reports, to tell device jitter from host latency
+        timed = [s for s in sensors if getattr(s, 'timing', None) is not None]
+        for metric, kind, field, scale in (('device_sample_rate_hertz', 'gauge', 'rate', 1.0),
+                                           ('device_jitter_seconds', 'gauge', 'jitter', 1e-6),
+                                           ('device_jitter_max_seconds', 'gauge', 'jitter_max', 1e-6),
+                                           ('device_missed_deadlines_total', 'counter', 'missed', 1)):
+            if timed:
+                out.append("# TYPE pyteapot_%s %s" % (metric, kind))
+            for s in timed:
+                out.append('pyteapot_%s{sensor="%s"} %s' % (metric, s.name, getattr(s.timing, field) * scale))
+        return "\n".join(out) + "\n"
+
+    def write_histograms(self, path, unit=1e-3):
+        """
+        Writes every non-empty histogram as an HdrHistogram percentile
+        distribution, values in milliseconds by default
+        """
+        with open(path, 'w') as f:
+            for name, histogram in self.histograms.items():
+                if histogram.count:
+                    f.write("# %s: %s (%s)\n" % (name, histogram.help, 'ms' if unit == 1e-3 else 'x %g s' % unit))
+                    f.write(histogram.percentile_distribution(unit) + "\n\n")
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        Serves prometheus() at http://host:port/metrics from a daemon thread
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # only loaded when metrics are served
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="pyteapot-metrics", daemon=True).start()
+        return self._server
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
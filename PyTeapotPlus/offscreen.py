@@ -0,0 +1,433 @@
+"""
+Offscreen rendering of orientation sessions to images or video.
+
+Draws a recorded session, or the live samples on the shared memory bus,
+with the viewers' own draw() code into a framebuffer object of an EGL
+context, so it runs on servers without a display (Mesa renders in software
+if there is no GPU). Recorded sessions are rendered on their own time line
+at the output frame rate, as fast as the CPU allows; the poses between
+samples are interpolated by a PoseSmoother like in the viewers.
+
+Frames are read back asynchronously through two pixel buffer objects: the
+copy of frame n is started right after drawing it and collected after
+drawing frame n + 1. They are written as a numbered PNG sequence (PNGs are
+compressed in worker threads) or piped as raw RGBA into an encoder process,
+ENCODER by default, which needs ffmpeg on the PATH.
+
+    python offscreen.py session.ptrec --png frames/               # frames/000000.png, ...
+    python offscreen.py session.ptrec --video run.mp4 --fps 30 --render model --obj car.obj
+    python offscreen.py --bus pyteapot --duration 60 --video live.mp4
+"""
+
+import argparse
+import ctypes
+import os
+import queue
+import shlex
+import struct
+import subprocess
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+if not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY')):
+    os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')  # before anything imports OpenGL
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')  # pygame is still needed for the text
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy as np
+from OpenGL import EGL
+from OpenGL.GL import *
+
+from smoothing import PoseSmoother
+
+
+SIZE = (640, 480)  # the viewers' window size, their text is laid out for 4:3
+FPS = 30  # output frames per second of session time
+PNG_LEVEL = 6  # zlib compression level of the PNG frames, 1 is faster, 9 smaller
+ENCODER = ('ffmpeg -loglevel error -y -f rawvideo -pix_fmt rgba -s {width}x{height} -r {fps} -i - '
+           '-vf vflip -pix_fmt yuv420p -c:v libx264 -preset veryfast {output}')
+PIPE_FRAMES = 4  # frames queued for the encoder before rendering waits for it
+
+
+def egl_context(width, height):
+    """
+    Makes an OpenGL context current on an EGL pbuffer. PYOPENGL_PLATFORM must
+    be 'egl' before OpenGL is first imported.
+    """
+    display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    major, minor = EGL.EGLint(), EGL.EGLint()
+    if not EGL.eglInitialize(display, ctypes.pointer(major), ctypes.pointer(minor)):
+        raise RuntimeError("Cannot initialise EGL")
+    attributes = [EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT, EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8,
+                  EGL.EGL_BLUE_SIZE, 8, EGL.EGL_DEPTH_SIZE, 24, EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                  EGL.EGL_NONE]
+    config, count = EGL.EGLConfig(), EGL.EGLint()
+    if not EGL.eglChooseConfig(display, (EGL.EGLint * len(attributes))(*attributes), ctypes.pointer(config), 1,
+                               ctypes.pointer(count)) or not count.value:
+        raise RuntimeError("No EGL config for desktop OpenGL with a depth buffer")
+    surface = EGL.eglCreatePbufferSurface(display, config, (EGL.EGLint * 5)(EGL.EGL_WIDTH, width, EGL.EGL_HEIGHT,
+                                                                          height, EGL.EGL_NONE))
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+    if not EGL.eglMakeCurrent(display, surface, surface, context):
+        raise RuntimeError("Cannot make the EGL context current")
+    return display
+
+
+class Framebuffer:
+    """
+    Framebuffer object with an RGBA8 color and a 24 bit depth renderbuffer,
+    bound for drawing and reading while it exists
+    """
+    def __init__(self, width, height):
+        self.size = (width, height)
+        self.fbo = glGenFramebuffers(1)
+        self.color, self.depth = glGenRenderbuffers(2)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.color)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, width, height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, self.color)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.depth)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, width, height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, self.depth)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError("Incomplete framebuffer object")
+
+    def close(self):
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glDeleteRenderbuffers(2, [self.color, self.depth])
+        glDeleteFramebuffers(1, [self.fbo])
+
+
+class PixelReader:
+    """
+    Asynchronous readback through a ring of pixel buffer objects. read()
+    starts copying the frame just drawn and returns the one drawn count - 1
+    frames earlier, whose copy has had a whole frame's time to finish.
+    Pixels are bottom-up RGBA rows.
+    """
+    def __init__(self, width, height, count=2):
+        self.size = (width, height)
+        self.nbytes = width * height * 4
+        self.buffers = list(glGenBuffers(count))
+        self.pending = []  # buffers holding a started copy, oldest first
+        self._next = 0
+        for buffer in self.buffers:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+            glBufferData(GL_PIXEL_PACK_BUFFER, self.nbytes, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+
+    def read(self):
+        """
+        Starts the copy of the current frame; returns the pixels (bytes) of
+        an earlier one, or None while the ring fills up
+        """
+        buffer = self.buffers[self._next]
+        self._next = (self._next + 1) % len(self.buffers)
+        pixels = self._collect() if len(self.pending) == len(self.buffers) - 1 else None
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+        glReadPixels(0, 0, *self.size, GL_RGBA, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.pending.append(buffer)
+        return pixels
+
+    def flush(self):
+        """
+        Pixels of the frames still in flight, oldest first
+        """
+        frames = []
+        while self.pending:
+            frames.append(self._collect())
+        return frames
+
+    def _collect(self):
+        buffer = self.pending.pop(0)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+        pointer = glMapBuffer(GL_PIXEL_PACK_BUFFER, GL_READ_ONLY)
+        try:
+            return ctypes.string_at(pointer, self.nbytes)
+        finally:
+            glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+    def close(self):
+        glDeleteBuffers(len(self.buffers), self.buffers)
+
+
+def png_bytes(pixels, width, height, level=PNG_LEVEL):
+    """
+    RGB PNG file of bottom-up RGBA pixels; the viewers clear to alpha 0,
+    which would make the background transparent
+    """
+    rows = np.frombuffer(pixels, np.uint8).reshape(height, width, 4)[::-1, :, :3]
+    raw = np.zeros((height, width * 3 + 1), np.uint8)  # filter type 0 (none) in front of every row
+    raw[:, 1:] = rows.reshape(height, width * 3)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)  # 8 bit RGB
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw.tobytes(), level))
+            + chunk(b'IEND', b''))
+
+
+class PngSequence:
+    """
+    Writes frames as directory/000000.png, 000001.png, ... The compression
+    runs in a pool of threads (zlib releases the GIL), at most 2 * workers
+    frames ahead of the files on disk.
+    """
+    def __init__(self, directory, size, workers=None, level=PNG_LEVEL, pattern="%06d.png"):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.size = size
+        self.level = level
+        self.pattern = pattern
+        self.frames = 0
+        self._pool = ThreadPoolExecutor(workers or os.cpu_count())
+        self._limit = 2 * self._pool._max_workers
+        self._pending = []
+
+    def write(self, pixels):
+        path = os.path.join(self.directory, self.pattern % self.frames)
+        self.frames += 1
+        self._pending.append(self._pool.submit(self._save, path, pixels))
+        while len(self._pending) > self._limit:
+            self._pending.pop(0).result()
+
+    def _save(self, path, pixels):
+        data = png_bytes(pixels, *self.size, self.level)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def close(self):
+        for future in self._pending:
+            future.result()
+        self._pool.shutdown()
+
+
+class EncoderPipe:
+    """
+    Pipes raw bottom-up RGBA frames into an encoder process. command is a
+    format string with {width}, {height}, {fps} and {output}. A writer
+    thread feeds the pipe so rendering and encoding overlap.
+    """
+    def __init__(self, output, size, fps=FPS, command=ENCODER):
+        args = [part.format(width=size[0], height=size[1], fps=fps, output=output) for part in shlex.split(command)]
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE)
+        self.frames = 0
+        self._queue = queue.Queue(PIPE_FRAMES)
+        self._error = None
+        self._thread = threading.Thread(target=self._feed, name="offscreen-encoder", daemon=True)
+        self._thread.start()
+
+    def write(self, pixels):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(pixels)
+        self.frames += 1
+
+    def _feed(self):
+        while 1:
+            pixels = self._queue.get()
+            if pixels is None:
+                break
+            if self._error is not None:
+                continue  # keep draining so write() does not block
+            try:
+                self.process.stdin.write(pixels)
+            except OSError as e:  # the encoder died, wait() tells why
+                self._error = e
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        if self.process.wait():
+            raise RuntimeError(f"Encoder exited with status {self.process.returncode}")
+
+
+class OffscreenRenderer:
+    """
+    The drawing code of pyteapotplus.py (render='board') or pyteapot_3dm.py
+    (render='model') on a framebuffer object, frames come out of
+    render() as pixels
+    """
+    def __init__(self, size=SIZE, useQuat=True, render='board', obj=None):
+        import pygame
+        pygame.init()  # fonts for the text
+        if render == 'model':
+            import pyteapot_3dm as viewer
+            if obj:
+                viewer.OBJ_FILE = obj
+        else:
+            import pyteapotplus as viewer
+        viewer.useQuat = useQuat
+        self.viewer = viewer
+        self.size = size
+        self.display = egl_context(*size)
+        self.framebuffer = Framebuffer(*size)
+        self.reader = PixelReader(*size)
+        viewer.resizewin(*size)
+        scene = viewer.init()
+        self.scene = (scene,) if render == 'model' else ()
+
+    def render(self, values):
+        """
+        Draws one pose; returns the pixels of an earlier frame or None
+        """
+        viewer = self.viewer
+        if(viewer.useQuat):
+            viewer.draw(*self.scene, *(values or (1, 0, 0, 0)))
+        else:
+            viewer.draw(*self.scene, 1, *(values or (0, 0, 0)))
+        return self.reader.read()
+
+    def flush(self):
+        return self.reader.flush()
+
+    def close(self):
+        self.reader.close()
+        self.framebuffer.close()
+        EGL.eglTerminate(self.display)
+
+
+def session_poses(path, fps=FPS, source=None, smoothing='interpolate', start=0.0, duration=None):
+    """
+    Yields the pose of every output frame of a session log (useQuat from
+    the log): frame k shows the sensor k / fps seconds after start seconds
+    into the session
+    """
+    from session import SessionLog
+    log = SessionLog(path)
+    records = log.records
+    if source is None and log.sources:
+        source = 0
+    if source is not None:
+        if not isinstance(source, int):
+            source = log.sources.index(source)
+        records = records[records['source'] == source]
+    if not len(records):
+        return
+    width = 4 if log.useQuat else 3
+    t_recv = records['t_recv']
+    smoother = PoseSmoother(log.useQuat, extrapolate=smoothing == 'extrapolate')
+    t = t_recv[0] + start
+    end = t_recv[-1] if duration is None else min(t + duration, t_recv[-1])
+    i = 0
+    values = None
+    frame = 0
+    while t <= end:
+        while i < len(records) and t_recv[i] <= t:
+            record = records[i]
+            values = tuple(record['values'][:width].tolist())
+            if smoothing:
+                smoother.push(values, float(record['t_recv']), float(record['t_device']))
+            i += 1
+        yield smoother.pose(t) if smoothing else values
+        frame += 1
+        t = t_recv[0] + start + frame / fps
+    log.close()
+
+
+def bus_poses(name, useQuat, fps=FPS, sensor=None, smoothing='interpolate', duration=None):
+    """
+    Yields a pose every 1 / fps seconds of real time from the samples on a
+    shared memory bus, until duration seconds passed
+    """
+    from shmbus import BusReader
+    reader = BusReader(name)
+    if reader.useQuat != bool(useQuat):
+        raise ValueError(f"Bus {name!r} carries useQuat={reader.useQuat} samples")
+    smoother = PoseSmoother(useQuat, extrapolate=smoothing == 'extrapolate')
+    start = time.monotonic()
+    deadline = start
+    values = None
+    try:
+        while duration is None or deadline - start < duration:
+            for sample in reader.wait(max(0.0, deadline - time.monotonic()), sensor):
+                values = sample.values
+                if smoothing:
+                    smoother.push(sample.values, sample.t_recv, sample.t_device)
+            yield smoother.pose(deadline) if smoothing else values
+            deadline += 1.0 / fps
+            time.sleep(max(0.0, deadline - time.monotonic()))
+    finally:
+        reader.close()
+
+
+def export(poses, sink, renderer):
+    """
+    Renders every pose into sink (PngSequence or EncoderPipe); returns the
+    number of frames
+    """
+    frames = 0
+    try:
+        for values in poses:
+            pixels = renderer.render(values)
+            if pixels is not None:
+                sink.write(pixels)
+            frames += 1
+        for pixels in renderer.flush():
+            sink.write(pixels)
+    finally:
+        sink.close()
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render PyTeapotPlus sessions offscreen to PNGs or video")
+    parser.add_argument('session', nargs='?', help="session log to render")
+    parser.add_argument('--bus', metavar='NAME', help="render the live samples of a shared memory bus instead")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument('--png', metavar='DIR', help="write a numbered PNG sequence into DIR")
+    output.add_argument('--video', metavar='FILE', help="pipe the frames into the encoder")
+    parser.add_argument('--encoder', default=ENCODER, help="encoder command, with {width} {height} {fps} {output}")
+    parser.add_argument('--fps', type=float, default=FPS, help=f"output frame rate (default {FPS})")
+    parser.add_argument('--size', default="%dx%d" % SIZE, help="WIDTHxHEIGHT (default %dx%d)" % SIZE)
+    parser.add_argument('--render', choices=['board', 'model'], default='board')
+    parser.add_argument('--obj', help="OBJ file for --render model")
+    parser.add_argument('--source', help="sensor index or name in the session or on the bus (default the first)")
+    parser.add_argument('--smoothing', choices=['none', 'interpolate', 'extrapolate'], default='interpolate')
+    parser.add_argument('--start', type=float, default=0.0, help="seconds into the session to start at")
+    parser.add_argument('--duration', type=float, help="seconds to render")
+    parser.add_argument('--euler', action='store_true', help="the bus carries yaw, pitch, roll")
+    args = parser.parse_args()
+    if bool(args.session) == bool(args.bus):
+        parser.error("give either a session log or --bus")
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    smoothing = None if args.smoothing == 'none' else args.smoothing
+    source = int(args.source) if args.source and args.source.isdigit() else args.source
+    if args.session:
+        from session import SessionLog
+        log = SessionLog(args.session)
+        useQuat = log.useQuat
+        log.close()
+        poses = session_poses(args.session, args.fps, source, smoothing, args.start, args.duration)
+    else:
+        useQuat = not args.euler
+        poses = bus_poses(args.bus, useQuat, args.fps, source, smoothing, args.duration)
+    renderer = OffscreenRenderer((width, height), useQuat, args.render, args.obj)
+    if args.png:
+        sink = PngSequence(args.png, (width, height))
+    else:
+        sink = EncoderPipe(args.video, (width, height), args.fps, args.encoder)
+    print(f"Rendering with {glGetString(GL_RENDERER).decode('utf-8', 'replace')}")
+    t = time.perf_counter()
+    try:
+        frames = export(poses, sink, renderer)
+    except KeyboardInterrupt:
+        frames = sink.frames
+    elapsed = time.perf_counter() - t
+    renderer.close()
+    print(f"{frames} frames in {elapsed:.1f} s, {frames / max(elapsed, 1e-9):.1f} frames/s")
+
+
+if __name__ == '__main__':
+    main()
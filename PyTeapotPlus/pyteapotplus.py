@@ -5,57 +5,157 @@ quaternion or yaw, pitch, roll angles received over serial port and UDP.
 
 import pygame
 import math
+import time
+import sys
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from pygame.locals import *
+import quat
+import cli
+from glbuffers import StaticMesh
+from gltext import TextRenderer
+from ingest import IngestWorker, LatestSlot
+import logs
+from metrics import Metrics
+from scheduler import FrameScheduler, quantize, set_mode
+from smoothing import PoseSmoother
 
 
 # User Configurations
 # --------------------------------------------------------------------------------------------------------------------------------
 useSerial = True  # set True for using serial for data transmission, False for wifi
 useQuat = True   # set True for using quaternions, False for using y,p,r angles
-
-if(useSerial):
-    import serial
-    ser = serial.Serial('COM19', 115200, dsrdtr=False, timeout=1)  # set 'COM' if you are using Windows, otherwise as '/dev/ttyUSB0'
-else:
-    import socket
-    # Modify these two varibles acording to your UDP settings
-    UDP_IP = "192.168.1.2"
-    UDP_PORT = 5555
-    sock = socket.socket(socket.AF_INET, # Internet
-                         socket.SOCK_DGRAM) # UDP
-    sock.bind((UDP_IP, UDP_PORT))
+useBinary = False  # set True for the compact binary frames, must match 'useBinary' in config.h
+multiSensor = False  # set True to show every board sending to UDP_PORT side by side (UDP only)
+
+SERIAL_PORT = 'COM19'  # set 'COM' if you are using Windows, otherwise as '/dev/ttyUSB0'
+SERIAL_BAUD = 115200
+# Modify these two varibles acording to your UDP settings
+UDP_IP = "192.168.1.2"  # with multiSensor, "" receives the broadcasts of every board on the network
+UDP_PORT = 5555
+DISPLAY_SIZE = (640, 480)
+FPS_LIMIT = 60  # render rate cap, independent of the sensor rate; frames are only drawn when the pose changes
+VSYNC = False  # set True to flip in step with the display refresh, no tearing (FPS_LIMIT still applies)
+REFERENCE_YPR = (40.2381, -7.4261, -0.6765)  # sensor pose (yaw, pitch, roll) that reads as level, heading 0
+RECORD_FILE = None  # set a path such as "session.ptrec" to record every received sample
+REPLAY_FILE = None  # set a recorded session to play it back instead of using the serial port or UDP
+REPLAY_SPEED = 1.0  # 1.0 real time, 10.0 ten times faster, 0 as fast as possible
+BUS_NAME = None  # set "pyteapot" to show the samples of a running 'python shmbus.py publish' instead of opening the device
+BUS_SENSOR = 0  # sensor on the bus to show, index or name (not with multiSensor)
+RELAY_ADDRESS = None  # set "127.0.0.1:5700" or a Unix socket path to follow a running 'python relay.py' instead of opening the device
+SMOOTHING = 'interpolate'  # None: newest sample, 'interpolate': glide between samples, 'extrapolate': predict to hide latency
+SMOOTHING_DELAY = None  # seconds 'interpolate' renders behind the sensor, None adapts to the sample rate
+SHOW_HUD = False  # overlay of frame rate, stage timings, latency and sensor counters, H toggles it
+METRICS_PORT = None  # set a port such as 9105 to serve Prometheus metrics at http://127.0.0.1:9105/metrics
+METRICS_FILE = None  # set a path such as "timings.hgrm" to save the timing histograms on exit
+LOG_LEVEL = 'INFO'  # 'DEBUG' adds every raw serial line, 'WARNING' only reports problems
+LOG_RATES = {'sample': 5.0, 'serial': 5.0}  # console lines per second per message kind, {} for no limit
 # --------------------------------------------------------------------------------------------------------------------------------
 # User Configurations ends here
 
+text_renderer = TextRenderer()  # fonts, textures and glyph atlases are built once, on first use
+board = None  # retained axes and board geometry, built by init()
+MOUNT_OFFSET = quat.conjugate(quat.from_ypr(*REFERENCE_YPR))  # applied to every sample as MOUNT_OFFSET * q
+smoothers = {}  # PoseSmoother per sensor
+metrics = Metrics()  # stage timings, sensor to photon latency and sensor counters
+shown = {}  # per sensor, host time the pose drawn in this frame was measured at
+sample_log = logs.get('sample')  # the angles of the drawn poses
+
 
 def main():
+    global MOUNT_OFFSET
+    MOUNT_OFFSET = quat.conjugate(quat.from_ypr(*REFERENCE_YPR))  # REFERENCE_YPR may have been set by cli
+    logs.setup(LOG_LEVEL, LOG_RATES)
     video_flags = OPENGL | DOUBLEBUF
     pygame.init()
-    screen = pygame.display.set_mode((640, 480), video_flags)
+    screen = set_mode(DISPLAY_SIZE, video_flags, VSYNC)
     pygame.display.set_caption("PyTeapot IMU orientation visualization")
-    resizewin(640, 480)
+    resizewin(*DISPLAY_SIZE)
     init()
+    scheduler = FrameScheduler(FPS_LIMIT)
+    recorder = None
+    if(RECORD_FILE):
+        from session import Recorder
+        recorder = Recorder(RECORD_FILE, useQuat)
+    if(multiSensor):
+        from fanin import FanInReceiver
+        worker = FanInReceiver(UDP_IP, UDP_PORT, useQuat, binary=useBinary, recorder=recorder, metrics=metrics,
+                               notify=scheduler.wake)
+        metrics.sensors = worker.sensors
+    else:
+        slot = LatestSlot()
+        worker = IngestWorker(open_source(), slot, recorder=recorder, notify=scheduler.wake)
+        metrics.sensors = lambda: (worker,)
+    worker.start()
+    if(METRICS_PORT):
+        metrics.serve(METRICS_PORT)
+    show_hud = SHOW_HUD
     frames = 0
     ticks = pygame.time.get_ticks()
     while 1:
-        event = pygame.event.poll()
-        if event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
+        events = scheduler.wait()  # sleeps until input, a new sample or the next frame of a moving pose
+        if any(event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE) for event in events):
             break
-        if(useQuat):
-            [w, nx, ny, nz] = read_data()
-        else:
-            [yaw, pitch, roll] = read_data()
-        if(useQuat):
-            draw(w, nx, ny, nz)
-        else:
-            draw(1, yaw, pitch, roll)
-        pygame.display.flip()
+        if any(event.type == KEYDOWN and event.key == K_h for event in events):
+            show_hud = not show_hud
+            scheduler.invalidate()
+        shown.clear()
+        with metrics.timer('convert'):
+            if(multiSensor):
+                sensors = worker.sensors()
+                poses = [smoothed(stream.key, stream.slot.get()) for stream in sensors]
+            else:
+                values = smoothed(None, slot.get())
+        labels = [rate_text(stream) for stream in sensors] if multiSensor else None
+        hud = metrics.hud_lines() if show_hud else None  # new text every HUD_INTERVAL
+        if not scheduler.ready((quantize(poses if multiSensor else [values], useQuat), labels, hud)):
+            continue  # nothing moved and no text changed, keep the last frame on screen
+        with metrics.timer('draw'):
+            if(multiSensor):
+                draw_sensors(sensors, poses, *DISPLAY_SIZE)
+            elif(useQuat):
+                [w, nx, ny, nz] = values or [1, 0, 0, 0]
+                draw(w, nx, ny, nz)
+            else:
+                [yaw, pitch, roll] = values or [0, 0, 0]
+                draw(1, yaw, pitch, roll)
+            if(show_hud):
+                draw_hud(hud)
+        with metrics.timer('flip'):
+            pygame.display.flip()
+        metrics.frame_shown(time.monotonic(), shown.values())
         frames += 1
     print("fps: %d" % ((frames*1000)/(pygame.time.get_ticks()-ticks)))
+    worker.stop()
+    worker.join()
+    if not multiSensor:
+        worker.source.close()
+    if recorder is not None:
+        recorder.close()
+    if(METRICS_FILE):
+        metrics.write_histograms(METRICS_FILE)
+    metrics.close()
+    logs.shutdown()
+
+
+def open_source():
+    """
+    Opens the configured transport, the ingest worker owns it from here on
+    """
+    if(REPLAY_FILE):
+        from session import ReplaySource
+        return ReplaySource(REPLAY_FILE, REPLAY_SPEED, useQuat, loop=True)
+    if(BUS_NAME):
+        from shmbus import BusSource
+        return BusSource(BUS_NAME, useQuat, BUS_SENSOR)
+    if(RELAY_ADDRESS):
+        from relay import RelaySource
+        return RelaySource(RELAY_ADDRESS, useQuat, metrics=metrics)
     if(useSerial):
-        ser.close()
+        from ingest import SerialSource
+        return SerialSource(SERIAL_PORT, SERIAL_BAUD, useQuat, binary=useBinary, metrics=metrics)
+    from ingest import UdpSource
+    return UdpSource(UDP_IP, UDP_PORT, useQuat, binary=useBinary, metrics=metrics)
 
 
 def resizewin(width, height):
@@ -72,6 +172,23 @@ def resizewin(width, height):
     glLoadIdentity()
 
 
+def viewport(x, y, width, height):
+    """
+    Like resizewin() for one tile of the window. Tiles narrower than 4:3 get a
+    wider field of view, so the board and labels fit as in the full window.
+    """
+    aspect = 1.0*width/max(height, 1)
+    fovy = 45.0
+    if aspect < 4.0/3.0:
+        fovy = math.degrees(2 * math.atan(math.tan(math.radians(22.5)) * (4.0/3.0) / aspect))
+    glViewport(x, y, width, height)
+    glMatrixMode(GL_PROJECTION)
+    glLoadIdentity()
+    gluPerspective(fovy, aspect, 0.1, 100.0)
+    glMatrixMode(GL_MODELVIEW)
+    glLoadIdentity()
+
+
 def init():
     glShadeModel(GL_SMOOTH)
     glClearColor(0.0, 0.0, 0.0, 0.0)
@@ -79,160 +196,66 @@ def init():
     glEnable(GL_DEPTH_TEST)
     glDepthFunc(GL_LEQUAL)
     glHint(GL_PERSPECTIVE_CORRECTION_HINT, GL_NICEST)
+    global board
+    board = build_board()
 
 
-def cleanSerialBegin():
-    if(useQuat):
-        try:
-            line = ser.readline().decode('UTF-8').replace('\n', '')
-            w = float(line.split('w')[1])
-            nx = float(line.split('a')[1])
-            ny = float(line.split('b')[1])
-            nz = float(line.split('c')[1])
-        except Exception:
-            pass
-    else:
-        try:
-            line = ser.readline().decode('UTF-8').replace('\n', '') 
-            roll = float(line.split('y')[1])
-            pitch = float(line.split('p')[1])
-            yaw = float(line.split('r')[1])
-        except Exception:
-            pass
-
-
-def read_data():
-    if(useSerial):
-        ser.reset_input_buffer()
-        cleanSerialBegin()
-        line = ser.readline().decode('UTF-8').replace('\n', '')
-        print(line)
-    else:
-        # Waiting for data from udp port 5555
-        data, addr = sock.recvfrom(1024) # buffer size is 1024 bytes
-        line = data.decode('UTF-8').replace('\n', '')
-        # print(line)
-            
-    if(useQuat):
-        try:
-            w = float(line.split('w')[1])
-            nx = float(line.split('a')[1])
-            ny = float(line.split('b')[1])
-            nz = float(line.split('c')[1])
-            return [w, nx, ny, nz]
-        except Exception:
-            return [0, 0, 0, 1]
-    else:
-        try:
-            yaw = float(line.split('y')[1])
-            pitch = float(line.split('p')[1])
-            roll = float(line.split('r')[1])
-            print(f"Roll={roll:.4f}, Pitch={pitch:.4f}, Yaw={yaw:.4f}")
-            return [yaw, pitch, roll]
-        except Exception:
-            return [0, 0, 0]
-
-
-def draw_arrow_tips(length, size):
+def arrow_tip_vertices(length, size):
     """
-    Draws simple line-based arrow tips for the axes.
+    Simple line-based arrow tips for the axes, as (r, g, b, x, y, z) rows.
     """
-    glBegin(GL_LINES)
-
-    # Y arrow tip (blue)
-    glColor3f(0.0, 0.0, 1.0)
-    glVertex3f(-length, 0.0, 0.0)
-    glVertex3f(-length + size, 0.0, size)
-    glVertex3f(-length, 0.0, 0.0)
-    glVertex3f(-length + size, 0.0, -size)
-
-    # Z arrow tip (green)
-    glColor3f(0.0, 1.0, 0.0)
-    glVertex3f(0.0, length, 0.0)
-    glVertex3f(size, length - size, 0.0)
-    glVertex3f(0.0, length, 0.0)
-    glVertex3f(-size, length - size, 0.0)
-
-    # X arrow tip (red)
-    glColor3f(1.0, 0.0, 0.0)
-    glVertex3f(0.0, 0.0, -length - 0.5)
-    glVertex3f(0.0, size, size - length - 0.5)
-    glVertex3f(0.0, 0.0, -length - 0.5)
-    glVertex3f(0.0, -size, size - length - 0.5)
-
-    glEnd()
-
-
-def draw_axes(length=2, line_width=3.0, arrow_width=2.0, arrow_size=0.2):
+    blue, green, red = (0.0, 0.0, 1.0), (0.0, 1.0, 0.0), (1.0, 0.0, 0.0)
+    return [
+        # Y arrow tip (blue)
+        (*blue, -length, 0.0, 0.0), (*blue, -length + size, 0.0, size),
+        (*blue, -length, 0.0, 0.0), (*blue, -length + size, 0.0, -size),
+        # Z arrow tip (green)
+        (*green, 0.0, length, 0.0), (*green, size, length - size, 0.0),
+        (*green, 0.0, length, 0.0), (*green, -size, length - size, 0.0),
+        # X arrow tip (red)
+        (*red, 0.0, 0.0, -length - 0.5), (*red, 0.0, size, size - length - 0.5),
+        (*red, 0.0, 0.0, -length - 0.5), (*red, 0.0, -size, size - length - 0.5),
+    ]
+
+
+def axes_vertices(length):
     """
-    Draws the X, Y, and Z axes at the origin (0, 0, 0).
+    The X, Y, and Z axes at the origin (0, 0, 0), as (r, g, b, x, y, z) rows.
     For BNO055's absolute orientation
     X axis is red, Y axis is blue, Z axis is green.
     """
-    glLineWidth(line_width)
-    glBegin(GL_LINES)
-
-    # Y axis (blue)
-    glColor3f(0.0, 0.0, 1.0)
-    glVertex3f(0.0, 0.0, 0.0)
-    glVertex3f(-length, 0.0, 0.0) # Line to y=-2
-
-    # Z axis (green)
-    glColor3f(0.0, 1.0, 0.0)
-    glVertex3f(0.0, 0.0, 0.0)
-    glVertex3f(0.0, length, 0.0) # Line to z=2
-
-    # X axis (red)
-    glColor3f(1.0, 0.0, 0.0)
-    glVertex3f(0.0, 0.0, 0.0)
-    glVertex3f(0.0, 0.0, -length-0.5) # Line to x=-2.5
-    glEnd()
-    
-    glLineWidth(arrow_width)
-    draw_arrow_tips(length, arrow_size)
-
-    
-    
-    
-def draw_surface():
-    glBegin(GL_QUADS)
-    glColor3f(0.0, 1.0, 0.0)
-    glVertex3f(1.0, 0.2, -1.0)
-    glVertex3f(-1.0, 0.2, -1.0)
-    glVertex3f(-1.0, 0.2, 1.0)
-    glVertex3f(1.0, 0.2, 1.0)
-
-    glColor3f(1.0, 0.5, 0.0)
-    glVertex3f(1.0, -0.2, 1.0)
-    glVertex3f(-1.0, -0.2, 1.0)
-    glVertex3f(-1.0, -0.2, -1.0)
-    glVertex3f(1.0, -0.2, -1.0)
-
-    glColor3f(1.0, 0.0, 0.0)
-    glVertex3f(1.0, 0.2, 1.0)
-    glVertex3f(-1.0, 0.2, 1.0)
-    glVertex3f(-1.0, -0.2, 1.0)
-    glVertex3f(1.0, -0.2, 1.0)
-
-    glColor3f(1.0, 1.0, 0.0)
-    glVertex3f(1.0, -0.2, -1.0)
-    glVertex3f(-1.0, -0.2, -1.0)
-    glVertex3f(-1.0, 0.2, -1.0)
-    glVertex3f(1.0, 0.2, -1.0)
-
-    glColor3f(0.0, 0.0, 1.0)
-    glVertex3f(-1.0, 0.2, 1.0)
-    glVertex3f(-1.0, 0.2, -1.0)
-    glVertex3f(-1.0, -0.2, -1.0)
-    glVertex3f(-1.0, -0.2, 1.0)
-
-    glColor3f(1.0, 0.0, 1.0)
-    glVertex3f(1.0, 0.2, -1.0)
-    glVertex3f(1.0, 0.2, 1.0)
-    glVertex3f(1.0, -0.2, 1.0)
-    glVertex3f(1.0, -0.2, -1.0)
-    
-    glEnd()
+    return [
+        (0.0, 0.0, 1.0, 0.0, 0.0, 0.0), (0.0, 0.0, 1.0, -length, 0.0, 0.0),  # Y axis (blue), line to y=-2
+        (0.0, 1.0, 0.0, 0.0, 0.0, 0.0), (0.0, 1.0, 0.0, 0.0, length, 0.0),  # Z axis (green), line to z=2
+        (1.0, 0.0, 0.0, 0.0, 0.0, 0.0), (1.0, 0.0, 0.0, 0.0, 0.0, -length-0.5),  # X axis (red), line to x=-2.5
+    ]
+
+
+def surface_vertices():
+    """
+    The board, one color per face, as (r, g, b, x, y, z) rows.
+    """
+    faces = [
+        ((0.0, 1.0, 0.0), [(1.0, 0.2, -1.0), (-1.0, 0.2, -1.0), (-1.0, 0.2, 1.0), (1.0, 0.2, 1.0)]),
+        ((1.0, 0.5, 0.0), [(1.0, -0.2, 1.0), (-1.0, -0.2, 1.0), (-1.0, -0.2, -1.0), (1.0, -0.2, -1.0)]),
+        ((1.0, 0.0, 0.0), [(1.0, 0.2, 1.0), (-1.0, 0.2, 1.0), (-1.0, -0.2, 1.0), (1.0, -0.2, 1.0)]),
+        ((1.0, 1.0, 0.0), [(1.0, -0.2, -1.0), (-1.0, -0.2, -1.0), (-1.0, 0.2, -1.0), (1.0, 0.2, -1.0)]),
+        ((0.0, 0.0, 1.0), [(-1.0, 0.2, 1.0), (-1.0, 0.2, -1.0), (-1.0, -0.2, -1.0), (-1.0, -0.2, 1.0)]),
+        ((1.0, 0.0, 1.0), [(1.0, 0.2, -1.0), (1.0, 0.2, 1.0), (1.0, -0.2, 1.0), (1.0, -0.2, -1.0)]),
+    ]
+    return [(*color, *vertex) for color, vertices in faces for vertex in vertices]
+
+
+def build_board(length=2, line_width=3.0, arrow_width=2.0, arrow_size=0.2, use_vbo=None):
+    """
+    Builds the axes, arrow tips and board once into a retained mesh
+    """
+    mesh = StaticMesh(GL_C3F_V3F, use_vbo)
+    mesh.add(GL_LINES, axes_vertices(length), line_width)
+    mesh.add(GL_LINES, arrow_tip_vertices(length, arrow_size), arrow_width)
+    mesh.add(GL_QUADS, surface_vertices())
+    mesh.upload()
+    return mesh
 
 
 def draw(w, nx, ny, nz):
@@ -243,47 +266,105 @@ def draw(w, nx, ny, nz):
     drawText((-2.6, 1.8, 2), "PyTeapotPlus", 18)
     drawText((-2.6, 1.6, 2), "Module to visualize quaternion or Euler angles data", 16)
     drawText((-2.6, -2, 2), "Press Escape to exit.", 16)
+    draw_board(w, nx, ny, nz)
+
 
+def draw_board(w, nx, ny, nz, name=True):
+    """
+    Draws the angles readout and the rotated board, name keys the readout
+    text when several boards are drawn
+    """
     if(useQuat):
         [yaw, pitch , roll] = quat_to_ypr([w, nx, ny, nz])
-        print(f"Yaw={yaw:.4f}, Pitch={pitch:.4f}, Roll={roll:.4f}")
-        drawText((-2.6, -1.8, 2), "Yaw: %f, Pitch: %f, Roll: %f" %(yaw, pitch, roll), 16)
-        glRotatef(2 * math.acos(w) * 180.00/math.pi, -ny, nz, -nx)
+        sample_log.info("Yaw=%.4f, Pitch=%.4f, Roll=%.4f", yaw, pitch, roll)
+        drawText((-2.6, -1.8, 2), "Yaw: %f, Pitch: %f, Roll: %f" %(yaw, pitch, roll), 16, dynamic=name)
+        glMultMatrixf(quat.gl_matrix([w, -ny, nz, -nx]))  # sensor x, y, z are the board's -z, -x, y
     else:
         yaw = nx
         pitch = ny
         roll = nz
-        drawText((-2.6, -1.8, 2), "Yaw: %f, Pitch: %f, Roll: %f" %(yaw, pitch, roll), 16)
-        glRotatef(-roll, 0.00, 0.00, 1.00)
-        glRotatef(pitch, 1.00, 0.00, 0.00)
-        glRotatef(yaw, 0.00, 1.00, 0.00)
-    draw_axes()
-    draw_surface()
+        drawText((-2.6, -1.8, 2), "Yaw: %f, Pitch: %f, Roll: %f" %(yaw, pitch, roll), 16, dynamic=name)
+        rotation = quat.multiply(quat.multiply(quat.from_axis_angle(quat.Z_AXIS, -roll),
+                                               quat.from_axis_angle(quat.X_AXIS, pitch)),
+                                 quat.from_axis_angle(quat.Y_AXIS, yaw))
+        glMultMatrixf(quat.gl_matrix(rotation))
+    board.draw()
+
+
+def rate_text(stream):
+    """
+    Receive rate and losses of a sensor as its label shows them
+    """
+    return "%.1f Hz, lost %d (%.1f%%)" % (stream.rate, stream.dropped, 100 * stream.loss)
+
+
+def draw_sensors(sensors, poses, width, height):
+    """
+    Draws one board per sensor side by side at its pose from smoothed(), each
+    labelled with its address, receive rate and losses
+    """
+    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+    if not sensors:
+        glLoadIdentity()
+        glTranslatef(0, 0.0, -7.0)
+        drawText((-2.6, 1.8, 2), "Waiting for sensors on UDP port %d ..." % UDP_PORT, 18)
+        return
+    from fanin import tile  # loaded with the FanInReceiver
+    for stream, values, cell in zip(sensors, poses, tile(len(sensors), width, height)):
+        viewport(*cell)
+        glTranslatef(0, 0.0, -7.0)
+        drawText((-2.6, 1.8, 2), stream.name, 16)
+        drawText((-2.6, 1.6, 2), rate_text(stream), 16, dynamic=(stream.key, 'rate'))
+        if(useQuat):
+            [w, nx, ny, nz] = values or [1, 0, 0, 0]
+        else:
+            w = 1
+            [nx, ny, nz] = values or [0, 0, 0]
+        draw_board(w, nx, ny, nz, name=(stream.key, 'angles'))
+    resizewin(width, height)
+
+
+
+def smoothed(key, sample):
+    """
+    Values to draw for a sensor: the newest sample, or the pose its
+    PoseSmoother gives for this frame. Notes the time the pose was measured
+    for the latency histogram.
+    """
+    if not SMOOTHING:
+        if sample is None:
+            return None
+        shown[key] = metrics.clock(key).host_time(sample)
+        return sample.values
+    smoother = smoothers.get(key)
+    if smoother is None:
+        smoother = smoothers[key] = PoseSmoother(useQuat, SMOOTHING_DELAY, SMOOTHING == 'extrapolate')
+    values = smoother.update(sample)
+    if smoother.shown is not None:
+        shown[key] = smoother.shown
+    return values
+
+
+def draw_hud(lines):
+    """
+    Draws the metrics overlay in the top right corner of the window
+    """
+    glLoadIdentity()
+    glTranslatef(0, 0.0, -7.0)
+    for i, line in enumerate(lines):
+        drawText((0.4, 1.3 - 0.15 * i, 2), line, 14, dynamic=('hud', i))
 
 
+def drawText(position, textString, size, dynamic=False):
+    text_renderer.draw(position, textString, size, dynamic)
 
-def drawText(position, textString, size):
-    font = pygame.font.SysFont("Courier", size, True)
-    textSurface = font.render(textString, True, (255, 255, 255, 255), (0, 0, 0, 255))
-    textData = pygame.image.tobytes(textSurface, "RGBA", True)
-    glRasterPos3d(*position)
-    glDrawPixels(textSurface.get_width(), textSurface.get_height(), GL_RGBA, GL_UNSIGNED_BYTE, textData)
 
 def quat_to_ypr(q):
-    ## Default conversion method
-    yaw   = math.atan2(2.0 * (q[1] * q[2] + q[0] * q[3]), q[0] * q[0] + q[1] * q[1] - q[2] * q[2] - q[3] * q[3])
-    pitch = math.asin(2.0 * (q[1] * q[3] - q[0] * q[2]))
-    roll  = math.atan2(2.0 * (q[0] * q[1] + q[2] * q[3]), q[0] * q[0] - q[1] * q[1] - q[2] * q[2] + q[3] * q[3])
-    pitch *= -180.0 / math.pi
-    yaw   *= 180.0 / math.pi
-    roll  *= 180.0 / math.pi
-    # yaw   -= -0.13  # Declination at Chandrapur, Maharashtra is - 0 degress 13 min
-    # return [yaw, pitch, roll]
-    yaw -= 40.2381
-    pitch += 7.4261
-    roll += 0.6765
-    return [yaw, pitch, roll]  # For BNO055
+    """
+    Yaw, pitch, roll in degrees of a sample, relative to REFERENCE_YPR
+    """
+    return quat.to_ypr(quat.multiply(MOUNT_OFFSET, q)).tolist()
 
 
 if __name__ == '__main__':
-    main()
+    cli.main(viewer='cube', module=sys.modules[__name__])
@@ -0,0 +1,235 @@
+"""
+Quaternion math for PyTeapotPlus.
+
+Quaternions are (w, x, y, z) arrays with any number of leading dimensions,
+so the same functions convert one sample per frame in the viewers and
+millions of logged samples at once in offline analysis. Angles are degrees,
+Euler angles are the BNO055's yaw (about z), pitch (about y), roll (about x)
+applied in that order (Z-Y-X, intrinsic), matrices act on column vectors.
+
+    q = quat.from_ypr(yaw, pitch, roll)          # arrays of N angles -> (N, 4)
+    ypr = quat.to_ypr(quat.multiply(offset, q))  # (N, 3)
+    glMultMatrixf(quat.gl_matrix(q[-1]))
+
+    python quat.py bench                         # conversions per second
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+
+X_AXIS = (1.0, 0.0, 0.0)
+Y_AXIS = (0.0, 1.0, 0.0)
+Z_AXIS = (0.0, 0.0, 1.0)
+IDENTITY = np.array([1.0, 0.0, 0.0, 0.0])
+GIMBAL_LOCK = 1.0 - 1e-12  # |sin(pitch)| above which to_ypr() takes pitch as exactly +-90 degrees
+
+
+def _split(q):
+    q = np.asarray(q, np.float64)
+    return q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+
+
+def normalize(q):
+    """
+    Unit quaternions with w >= 0; an all-zero quaternion becomes the identity
+    """
+    q = np.array(q, np.float64)
+    norm = np.linalg.norm(q, axis=-1, keepdims=True)
+    zero = norm[..., 0] == 0
+    q[zero] = IDENTITY
+    norm[zero] = 1.0
+    q /= norm
+    return np.where(q[..., :1] < 0, -q, q)
+
+
+def conjugate(q):
+    """
+    Inverse rotation of a unit quaternion
+    """
+    return np.asarray(q, np.float64) * (1.0, -1.0, -1.0, -1.0)
+
+
+def multiply(a, b):
+    """
+    Hamilton product a * b, the rotation b followed by a
+    """
+    aw, ax, ay, az = _split(a)
+    bw, bx, by, bz = _split(b)
+    return np.stack([aw * bw - ax * bx - ay * by - az * bz,
+                     aw * bx + ax * bw + ay * bz - az * by,
+                     aw * by - ax * bz + ay * bw + az * bx,
+                     aw * bz + ax * by - ay * bx + az * bw], -1)
+
+
+def from_axis_angle(axis, angle):
+    """
+    Rotation by angle degrees about axis (need not be unit length)
+    """
+    axis = np.asarray(axis, np.float64)
+    norm = np.linalg.norm(axis, axis=-1, keepdims=True)
+    half = np.radians(np.asarray(angle, np.float64))[..., None] / 2
+    return np.concatenate([np.cos(half), np.sin(half) * axis / np.where(norm > 0, norm, 1.0)], -1)
+
+
+def from_ypr(yaw, pitch, roll):
+    """
+    Quaternion of Z-Y-X Euler angles in degrees
+    """
+    hy, hp, hr = (np.radians(np.asarray(a, np.float64)) / 2 for a in (yaw, pitch, roll))
+    cy, sy = np.cos(hy), np.sin(hy)
+    cp, sp = np.cos(hp), np.sin(hp)
+    cr, sr = np.cos(hr), np.sin(hr)
+    return np.stack([cr * cp * cy + sr * sp * sy,
+                     sr * cp * cy - cr * sp * sy,
+                     cr * sp * cy + sr * cp * sy,
+                     cr * cp * sy - sr * sp * cy], -1)
+
+
+def to_ypr(q):
+    """
+    (..., 3) yaw, pitch, roll in degrees of unit quaternions. At pitch +-90
+    degrees yaw and roll are not unique and the whole turn goes to yaw.
+    """
+    w, x, y, z = _split(q)
+    sin_pitch = np.clip(2.0 * (w * y - x * z), -1.0, 1.0)
+    yaw = np.arctan2(2.0 * (x * y + w * z), w * w + x * x - y * y - z * z)
+    roll = np.arctan2(2.0 * (w * x + y * z), w * w - x * x - y * y + z * z)
+    locked = np.abs(sin_pitch) > GIMBAL_LOCK
+    if np.any(locked):  # both arctan2 above only see rounding noise there
+        sin_pitch = np.where(locked, np.sign(sin_pitch), sin_pitch)
+        yaw = np.where(locked, np.arctan2(2.0 * (w * z - x * y), w * w - x * x + y * y - z * z), yaw)
+        roll = np.where(locked, 0.0, roll)
+    return np.degrees(np.stack([yaw, np.arcsin(sin_pitch), roll], -1))
+
+
+def to_matrix(q):
+    """
+    (..., 3, 3) rotation matrices, q is normalised on the way
+    """
+    w, x, y, z = _split(q)
+    s = 2.0 / np.maximum(w * w + x * x + y * y + z * z, np.finfo(np.float64).tiny)
+    return np.stack([
+        np.stack([1 - s * (y * y + z * z), s * (x * y - w * z), s * (x * z + w * y)], -1),
+        np.stack([s * (x * y + w * z), 1 - s * (x * x + z * z), s * (y * z - w * x)], -1),
+        np.stack([s * (x * z - w * y), s * (y * z + w * x), 1 - s * (x * x + y * y)], -1),
+    ], -2)
+
+
+def from_matrix(m):
+    """
+    Unit quaternions (w >= 0) of (..., 3, 3) rotation matrices, taking the
+    numerically best of the four Shepperd cases per matrix
+    """
+    m = np.asarray(m, np.float64)
+    trace = m[..., 0, 0] + m[..., 1, 1] + m[..., 2, 2]
+    candidates = np.stack([
+        np.stack([1 + trace, m[..., 2, 1] - m[..., 1, 2], m[..., 0, 2] - m[..., 2, 0], m[..., 1, 0] - m[..., 0, 1]], -1),
+        np.stack([m[..., 2, 1] - m[..., 1, 2], 1 + 2 * m[..., 0, 0] - trace, m[..., 0, 1] + m[..., 1, 0],
+                  m[..., 0, 2] + m[..., 2, 0]], -1),
+        np.stack([m[..., 0, 2] - m[..., 2, 0], m[..., 0, 1] + m[..., 1, 0], 1 + 2 * m[..., 1, 1] - trace,
+                  m[..., 1, 2] + m[..., 2, 1]], -1),
+        np.stack([m[..., 1, 0] - m[..., 0, 1], m[..., 0, 2] + m[..., 2, 0], m[..., 1, 2] + m[..., 2, 1],
+                  1 + 2 * m[..., 2, 2] - trace], -1),
+    ], -2)
+    diagonal = np.stack([trace, m[..., 0, 0], m[..., 1, 1], m[..., 2, 2]], -1)
+    best = np.take_along_axis(candidates, np.argmax(diagonal, -1)[..., None, None], -2)[..., 0, :]
+    return normalize(best)
+
+
+def slerp(a, b, u):
+    """
+    Spherical linear interpolation from a (u = 0) to b (u = 1) along the
+    shorter arc; u outside [0, 1] extrapolates along the same great circle
+    """
+    a = np.asarray(a, np.float64)
+    b = np.asarray(b, np.float64)
+    u = np.asarray(u, np.float64)[..., None]
+    dot = np.sum(a * b, -1, keepdims=True)
+    b = np.where(dot < 0, -b, b)
+    theta = np.arccos(np.clip(np.abs(dot), 0.0, 1.0))
+    sin_theta = np.sin(theta)
+    near = sin_theta < 1e-6  # (almost) the same rotation, plain lerp is exact enough
+    safe = np.where(near, 1.0, sin_theta)
+    wa = np.where(near, 1.0 - u, np.sin((1.0 - u) * theta) / safe)
+    wb = np.where(near, u, np.sin(u * theta) / safe)
+    return normalize(wa * a + wb * b)
+
+
+def angle_between(a, b):
+    """
+    Rotation angle in degrees between unit quaternions
+    """
+    dot = np.abs(np.sum(np.asarray(a, np.float64) * np.asarray(b, np.float64), -1))
+    return np.degrees(2.0 * np.arccos(np.clip(dot, 0.0, 1.0)))
+
+
+def to_rotvec(q):
+    """
+    (..., 3) rotation vectors (axis times angle in radians) of unit quaternions
+    """
+    q = normalize(q)
+    sin_half = np.linalg.norm(q[..., 1:], axis=-1, keepdims=True)
+    angle = 2.0 * np.arctan2(sin_half, q[..., :1])
+    scale = np.where(sin_half > 1e-12, angle / np.where(sin_half > 1e-12, sin_half, 1.0), 2.0)
+    return q[..., 1:] * scale
+
+
+def from_rotvec(v):
+    """
+    Unit quaternions of (..., 3) rotation vectors
+    """
+    v = np.asarray(v, np.float64)
+    angle = np.linalg.norm(v, axis=-1, keepdims=True)
+    half = angle / 2.0
+    scale = np.where(angle > 1e-12, np.sin(half) / np.where(angle > 1e-12, angle, 1.0), 0.5)
+    return np.concatenate([np.cos(half), v * scale], -1)
+
+
+def ypr_to_matrix(yaw, pitch, roll):
+    return to_matrix(from_ypr(yaw, pitch, roll))
+
+
+def matrix_to_ypr(m):
+    return to_ypr(from_matrix(m))
+
+
+def gl_matrix(q):
+    """
+    4x4 float32 matrix of one quaternion, laid out column-major for
+    glMultMatrixf()
+    """
+    m = np.zeros((4, 4), np.float32)
+    m[:3, :3] = to_matrix(q).T  # transposed = column-major order in memory
+    m[3, 3] = 1.0
+    return m
+
+
+def bench(n=1_000_000, repeat=5):
+    rng = np.random.default_rng(1)
+    q = normalize(rng.normal(size=(n, 4)))
+    ypr = to_ypr(q)
+    m = to_matrix(q)
+    for name, func, arg in (("to_ypr", to_ypr, q), ("from_ypr", lambda a: from_ypr(*a.T), ypr),
+                            ("multiply", lambda a: multiply(a, a), q), ("to_matrix", to_matrix, q),
+                            ("from_matrix", from_matrix, m), ("normalize", normalize, q)):
+        best = float('inf')
+        for _ in range(repeat):
+            t = time.perf_counter()
+            func(arg)
+            best = min(best, time.perf_counter() - t)
+        print(f"  {name:<12} {n / best / 1e6:8.1f} M samples/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PyTeapotPlus quaternion math")
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('-n', type=int, default=1_000_000, help="samples per batch (default 1000000)")
+    args = parser.parse_args()
+    bench(args.n)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+"""
+Sample relay for PyTeapotPlus.
+
+Only one process can open the board's serial port or bind its UDP port. The
+relay is that process: it ingests the samples once and serves them to any
+number of local clients over TCP or a Unix socket, so the cube viewer, the
+model viewer and a logger can all follow the same board. The viewers
+connect with RELAY_ADDRESS, other programs with a RelaySource.
+
+    python relay.py --serial COM19                          # serves on 127.0.0.1:5700
+    python relay.py --udp 0.0.0.0:5555 --binary --listen /tmp/pyteapot.sock
+
+Samples go out as frames of the binary wire protocol (wire.py), numbered by
+the relay, so clients reuse the BinaryFramer and count what they missed from
+the sequence gaps. A sample without device time or calibration goes out
+flagged as such (wire.FLAG_NO_TIME, FLAG_NO_CAL) and reaches the clients as
+None again, not as made-up values. Every client has its own queue of at most
+QUEUE_FRAMES frames; a client that falls behind has its queue collapsed to
+the newest sample, so it jumps to the current pose instead of replaying old
+ones, and neither the ingest thread nor the other clients ever wait for it.
+Socket send buffers are kept to SEND_BUFFER bytes for the same reason: the
+kernel would otherwise queue seconds of stale samples for a stalled client.
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+import logs
+from frameparser import FrameError
+from ingest import binary_reading
+from wire import KIND_QUAT, KIND_YPR, BinaryFramer, encode
+
+
+ADDRESS = '127.0.0.1:5700'  # TCP host:port, or the path of a Unix socket
+QUEUE_FRAMES = 32  # frames queued per client before its queue collapses to the newest
+SEND_BUFFER = 4096  # bytes, socket send buffer and asyncio write buffer limit per client
+
+log = logs.get('relay')
+
+
+def parse_address(address):
+    """
+    (host, port) of 'host:port', or a Unix socket path unchanged
+    """
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and '/' not in address:
+        return (host or '127.0.0.1', int(port))
+    return address
+
+
+class RelayClient:
+    """
+    Outbound queue of one connected client, touched by the event loop only
+    """
+    def __init__(self, writer, limit):
+        self.writer = writer
+        self.limit = limit
+        self.name = str(writer.get_extra_info('peername') or "unix client")
+        self.frames = deque()
+        self.sent = 0
+        self.coalesced = 0  # frames skipped because the client was behind
+        self.ready = asyncio.Event()
+        self.task = asyncio.current_task()
+
+    def offer(self, frame):
+        if len(self.frames) >= self.limit:
+            self.coalesced += len(self.frames)
+            self.frames.clear()
+        self.frames.append(frame)
+        self.ready.set()
+
+
+class RelayServer(threading.Thread):
+    """
+    Daemon thread serving the samples written to it to every client. Has the
+    interface of session.Recorder, so it plugs into an IngestWorker as
+    IngestWorker(source, slot, recorder=relay); write() may be called from
+    any one thread.
+    """
+    def __init__(self, address=ADDRESS, useQuat=True, queue_frames=QUEUE_FRAMES):
+        super().__init__(name="pyteapot-relay", daemon=True)
+        self.address = parse_address(address)
+        self.kind = KIND_QUAT if useQuat else KIND_YPR
+        self.queue_frames = queue_frames
+        self.clients = set()
+        self.count = 0
+        self._loop = None
+        self._stop_event = None
+        self._ready = threading.Event()
+        self._error = None
+
+    def start(self):
+        """
+        Starts the thread and returns once the server listens
+        """
+        super().start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def run(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        try:
+            if isinstance(self.address, tuple):
+                server = await asyncio.start_server(self._client, *self.address)
+            else:
+                server = await asyncio.start_unix_server(self._client, self.address)
+        except OSError as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        async with server:
+            await self._stop_event.wait()
+            # Server.wait_closed() waits for open connections from Python 3.12 on, so end them first
+            server.close()
+            tasks = [client.task for client in self.clients]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if not isinstance(self.address, tuple) and os.path.exists(self.address):
+            os.remove(self.address)
+
+    async def _client(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        writer.transport.set_write_buffer_limits(high=SEND_BUFFER)
+        client = RelayClient(writer, self.queue_frames)
+        self.clients.add(client)
+        log.info("Client %s connected, %d connected", client.name, len(self.clients))
+        try:
+            while 1:
+                await client.ready.wait()
+                client.ready.clear()
+                data = b''.join(client.frames)
+                client.sent += len(client.frames)
+                client.frames.clear()
+                writer.write(data)
+                await writer.drain()
+        except OSError:  # ConnectionResetError, BrokenPipeError: the client went away
+            pass
+        except asyncio.CancelledError:  # the relay stops
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+            log.info("Client %s disconnected after %d samples, %d skipped while it was behind",
+                     client.name, client.sent, client.coalesced)
+
+    def _broadcast(self, frame):
+        for client in self.clients:
+            client.offer(frame)
+
+    def source_id(self, name):
+        return 0
+
+    def write(self, values, t_recv, t_device=None, cal=None, source=0):
+        self.count += 1
+        millis = None if t_device is None else int(round(1000.0 * t_device))  # None goes out as unknown, like cal
+        frame = encode(self.count, millis, values, self.kind, cal)
+        try:
+            self._loop.call_soon_threadsafe(self._broadcast, frame)
+        except (AttributeError, RuntimeError):  # not started or already stopped
+            pass
+
+    def flush(self):
+        pass
+
+    def stop(self):
+        if self._loop is None or not self.is_alive():
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+        except RuntimeError:  # the loop already ended
+            pass
+
+    def close(self):
+        self.stop()
+        if self.is_alive():
+            self.join()
+
+
+class RelaySource:
+    """
+    Client transport with the interface of SerialSource: connects to a relay
+    (again after it restarts) and decodes its frames. dropped counts the
+    samples skipped because this client was behind.
+    """
+    def __init__(self, address=ADDRESS, useQuat=True, timeout=0.1, metrics=None):
+        self.address = parse_address(address)
+        self.useQuat = useQuat
+        self.timeout = timeout
+        self.metrics = metrics
+        self.parse_errors = 0
+        self.name = f"relay {address}"
+        self.framer = BinaryFramer()
+        self.sock = None
+
+    @property
+    def dropped(self):
+        return self.framer.seq.dropped
+
+    def connect(self):
+        family = socket.AF_INET if isinstance(self.address, tuple) else socket.AF_UNIX
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SEND_BUFFER)  # before connect(), or TCP grows it
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        self.framer = BinaryFramer()  # the relay numbers its samples afresh after a restart
+
+    def read(self):
+        """
+        Returns a list of Readings, empty if nothing complete arrived; raises
+        OSError while the relay cannot be reached
+        """
+        if self.sock is None:
+            self.connect()
+        try:
+            data = self.sock.recv(65536)
+        except TimeoutError:
+            return []
+        if not data:  # the relay closed the connection
+            self.sock.close()
+            self.sock = None
+            raise ConnectionResetError(f"{self.name} closed the connection")
+        t0 = time.perf_counter()
+        readings = []
+        for frame in self.framer.feed(data):
+            try:
+                readings.append(binary_reading(frame, self.useQuat))
+            except FrameError:
+                self.parse_errors += 1
+        self.parse_errors += self.framer.crc_errors
+        self.framer.crc_errors = 0
+        if self.metrics is not None:
+            self.metrics['parse'].record(time.perf_counter() - t0)
+        return readings
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def main():
+    from ingest import IngestWorker, LatestSlot, SerialSource, UdpSource
+    from session import ReplaySource
+    parser = argparse.ArgumentParser(description="Serve one board's samples to many local PyTeapotPlus clients")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--serial', metavar='PORT', help="serial port of the board")
+    group.add_argument('--udp', metavar='IP:PORT', help="address to receive the board's datagrams on")
+    group.add_argument('--replay', metavar='FILE', help="session log to play back in a loop")
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--binary', action='store_true', help="binary wire protocol")
+    parser.add_argument('--euler', action='store_true', help="yaw, pitch, roll instead of quaternions")
+    parser.add_argument('--listen', default=ADDRESS, help=f"host:port or Unix socket path (default {ADDRESS})")
+    parser.add_argument('--queue', type=int, default=QUEUE_FRAMES,
+                        help=f"frames queued per client before skipping to the newest (default {QUEUE_FRAMES})")
+    args = parser.parse_args()
+    logs.setup('INFO')
+    useQuat = not args.euler
+    if args.serial:
+        source = SerialSource(args.serial, args.baud, useQuat, binary=args.binary)
+    elif args.udp:
+        ip, port = args.udp.rsplit(':', 1)
+        source = UdpSource(ip, int(port), useQuat, binary=args.binary)
+    else:
+        source = ReplaySource(args.replay, useQuat=useQuat, loop=True)
+    relay = RelayServer(args.listen, useQuat, args.queue)
+    relay.start()
+    worker = IngestWorker(source, LatestSlot(), recorder=relay)
+    worker.start()
+    log.info("Relaying %s on %s, Ctrl+C to stop", worker.name, args.listen)
+    try:
+        while worker.is_alive():
+            worker.join(0.5)
+    except KeyboardInterrupt:
+        pass
+    worker.stop()
+    worker.join()
+    source.close()
+    relay.close()
+    logs.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Event-driven frame scheduling for the PyTeapotPlus viewers.
+
+Redrawing and flipping a window whose content did not change only burns CPU,
+GPU and battery. A FrameScheduler sleeps in pygame.event.wait() until there
+is something to do: input, a window event, or a new sample. The ingest
+threads report samples through wake(), which posts at most one event at a
+time. A frame is drawn only when the state passed to ready() (the poses,
+rounded by quantize() so sensor noise does not count, and the text on
+screen) differs from the last drawn one, or when the window was invalidated,
+and never more often than the fps cap. While the poses keep changing, for
+example while smoothing glides towards the newest sample, it wakes up at the
+cap; once they stand still the viewer sleeps until the next event, and
+redraws every idle_refresh seconds in case something on screen changed that
+ready() was not shown.
+
+    scheduler = FrameScheduler(FPS_LIMIT)
+    worker = IngestWorker(source, slot, notify=scheduler.wake)
+    while 1:
+        for event in scheduler.wait():
+            ...                              # input; scheduler.invalidate() if it changes the picture
+        values = slot.get().values
+        hud = metrics.hud_lines() if show_hud else None
+        if scheduler.ready((quantize([values]), hud)):
+            draw(values, hud)
+            pygame.display.flip()
+"""
+
+import time
+
+import pygame
+
+
+IDLE_REFRESH = 1.0  # seconds between redraws when nothing changes, for what ready() is not shown
+QUAT_STEP = 0.001  # smallest quaternion component change worth a frame, about 0.1 degrees
+ANGLE_STEP = 0.1  # smallest change of yaw, pitch or roll in degrees worth a frame
+WINDOW_EVENTS = tuple(getattr(pygame, name) for name in
+                      ('VIDEOEXPOSE', 'VIDEORESIZE', 'WINDOWEXPOSED', 'WINDOWRESIZED', 'WINDOWSIZECHANGED',
+                       'WINDOWSHOWN', 'WINDOWRESTORED', 'WINDOWMAXIMIZED')
+                      if hasattr(pygame, name))
+
+
+def set_mode(size, flags, vsync=False):
+    """
+    pygame.display.set_mode() that waits for the display refresh on flip()
+    when vsync is set and the driver supports it, and silently does not when
+    it does not
+    """
+    if vsync:
+        try:
+            return pygame.display.set_mode(size, flags, vsync=1)
+        except pygame.error:
+            pass
+    return pygame.display.set_mode(size, flags)
+
+
+def quantize(poses, useQuat=True):
+    """
+    Poses (None for sensors without samples) rounded to the smallest change
+    worth drawing, for ready(): the sensor noise of a board lying still
+    should not keep the viewer drawing
+    """
+    step = QUAT_STEP if useQuat else ANGLE_STEP
+    return tuple(None if pose is None else tuple(round(v / step) for v in pose) for pose in poses)
+
+
+class FrameScheduler:
+    """
+    Decides when a viewer draws. fps caps the frame rate, 0 for no cap;
+    idle_refresh None never redraws an unchanged picture. Must be created
+    after pygame.init(); wake() may be called from any thread.
+    """
+    def __init__(self, fps=60, idle_refresh=IDLE_REFRESH):
+        self.period = 1.0 / fps if fps else 0.0
+        self.idle_refresh = idle_refresh
+        self.event_type = pygame.event.custom_type()
+        self.dirty = True  # draw the first frame whatever the state
+        self.animating = False  # the last frame changed the picture, so the next one probably does too
+        self.frames = 0
+        self.skipped = 0  # frames due that had nothing new to draw
+        self._state = None
+        self._last = 0.0  # time.monotonic() the last frame drawn was due
+        self._sample = False
+        self._posted = False
+
+    def wake(self):
+        """
+        Tells the scheduler a new sample arrived; posts no more than one event
+        until the render thread has seen it
+        """
+        if not self._posted:
+            self._posted = True
+            pygame.event.post(pygame.event.Event(self.event_type))
+
+    def invalidate(self):
+        """
+        Forces the next frame to be drawn, for changes ready() cannot see
+        such as the camera, a toggled overlay or an exposed window
+        """
+        self.dirty = True
+
+    def wait(self):
+        """
+        Blocks until input arrives or a frame may be due and returns the
+        pending events, without the scheduler's own
+        """
+        now = time.monotonic()
+        if self.dirty or self.animating or self._sample:
+            timeout = self._last + self.period - now
+        elif self.idle_refresh is None:
+            timeout = None
+        else:
+            timeout = self._last + self.idle_refresh - now
+        if timeout is None:
+            events = [pygame.event.wait()]
+            events += pygame.event.get()
+        elif timeout > 0:
+            event = pygame.event.wait(max(1, int(timeout * 1000)))
+            events = [event] + pygame.event.get() if event.type != pygame.NOEVENT else []
+        else:
+            events = pygame.event.get()
+        if not events:
+            return events
+        self._posted = False  # before the check below, so a wake() from now on posts again
+        others = []
+        for event in events:
+            if event.type == self.event_type:
+                self._sample = True
+            else:
+                if event.type in WINDOW_EVENTS:
+                    self.dirty = True
+                others.append(event)
+        return others
+
+    def ready(self, state=None):
+        """
+        True if a frame should be drawn now for state, anything comparable
+        with == (the poses to draw); records it as drawn
+        """
+        now = time.monotonic()
+        if now < self._last + self.period:
+            return False
+        if self.idle_refresh is not None and now - self._last >= self.idle_refresh:
+            self.dirty = True
+        self._sample = False
+        self.animating = self.dirty or state != self._state
+        if not self.animating:
+            self.skipped += 1
+            return False
+        self._state = state
+        self.dirty = False
+        due = self._last + self.period
+        self._last = due if now - due < self.period else now  # keeps the cap's pace when a wake-up is a bit late
+        self.frames += 1
+        return True
@@ -0,0 +1,268 @@
+"""
+Session recording and replay for PyTeapotPlus.
+
+A Recorder appends every decoded sample to a binary session log; a
+ReplaySource memory-maps such a log and plays it back through the same
+read() interface as SerialSource and UdpSource, in real time, sped up or as
+fast as possible. Field problems can then be reproduced, and the render path
+benchmarked, with exactly the same input every time.
+
+File layout: b'PTREC001', uint32 header length and a JSON header padded to
+HEADER_SIZE bytes, followed by fixed 40 byte little-endian records:
+
+    offset  size  field
+    0       8     host receive time, time.monotonic() seconds
+    8       8     device time in seconds, NaN if the transport has none
+    16      16    four float32 values, (w, x, y, z) or (yaw, pitch, roll, 0)
+    32      2     source index into the header's 'sources' list
+    34      1     calibration as in the binary wire protocol
+    35      1     flags, bit 0: calibration is known
+    36      4     reserved
+
+The header holds the angle mode, the wall clock time recording started and
+the source names; it is rewritten in place when a new source shows up and
+when the recorder is closed.
+
+    python session.py info session.ptrec
+    python analysis.py session.ptrec      # drift, noise, Allan deviation, gaps, calibration
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+from ingest import Reading
+from wire import pack_cal, unpack_cal
+
+
+MAGIC = b'PTREC001'
+HEADER_SIZE = 4096
+RECORD = np.dtype([('t_recv', '<f8'), ('t_device', '<f8'), ('values', '<f4', (4,)),
+                   ('source', '<u2'), ('cal', 'u1'), ('flags', 'u1'), ('reserved', 'u1', (4,))])
+FLAG_CAL = 1
+CHUNK = 256  # records buffered before they are written
+FLUSH_INTERVAL = 1.0  # seconds a record may wait in the buffer
+
+
+class Recorder:
+    """
+    Buffered writer of a session log. Records are collected in a numpy chunk
+    and written with one call when it fills up or gets older than
+    flush_interval. Call write() from one thread only.
+    """
+    def __init__(self, path, useQuat=True, chunk=CHUNK, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.useQuat = useQuat
+        self.flush_interval = flush_interval
+        self.count = 0
+        self.sources = []
+        self._source_ids = {}
+        self._chunk = np.zeros(chunk, RECORD)
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._file = open(path, 'wb')
+        self._header = {'useQuat': bool(useQuat), 'started': time.time(), 'sources': self.sources}
+        self._write_header()
+
+    def _write_header(self):
+        self._header['records'] = self.count
+        header = json.dumps(self._header).encode('utf-8')
+        if len(MAGIC) + 4 + len(header) > HEADER_SIZE:
+            raise ValueError(f"Session header exceeds {HEADER_SIZE} bytes ({len(self.sources)} sources)")
+        block = MAGIC + struct.pack('<I', len(header)) + header
+        self._file.seek(0)
+        self._file.write(block.ljust(HEADER_SIZE, b' '))
+        self._file.seek(0, os.SEEK_END)
+
+    def source_id(self, name):
+        """
+        Index of a source name, registering it on first use
+        """
+        index = self._source_ids.get(name)
+        if index is None:
+            self.flush()
+            index = self._source_ids[name] = len(self.sources)
+            self.sources.append(str(name))
+            self._write_header()
+        return index
+
+    def write(self, values, t_recv, t_device=None, cal=None, source=0):
+        record = self._chunk[self._pending]
+        record['t_recv'] = t_recv
+        record['t_device'] = np.nan if t_device is None else t_device
+        record['values'][:len(values)] = values
+        record['values'][len(values):] = 0.0
+        record['source'] = source
+        record['cal'] = 0 if cal is None else pack_cal(cal)
+        record['flags'] = 0 if cal is None else FLAG_CAL
+        self._pending += 1
+        self.count += 1
+        if self._pending == len(self._chunk) or t_recv - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self._file.write(self._chunk[:self._pending].tobytes())
+            self._pending = 0
+        self._file.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._write_header()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SessionLog:
+    """
+    Read-only, memory-mapped view of a session log. records is a numpy
+    structured array over the file; a log still being written is read up to
+    its last whole record.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mapping[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a PyTeapotPlus session log")
+        (length,) = struct.unpack_from('<I', self._mapping, len(MAGIC))
+        self.header = json.loads(self._mapping[len(MAGIC) + 4:len(MAGIC) + 4 + length])
+        self.useQuat = self.header['useQuat']
+        self.sources = self.header['sources']
+        count = (len(self._mapping) - HEADER_SIZE) // RECORD.itemsize
+        self.records = np.frombuffer(self._mapping, RECORD, max(count, 0), HEADER_SIZE)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def duration(self):
+        return float(self.records['t_recv'][-1] - self.records['t_recv'][0]) if len(self.records) else 0.0
+
+    def chunks(self, size):
+        """
+        Yields the records as consecutive views of at most size records.
+        Pages of the chunks already yielded are handed back to the OS, so a
+        log larger than memory is read through with a bounded footprint.
+        """
+        sequential = hasattr(mmap, 'MADV_DONTNEED')  # Unix, Python 3.8+
+        if sequential:
+            self._mapping.madvise(mmap.MADV_SEQUENTIAL)
+        for start in range(0, len(self.records), size):
+            yield self.records[start:start + size]
+            if sequential:
+                done = min(HEADER_SIZE + (start + size) * RECORD.itemsize, len(self._mapping))
+                done -= done % mmap.PAGESIZE
+                if done:
+                    self._mapping.madvise(mmap.MADV_DONTNEED, 0, done)
+
+    def reading(self, i):
+        record = self.records[i]
+        values = record['values'].tolist()
+        t_device = float(record['t_device'])
+        return Reading(tuple(values if self.useQuat else values[:3]),
+                       None if t_device != t_device else t_device,
+                       unpack_cal(int(record['cal'])) if record['flags'] & FLAG_CAL else None)
+
+    def close(self):
+        """
+        Drops the records; the map is unmapped once no array view is left
+        """
+        self.records = None
+        self._mapping = None
+
+
+class ReplaySource:
+    """
+    Plays a session log back with the interface of the live transports.
+    speed 1.0 is real time, 10.0 ten times faster, 0 as fast as possible.
+    source restricts playback to one source index or name; loop restarts at
+    the end instead of going quiet.
+    """
+    def __init__(self, path, speed=1.0, useQuat=True, source=None, loop=False, timeout=0.1, batch=64):
+        self.log = SessionLog(path)
+        if self.log.useQuat != bool(useQuat):
+            raise ValueError(f"{path} was recorded with useQuat={self.log.useQuat}")
+        self.speed = speed
+        self.loop = loop
+        self.timeout = timeout
+        self.batch = batch
+        self.parse_errors = 0
+        self.dropped = 0
+        self.finished = False
+        self._index = np.arange(len(self.log))
+        if source is not None:
+            if not isinstance(source, int):
+                source = self.log.sources.index(source)
+            self._index = np.flatnonzero(self.log.records['source'] == source)
+        self._times = self.log.records['t_recv'][self._index]
+        self._pos = 0
+        self._t0 = None
+
+    def read(self):
+        """
+        Returns the Readings that are due, waiting at most timeout for the next one
+        """
+        if self._pos >= len(self._index):
+            if not self.loop or not len(self._index):
+                self.finished = True
+                time.sleep(self.timeout)
+                return []
+            self._pos = 0
+            self._t0 = None
+        if not self.speed:
+            end = min(self._pos + self.batch, len(self._index))
+        else:
+            now = time.monotonic()
+            if self._t0 is None:
+                self._t0 = now - (self._times[self._pos] - self._times[0]) / self.speed
+            position = (now - self._t0) * self.speed + self._times[0]  # in recorded time
+            end = int(np.searchsorted(self._times, position, side='right'))
+            if end <= self._pos:
+                wait = (self._times[self._pos] - position) / self.speed
+                time.sleep(min(max(wait, 0.0), self.timeout))
+                return []
+        readings = [self.log.reading(i) for i in self._index[self._pos:end]]
+        self._pos = end
+        return readings
+
+    def close(self):
+        self.log.close()
+
+
+def info(path):
+    log = SessionLog(path)
+    records = log.records
+    mode = "quaternion" if log.useQuat else "yaw, pitch, roll"
+    started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(log.header['started']))
+    print(f"{path}: {len(log)} samples, {log.duration:.1f} s, {mode}, started {started}")
+    for index, name in enumerate(log.sources or ['(unnamed)']):
+        times = records['t_recv'][records['source'] == index]
+        rate = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 0.0
+        print(f"  {index}: {name:<24} {len(times):9d} samples {rate:8.1f} Hz")
+    log.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PyTeapotPlus session logs")
+    parser.add_argument('command', choices=['info'])
+    parser.add_argument('path', nargs='+', help="session log files")
+    args = parser.parse_args()
+    for path in args.path:
+        info(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,555 @@
+"""
+Shared-memory orientation bus for PyTeapotPlus.
+
+One process owns the serial port or UDP socket and publishes every decoded
+sample into a ring buffer in shared memory; any number of local processes
+(the viewers, control loops, loggers) read the samples from there without
+touching the device, without sockets and without pickling. Readers never
+block the publisher: a reader that falls more than CAPACITY samples behind
+loses the oldest ones and counts them in missed.
+
+    python shmbus.py publish --serial /dev/ttyUSB0          # or COM19 on Windows
+    python shmbus.py publish --udp 0.0.0.0:5555 --binary --multi
+    python shmbus.py monitor                                # rates and latest samples on the bus
+
+    reader = BusReader()                   # in the other process
+    sample = reader.latest()               # newest BusSample, or None
+    for sample in reader.wait(0.1):        # everything new since the last call
+        ...
+
+The viewers subscribe by setting BUS_NAME, see BusSource.
+
+Memory layout: a HEADER_SIZE byte header followed by CAPACITY fixed 64 byte
+little-endian slots; sample n (counting from 1) goes to slot n % CAPACITY.
+
+    offset  size  field
+    0       8     sample number n, 0 while the slot is being written
+    8       8     host receive time, time.monotonic() seconds (the same clock in every process)
+    16      8     device time in seconds, NaN if the transport has none
+    24      32    four float64 values, (w, x, y, z) or (yaw, pitch, roll, 0)
+    56      2     sensor index into the header's names
+    58      1     calibration as in the binary wire protocol
+    59      1     flags, bit 0: calibration is known
+    60      4     reserved
+
+Each slot is a seqlock: the publisher zeroes its sample number, writes the
+fields, stores the sample number and then advances the header's head.
+A reader copies the slots it wants and keeps only those whose sample
+number read the same before and after the copy, so a torn slot is never
+returned. There is a single publisher per bus. A publisher restarted on
+the block of one that crashed numbers its samples from 1 again and bumps
+the header's epoch, and the readers start over with its first sample. It
+refuses to take over a bus whose publisher still runs or still publishes.
+Where the crashed publisher's block was removed instead (on POSIX its
+resource tracker does that) readers that find it gone attach to the block
+the new publisher created.
+"""
+
+import argparse
+import os
+import struct
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from ingest import Reading
+from wire import pack_cal, unpack_cal
+
+
+BUS_NAME = 'pyteapot'  # shared memory block name, several buses can run side by side
+CAPACITY = 4096  # slots, 40 s of one sensor at 100 Hz
+MAX_SENSORS = 64
+MAGIC = b'PTBUS001'
+HEADER_SIZE = 4096
+HEADER = np.dtype([('magic', 'S8'), ('head', '<u8'), ('capacity', '<u4'), ('sensors', '<u4'),
+                   ('useQuat', 'u1'), ('reserved', 'u1', (3,)), ('epoch', '<u4'), ('names', 'S48', (MAX_SENSORS,)),
+                   ('pid', '<u4')])
+SLOT = np.dtype([('seq', '<u8'), ('t_recv', '<f8'), ('t_device', '<f8'), ('values', '<f8', (4,)),
+                 ('sensor', '<u2'), ('cal', 'u1'), ('flags', 'u1'), ('reserved', 'u1', (4,))])
+SLOT_STRUCT = struct.Struct('<Qdd4dHBB4x')  # one SLOT, for single samples where numpy's overhead dominates
+SEQ = struct.Struct('<Q')  # sample number at the start of a slot, and the head at offset 8 of the header
+FLAG_CAL = 1
+POLL_INTERVAL = 0.001  # seconds between looks at the head while waiting
+STALE_AFTER = 1.0  # seconds the head of an existing bus must stand still before a new publisher takes it over
+
+_published = set()  # names of the buses BusWriters of this process hold
+
+
+BusSample = namedtuple('BusSample', ['seq', 't_recv', 'values', 't_device', 'cal', 'sensor'])
+BusSample.__doc__ = """
+A sample read from the bus: bus sample number, host receive time
+(time.monotonic()), values, device time and calibration (None when the
+transport has none) and the sensor index into BusReader.sensors
+"""
+
+
+def _attach(name):
+    """
+    Opens an existing block without handing it to this process' resource
+    tracker, which would otherwise destroy it when the reader exits
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name)
+        if os.name == 'posix' and name not in _published:  # the tracker has one entry per name and process
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _process_alive(pid):
+    """
+    True or False if process pid exists, None where that cannot be told
+    (no pid recorded, or not POSIX)
+    """
+    if not pid or os.name != 'posix':
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # another user's process
+        pass
+    return True
+
+
+def _publisher_alive(name, header):
+    """
+    True if the publisher that left header behind still runs: its process
+    exists (where that can be told) or its head advances within STALE_AFTER
+    """
+    pid = int(header['pid'])
+    if pid == os.getpid():
+        return name in _published
+    alive = _process_alive(pid)
+    if alive is not None:
+        return alive
+    head = int(header['head'])
+    deadline = time.monotonic() + STALE_AFTER
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL * 10)
+        if int(header['head']) != head:
+            return True
+    return False
+
+
+class BusWriter:
+    """
+    The publishing side. Has the interface of session.Recorder, so it goes
+    wherever a recorder does: IngestWorker(source, slot, recorder=bus) or
+    FanInReceiver(..., recorder=bus). Call write() from one thread only.
+    The block of a publisher that crashed is taken over; FileExistsError
+    if the bus has a running publisher.
+    """
+    def __init__(self, name=BUS_NAME, useQuat=True, capacity=CAPACITY):
+        size = HEADER_SIZE + capacity * SLOT.itemsize
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            self.shm = _attach(name)  # untracked, a refused publisher must not remove the block on exit
+            if self.shm.size < size:
+                self.shm.close()
+                raise ValueError(f"Shared memory block {name!r} exists and is too small, remove it first")
+            header = np.ndarray((), HEADER, self.shm.buf)
+            alive = _publisher_alive(name, header)
+            del header  # the block cannot be closed while a view of it exists
+            self.shm.close()
+            if alive:
+                raise FileExistsError(f"Bus {name!r} has a running publisher, stop it or choose another --name")
+            self.shm = shared_memory.SharedMemory(name)  # tracked, as if created here
+        _published.add(name)
+        self.name = name
+        self.useQuat = useQuat
+        self.count = 0
+        self.sources = []
+        self._source_ids = {}
+        self.header = np.ndarray((), HEADER, self.shm.buf)
+        self.slots = np.ndarray((capacity,), SLOT, self.shm.buf, HEADER_SIZE)
+        self._seqs = self.slots['seq']
+        self.header['magic'] = b''  # readers refuse the block until it is consistent
+        self.header['head'] = 0
+        self._seqs[:] = 0
+        self.header['capacity'] = capacity
+        self.header['sensors'] = 0
+        self.header['useQuat'] = bool(useQuat)
+        self.header['epoch'] += 1  # readers start over with this publisher's samples
+        self.header['pid'] = os.getpid()
+        self.header['magic'] = MAGIC
+
+    def source_id(self, name):
+        """
+        Index of a sensor name, registering it on first use
+        """
+        index = self._source_ids.get(name)
+        if index is None:
+            if len(self.sources) == MAX_SENSORS:
+                raise ValueError(f"The bus holds at most {MAX_SENSORS} sensors")
+            index = self._source_ids[name] = len(self.sources)
+            self.sources.append(str(name))
+            self.header['names'][index] = str(name).encode('utf-8')[:HEADER['names'].itemsize]
+            self.header['sensors'] = len(self.sources)
+        return index
+
+    def write(self, values, t_recv, t_device=None, cal=None, source=0):
+        n = self.count + 1
+        i = n % len(self.slots)
+        self._seqs[i] = 0
+        padded = tuple(values) + (0.0,) * (4 - len(values))
+        self.slots[i] = (0, t_recv, np.nan if t_device is None else t_device, padded, source,
+                         0 if cal is None else pack_cal(cal), 0 if cal is None else FLAG_CAL, (0, 0, 0, 0))
+        self._seqs[i] = n
+        self.header['head'] = n
+        self.count = n
+
+    def flush(self):
+        pass
+
+    def close(self, unlink=True):
+        """
+        Detaches from the block, and removes it unless unlink is False
+        """
+        if self.shm is None:
+            return
+        self.header = self.slots = self._seqs = None
+        _published.discard(self.name)
+        self.shm.close()
+        if unlink:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+        self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BusReader:
+    """
+    A subscriber. Attaches to a running publisher's bus (FileNotFoundError
+    if there is none) and reads from it without ever writing to it. read()
+    and wait() start with the samples published after the reader attached.
+    """
+    def __init__(self, name=BUS_NAME):
+        self.shm = _attach(name)
+        self.name = name
+        self.header = np.ndarray((), HEADER, self.shm.buf)
+        if bytes(self.header['magic']) != MAGIC:
+            self.close()
+            raise ValueError(f"Shared memory block {name!r} is not a PyTeapotPlus bus")
+        self.useQuat = bool(self.header['useQuat'])
+        self.slots = np.ndarray((int(self.header['capacity']),), SLOT, self.shm.buf, HEADER_SIZE)
+        self.missed = 0  # samples overwritten before this reader got to them
+        self.last = int(self.header['head'])  # newest sample number returned or skipped
+        self.epoch = int(self.header['epoch'])
+        self._sensors = []
+
+    @property
+    def head(self):
+        """
+        Number of samples published so far
+        """
+        return SEQ.unpack_from(self.shm.buf, 8)[0]
+
+    def _sync(self):
+        """
+        The head, after starting over at the first sample of a publisher that
+        took the bus over since the last look (a new epoch, or a head behind
+        the samples already read)
+        """
+        head = self.head
+        epoch = int(self.header['epoch'])
+        if epoch != self.epoch or head < self.last:
+            self.epoch = epoch
+            self.useQuat = bool(self.header['useQuat'])
+            self.slots = np.ndarray((int(self.header['capacity']),), SLOT, self.shm.buf, HEADER_SIZE)
+            self._sensors = []
+            self.last = 0
+            head = self.head
+        return head
+
+    @property
+    def sensors(self):
+        """
+        Sensor names by index, as the publisher registered them
+        """
+        count = int(self.header['sensors'])
+        if count != len(self._sensors):
+            self._sensors = [name.decode('utf-8', 'replace') for name in self.header['names'][:count]]
+        return self._sensors
+
+    def sensor_index(self, sensor):
+        """
+        Index of a sensor given by index or name
+        """
+        return sensor if isinstance(sensor, int) else self.sensors.index(sensor)
+
+    def records(self, first, last):
+        """
+        Consistent copy of the slots of samples first..last as a SLOT array,
+        without those overwritten meanwhile
+        """
+        numbers = np.arange(first, last + 1, dtype=np.uint64)
+        index = numbers % np.uint64(len(self.slots))
+        before = self.slots['seq'][index]
+        records = self.slots[index]
+        after = self.slots['seq'][index]
+        return records[(before == numbers) & (after == numbers)]
+
+    def read(self, sensor=None):
+        """
+        SLOT array of the samples published since the last read() or wait(),
+        of one sensor (index or name) or all of them
+        """
+        head = self._sync()
+        first = max(self.last + 1, head - len(self.slots) + 1)
+        if head < first:
+            return self.slots[:0].copy()
+        records = self.records(first, head)
+        self.missed += head - self.last - len(records)
+        self.last = head
+        if sensor is not None:
+            records = records[records['sensor'] == self.sensor_index(sensor)]
+        return records
+
+    def wait(self, timeout=None, sensor=None):
+        """
+        Like read() as BusSamples, polling every POLL_INTERVAL until there is
+        something new or timeout seconds passed
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._sync() == self.last:
+            if deadline is not None and time.monotonic() >= deadline:
+                self.reattach()
+                return []
+            time.sleep(POLL_INTERVAL)
+        return [self.sample(record) for record in self.read(sensor)]
+
+    def reattach(self):
+        """
+        Switches to the block now under the bus name when the publisher of
+        this one is gone and a new publisher created another block; True if
+        it did. wait() calls it when it times out.
+        """
+        pid = int(self.header['pid'])
+        if _process_alive(pid) is not False:
+            return False
+        try:
+            shm = _attach(self.name)
+        except FileNotFoundError:  # no new publisher yet
+            return False
+        header = np.ndarray((), HEADER, shm.buf)
+        fresh = bytes(header['magic']) == MAGIC and int(header['pid']) != pid
+        del header
+        if not fresh:  # the same block, or one still being set up
+            shm.close()
+            return False
+        self.header = self.slots = None
+        self.shm.close()
+        self.shm = shm
+        self.header = np.ndarray((), HEADER, shm.buf)
+        self.epoch = None  # _sync() starts over with the first sample of the new block
+        self._sync()
+        return True
+
+    def latest(self, sensor=None):
+        """
+        The newest BusSample, of one sensor or any, None if there is none;
+        leaves the position of read() alone
+        """
+        head = self._sync()
+        index = None if sensor is None else self.sensor_index(sensor)
+        oldest = max(head - len(self.slots), 0)
+        buf = self.shm.buf
+        # the newest few one by one, a sensor is rarely far behind the newest sample
+        for n in range(head, max(head - 16, oldest), -1):
+            offset = HEADER_SIZE + n % len(self.slots) * SLOT.itemsize
+            before = SEQ.unpack_from(buf, offset)[0]
+            seq, t_recv, t_device, w, x, y, z, number, cal, flags = SLOT_STRUCT.unpack_from(buf, offset)
+            if before != n or SEQ.unpack_from(buf, offset)[0] != n or (index is not None and number != index):
+                continue
+            return BusSample(n, t_recv, (w, x, y, z) if self.useQuat else (w, x, y),
+                             None if t_device != t_device else t_device,
+                             unpack_cal(cal) if flags & FLAG_CAL else None, number)
+        end = head - 16
+        while end > oldest:
+            first = max(end - 1023, oldest + 1)
+            records = self.records(first, end)
+            if index is not None:
+                records = records[records['sensor'] == index]
+            if len(records):
+                return self.sample(records[-1])
+            end = first - 1
+        return None
+
+    def sample(self, record):
+        values = record['values'].tolist()
+        t_device = float(record['t_device'])
+        return BusSample(int(record['seq']), float(record['t_recv']), tuple(values if self.useQuat else values[:3]),
+                         None if t_device != t_device else t_device,
+                         unpack_cal(int(record['cal'])) if record['flags'] & FLAG_CAL else None,
+                         int(record['sensor']))
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.header = self.slots = None
+        self.shm.close()
+        self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BusSource:
+    """
+    Reads one sensor of the bus with the interface of the live transports,
+    so a viewer subscribes with IngestWorker(BusSource(...), slot). sensor
+    is an index or name, the first sensor by default.
+    """
+    def __init__(self, name=BUS_NAME, useQuat=True, sensor=0, timeout=0.1):
+        self.reader = BusReader(name)
+        if self.reader.useQuat != bool(useQuat):
+            self.reader.close()
+            raise ValueError(f"Bus {name!r} carries useQuat={self.reader.useQuat} samples")
+        self.sensor = sensor
+        self.timeout = timeout
+        self.name = f"bus {name}"
+        self.parse_errors = 0
+
+    @property
+    def dropped(self):
+        return self.reader.missed
+
+    def read(self):
+        """
+        Returns the Readings published since the last call, waiting at most
+        timeout for one
+        """
+        if isinstance(self.sensor, str) and self.sensor not in self.reader.sensors:
+            time.sleep(self.timeout)  # not heard from yet
+            return []
+        samples = self.reader.wait(self.timeout, self.sensor)
+        return [Reading(sample.values, sample.t_device, sample.cal) for sample in samples]
+
+    def close(self):
+        self.reader.close()
+
+
+def publish(args):
+    from fanin import FanInReceiver
+    from ingest import IngestWorker, LatestSlot, SerialSource, UdpSource
+    from session import ReplaySource
+    useQuat = not args.euler
+    bus = BusWriter(args.name, useQuat, args.capacity)
+    if args.multi:
+        ip, port = args.udp.rsplit(':', 1)
+        worker = FanInReceiver(ip, int(port), useQuat, binary=args.binary, recorder=bus)
+    else:
+        if args.serial:
+            source = SerialSource(args.serial, args.baud, useQuat, binary=args.binary)
+        elif args.udp:
+            ip, port = args.udp.rsplit(':', 1)
+            source = UdpSource(ip, int(port), useQuat, binary=args.binary)
+        else:
+            source = ReplaySource(args.replay, useQuat=useQuat, loop=True)
+        worker = IngestWorker(source, LatestSlot(), recorder=bus)
+    worker.start()
+    print(f"Publishing on shared memory bus {args.name!r}, Ctrl+C to stop")
+    try:
+        while worker.is_alive():
+            worker.join(0.5)
+    except KeyboardInterrupt:
+        pass
+    worker.stop()
+    worker.join()
+    if not args.multi:
+        worker.source.close()
+    bus.close()
+
+
+def monitor(args):
+    reader = BusReader(args.name)
+    counts = {}
+    t = time.monotonic()
+    try:
+        while 1:
+            time.sleep(args.interval)
+            for index in reader.read()['sensor'].tolist():
+                counts[index] = counts.get(index, 0) + 1
+            now = time.monotonic()
+            for index, name in enumerate(reader.sensors):
+                sample = reader.latest(index)
+                values = ", ".join("%.4f" % v for v in sample.values) if sample else "-"
+                print(f"{name:<24} {counts.get(index, 0) / (now - t):8.1f} Hz  {values}")
+            print(f"{reader.head} samples published, {reader.missed} missed")
+            counts.clear()
+            t = now
+    except KeyboardInterrupt:
+        pass
+    reader.close()
+
+
+def bench(n=200_000):
+    name = f"pyteapot-bench-{os.getpid()}"
+    with BusWriter(name) as bus, BusReader(name) as reader:
+        values = (1.0, 0.0, 0.0, 0.0)
+        t = time.perf_counter()
+        for i in range(n):
+            bus.write(values, i * 0.01, i * 0.01, (3, 3, 3, 3))
+        write = (time.perf_counter() - t) / n
+        reader.last = bus.count - CAPACITY
+        t = time.perf_counter()
+        records = reader.read()
+        read = (time.perf_counter() - t) / len(records)
+        t = time.perf_counter()
+        for _ in range(10000):
+            reader.latest()
+        latest = (time.perf_counter() - t) / 10000
+    print(f"  write   {write * 1e6:8.2f} us/sample")
+    print(f"  read    {read * 1e6:8.2f} us/sample ({len(records)} at once)")
+    print(f"  latest  {latest * 1e6:8.2f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PyTeapotPlus shared memory orientation bus")
+    parser.add_argument('--name', default=BUS_NAME, help=f"bus name (default {BUS_NAME})")
+    commands = parser.add_subparsers(dest='command', required=True)
+    publisher = commands.add_parser('publish', help="read the device and publish its samples")
+    group = publisher.add_mutually_exclusive_group(required=True)
+    group.add_argument('--serial', metavar='PORT', help="serial port of the board")
+    group.add_argument('--udp', metavar='IP:PORT', help="address to receive the board's datagrams on")
+    group.add_argument('--replay', metavar='FILE', help="session log to play back in a loop")
+    publisher.add_argument('--baud', type=int, default=115200)
+    publisher.add_argument('--binary', action='store_true', help="binary wire protocol")
+    publisher.add_argument('--euler', action='store_true', help="yaw, pitch, roll instead of quaternions")
+    publisher.add_argument('--multi', action='store_true', help="every board sending to --udp, one sensor each")
+    publisher.add_argument('--capacity', type=int, default=CAPACITY, help=f"slots in the ring (default {CAPACITY})")
+    watcher = commands.add_parser('monitor', help="print the rate and newest sample of every sensor on the bus")
+    watcher.add_argument('--interval', type=float, default=1.0)
+    commands.add_parser('bench', help="bus throughput")
+    args = parser.parse_args()
+    if args.command == 'publish':
+        if args.multi and not args.udp:
+            parser.error("--multi needs --udp")
+        try:
+            publish(args)
+        except FileExistsError as e:
+            parser.error(str(e))
+    elif args.command == 'monitor':
+        monitor(args)
+    else:
+        bench()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""
+Simulated BNO055 + ESP32 for testing PyTeapotPlus without hardware.
+
+Produces the same bytes as 'bno055_udp_miniC3.ino' for a synthetic motion
+(slow yaw sweep with pitch and roll wobble), either on a pseudo-terminal that
+the viewers open like a real serial port, or as UDP datagrams.
+
+    python simdevice.py --pty                 # prints the port to use as SERIAL_PORT
+    python simdevice.py --udp 127.0.0.1:5555 --binary --rate 100 --batch 20
+    python simdevice.py --udp 127.0.0.1:5555 --binary --sensors 8 --drop 0.01
+"""
+
+import argparse
+import math
+import os
+import random
+import socket
+import threading
+import time
+
+import quat
+import wire
+
+
+CAL_STATUS_INTERVAL = 1.0  # seconds, CAL_STATUS_INTERVAL_MS in 'config.h'
+TIMING_INTERVAL = 1.0  # seconds, TIMING_INTERVAL_MS in 'config.h'
+
+
+def ypr_to_quat(yaw, pitch, roll):
+    """
+    (w, x, y, z) for Z-Y-X angles in degrees, the inverse of quat_to_ypr()
+    without the mounting offset
+    """
+    return tuple(quat.from_ypr(yaw, pitch, roll).tolist())
+
+
+class SimulatedBNO055:
+    """
+    Generates samples and encodes them exactly like the firmware's loop()
+    """
+    def __init__(self, rate=5.0, useQuat=True, binary=False, calibration=(3, 3, 3, 3), phase=0.0):
+        self.rate = rate
+        self.useQuat = useQuat
+        self.binary = binary
+        self.calibration = calibration
+        self.phase = phase  # seconds of motion offset, tells several simulated boards apart
+        self.seq = 0
+        self.t0 = time.monotonic()
+        self.missed = 0  # deadlines missed since start, see late()
+        self._cal_sent = None  # (calibration, time) of the last calibration status
+        self._timing_start = 0.0
+        self._timing_samples = 0
+        self._jitter = []
+
+    def angles(self, t):
+        t += self.phase
+        return ((30.0 * t) % 360.0 - 180.0, 20.0 * math.sin(0.5 * t), 10.0 * math.sin(0.8 * t))
+
+    def values(self, t):
+        if(self.useQuat):
+            return ypr_to_quat(*self.angles(t))
+        return self.angles(t)
+
+    def text_frame(self, values, millis):
+        if(self.useQuat):
+            return "w%.4fw a%.4fa b%.4fb c%.4fc t%dt " % (*values, millis)
+        return "y%.4fy p%.4fp r%.4fr t%dt " % (*values, millis)
+
+    def cal_status(self):
+        # displayCalStatus() output, "! " flags an uncalibrated system
+        sys, gyro, accel, mag = self.calibration
+        return "\t%sSys:%d G:%d A:%d M:%d" % ("" if sys else "! ", sys, gyro, accel, mag)
+
+    def timing_status(self, t):
+        """
+        The loop timing over the interval ending at t as
+        (rate, mean jitter, max jitter, missed), and starts the next interval
+        """
+        elapsed = t - self._timing_start
+        jitter = self._jitter or [0.0]
+        timing = (self._timing_samples / elapsed, 1e6 * sum(jitter) / len(jitter), 1e6 * max(jitter), self.missed)
+        self._timing_start = t
+        self._timing_samples = 0
+        self._jitter = []
+        return timing
+
+    def late(self, seconds, missed=0):
+        """
+        Records how late a sample was taken behind its deadline, and the
+        deadlines skipped after it
+        """
+        self._jitter.append(seconds)
+        self.missed += missed
+
+    def status(self, t):
+        """
+        (calibration, timing) status messages due at t, None where nothing is
+        due: the calibration status when it changed or CAL_STATUS_INTERVAL
+        passed (text only, binary frames carry it), the loop timing every
+        TIMING_INTERVAL. The firmware sends the first before the sample of
+        the same loop() iteration and the second after it.
+        """
+        cal = timing = None
+        if not self.binary and (self._cal_sent is None or self._cal_sent[0] != self.calibration
+                                or t - self._cal_sent[1] >= CAL_STATUS_INTERVAL):
+            self._cal_sent = (self.calibration, t)
+            cal = self.cal_status().encode()
+        if t - self._timing_start >= TIMING_INTERVAL:
+            rate, jitter, jitter_max, missed = self.timing_status(t)
+            if self.binary:
+                timing = wire.encode(self.seq + 1, int(t * 1000), (rate, jitter, jitter_max, missed),
+                                     wire.KIND_TIMING, self.calibration)
+            else:
+                timing = b"\tRate:%.2f Jitter:%.0f Max:%d Missed:%d" % (rate, jitter, jitter_max, missed)
+        return cal, timing
+
+    def next_sample(self, t=None):
+        """
+        Returns (values, millis) of the next sample and advances the sequence number
+        """
+        if t is None:
+            t = time.monotonic() - self.t0
+        self.seq += 1
+        self._timing_samples += 1
+        return self.values(t), int(t * 1000)
+
+    def encode_serial(self, values, millis):
+        """
+        The serial bytes of one loop() iteration: the status messages due, then
+        the sample
+        """
+        cal, timing = self.status(millis / 1000.0)
+        sample = self.encode_datagram(values, millis)
+        if self.binary:
+            return sample + (timing or b'')
+        return b''.join(line + b"\n" for line in (cal, sample, timing) if line)
+
+    def encode_datagram(self, values, millis):
+        """
+        The sample alone, empty until the system is calibrated (the firmware
+        only sends samples once sys > 0)
+        """
+        if not self.calibration[0]:
+            return b''
+        if self.binary:
+            return wire.encode(self.seq, millis, values, wire.KIND_QUAT if self.useQuat else wire.KIND_YPR,
+                               self.calibration)
+        return self.text_frame(values, millis).encode()
+
+
+def divmod_late(deadline, period):
+    """
+    (seconds, deadlines missed) the sample just taken for deadline was late
+    """
+    late = max(0.0, time.monotonic() - deadline)
+    missed = int(late // period)
+    return late - missed * period, missed
+
+
+def next_deadline(sim, deadline, period):
+    """
+    Records how late the sample taken for deadline was and returns the next
+    deadline, skipping the missed ones like the firmware's loop()
+    """
+    late, missed = divmod_late(deadline, period)
+    sim.late(late, missed)
+    return deadline + (missed + 1) * period
+
+
+class PtyDevice(threading.Thread):
+    """
+    Writes the simulated serial stream to the master side of a pseudo-terminal,
+    the viewers open self.port (the slave side) like a USB serial adapter
+    """
+    def __init__(self, sim):
+        super().__init__(name="simdevice-pty", daemon=True)
+        import tty
+        self.sim = sim
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self._stop_event = threading.Event()
+
+    def run(self):
+        period = 1.0 / self.sim.rate
+        deadline = time.monotonic()
+        while not self._stop_event.is_set():
+            os.write(self.master, self.sim.encode_serial(*self.sim.next_sample()))
+            deadline = next_deadline(self.sim, deadline, period)
+            self._stop_event.wait(max(0.0, deadline - time.monotonic()))
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class UdpDevice(threading.Thread):
+    """
+    Sends the simulated datagrams to a UDP address (use 127.0.0.1 for loopback).
+    With batch_size > 1 (binary mode only) samples are packed like the
+    firmware's udpBatchSize / UDP_BATCH_TIMEOUT_MS settings. drop is the
+    probability of losing a datagram on the way, to exercise loss counters.
+    """
+    def __init__(self, sim, address, batch_size=1, batch_timeout=0.05, drop=0.0):
+        super().__init__(name="simdevice-udp", daemon=True)
+        if batch_size > 1 and not sim.binary:
+            raise ValueError("UDP batching needs the binary wire protocol")
+        self.sim = sim
+        self.address = address
+        self.batch_size = min(batch_size, wire.BATCH_MAX)
+        self.batch_timeout = batch_timeout
+        self.drop = drop
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._batch = []
+        self._batch_start = 0.0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        period = 1.0 / self.sim.rate
+        deadline = time.monotonic()
+        while not self._stop_event.is_set():
+            self.send_next()
+            deadline = next_deadline(self.sim, deadline, period)
+            self._stop_event.wait(max(0.0, deadline - time.monotonic()))
+
+    def send_next(self):
+        """
+        Takes the next sample and sends it, or queues it into the batch, with
+        the status datagrams due
+        """
+        values, millis = self.sim.next_sample()
+        cal, timing = self.sim.status(millis / 1000.0)
+        self.send(cal)
+        if self.batch_size <= 1:
+            self.send(self.sim.encode_datagram(values, millis))
+        else:
+            if not self._batch:
+                self._batch_start = time.monotonic()
+            self._batch.append((values, millis))
+            if len(self._batch) >= self.batch_size or time.monotonic() - self._batch_start >= self.batch_timeout:
+                self.send(self.encode_batch(self._batch))
+                self._batch = []
+        self.send(timing)
+
+    def send(self, data):
+        if not data or (self.drop and random.random() < self.drop):
+            return
+        self.sock.sendto(data, self.address)
+
+    def encode_batch(self, batch):
+        kind = wire.KIND_QUAT if self.sim.useQuat else wire.KIND_YPR
+        first_seq = self.sim.seq - len(batch) + 1
+        return wire.encode_batch(first_seq, [m for v, m in batch], [v for v, m in batch], kind, self.sim.calibration)
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.sock.close()
+
+
+class UdpFleet(threading.Thread):
+    """
+    Drives several UdpDevices from one thread, each sending from its own
+    socket (source port) like separate boards on the network
+    """
+    def __init__(self, devices):
+        super().__init__(name="simdevice-fleet", daemon=True)
+        self.devices = devices
+        self._stop_event = threading.Event()
+
+    def run(self):
+        period = 1.0 / self.devices[0].sim.rate
+        deadline = time.monotonic()
+        while not self._stop_event.is_set():
+            for device in self.devices:
+                device.send_next()
+            late, missed = divmod_late(deadline, period)
+            for device in self.devices:
+                device.sim.late(late, missed)
+            deadline += (missed + 1) * period
+            self._stop_event.wait(max(0.0, deadline - time.monotonic()))
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        for device in self.devices:
+            device.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated BNO055 + ESP32 device")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--pty', action='store_true', help="emit the serial stream on a pseudo-terminal")
+    group.add_argument('--udp', metavar='IP:PORT', help="send datagrams to this address")
+    parser.add_argument('--rate', type=float, default=5.0, help="samples per second (default 5)")
+    parser.add_argument('--euler', action='store_true', help="send yaw, pitch, roll instead of quaternions")
+    parser.add_argument('--binary', action='store_true', help="use the binary wire protocol")
+    parser.add_argument('--batch', type=int, default=1, help="samples per UDP datagram, needs --binary (default 1)")
+    parser.add_argument('--sensors', type=int, default=1, help="number of simulated boards, UDP only (default 1)")
+    parser.add_argument('--drop', type=float, default=0.0, help="fraction of UDP datagrams to lose (default 0)")
+    args = parser.parse_args()
+
+    sim = SimulatedBNO055(args.rate, not args.euler, args.binary)
+    if args.pty:
+        device = PtyDevice(sim)
+        print(f"Simulated serial port: {device.port}")
+    elif args.sensors > 1:
+        ip, port = args.udp.rsplit(':', 1)
+        sims = [SimulatedBNO055(args.rate, not args.euler, args.binary, phase=7.0 * i) for i in range(args.sensors)]
+        device = UdpFleet([UdpDevice(s, (ip, int(port)), args.batch, drop=args.drop) for s in sims])
+        print(f"Sending {args.sensors} sensors to {ip}:{port}")
+    else:
+        ip, port = args.udp.rsplit(':', 1)
+        device = UdpDevice(sim, (ip, int(port)), args.batch, drop=args.drop)
+        print(f"Sending to {ip}:{port}")
+    device.start()
+    try:
+        while device.is_alive():
+            device.join(0.5)
+    except KeyboardInterrupt:
+        device.stop()
+
+
+if __name__ == '__main__':
+    main()
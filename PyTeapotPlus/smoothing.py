@@ -0,0 +1,246 @@
+"""
+Pose smoothing between ingest and drawing for PyTeapotPlus.
+
+The viewers render at the display rate while the boards send at their own,
+often much lower, rate; drawing the newest sample makes the model jump once
+per sample. A PoseSmoother keeps a short timestamped history of the samples
+of one sensor and renders the pose a small delay in the past, SLERPing
+between the two samples around that time. With extrapolate=True it instead
+renders the present, continuing the newest sample with the angular velocity
+of the last few samples, which hides the transport latency at the price of
+overshooting when the motion changes.
+
+    smoother = PoseSmoother(useQuat=True)
+    while 1:
+        values = smoother.update(slot.get())  # once per frame
+
+Samples carrying the device clock are placed on the host clock by the lower
+envelope of (receive time - device time) over the history, so WiFi jitter
+and batched datagrams do not show up as uneven motion. Samples that are not
+finite or not unit quaternions are dropped. A sample more than MAX_DEVIATION
+off the pose predicted from the history, such as a stray [0, 0, 0, 1], is
+only used once the next sample confirms it.
+
+All per-frame work is a few numpy operations over the history arrays.
+"""
+
+import time
+
+import numpy as np
+
+import quat
+
+
+HISTORY = 32  # samples kept per sensor
+DELAY_MARGIN = 1.2  # adaptive delay in median sample intervals, on top of the arrival jitter
+MAX_DELAY = 0.5  # seconds, cap of the adaptive delay for very slow sensors
+MAX_EXTRAPOLATION = 0.1  # seconds a pose is predicted past the newest sample at most
+VELOCITY_SAMPLES = 4  # samples the angular velocity is estimated over
+MAX_DEVIATION = 60.0  # degrees a sample may be off the predicted pose before it needs confirming
+NORM_TOLERANCE = 0.05  # quaternions further than this from unit length are outliers
+MAX_GAP = 2.0  # seconds without samples, or a device clock jump, that restarts the history
+
+
+def _wrap(angles):
+    """
+    Angle differences in degrees wrapped to [-180, 180)
+    """
+    return (angles + 180.0) % 360.0 - 180.0
+
+
+class PoseSmoother:
+    """
+    Interpolating or extrapolating pose filter for one sensor. Feed it every
+    frame with update(); samples already seen (same seq) are skipped. delay
+    is how far in the past poses are interpolated, None adapts it to the
+    sample rate and arrival jitter; extrapolating renders at delay 0 unless
+    a delay is given.
+    """
+    def __init__(self, useQuat=True, delay=None, extrapolate=False, history=HISTORY,
+                 max_extrapolation=MAX_EXTRAPOLATION):
+        self.useQuat = useQuat
+        self.delay = delay
+        self.extrapolate = extrapolate
+        self.max_extrapolation = max_extrapolation
+        self.accepted = 0
+        self.rejected = 0
+        self.restarts = 0
+        self.count = 0
+        self.shown = None  # host time the sensor was at the pose last returned by pose()
+        # chronological, the newest sample last; only the last count rows are valid
+        self.t_recv = np.zeros(history)
+        self.t_device = np.zeros(history)
+        self.poses = np.zeros((history, 4))  # (w, x, y, z) or (yaw, pitch, roll, 0)
+        self._seq = None
+        self._pending = None  # (pose, t_recv, t_device) of a sample awaiting confirmation
+        self._cache = None  # (times, delay, angular velocity), recomputed once per new sample
+
+    def update(self, sample, now=None):
+        """
+        Adds sample if it is new and returns the pose to draw now, as values
+        like the samples' or None before the first sample
+        """
+        if sample is not None and sample.seq != self._seq:
+            self._seq = sample.seq
+            self.push(sample.values, sample.t_recv, sample.t_device)
+        return self.pose(now)
+
+    def push(self, values, t_recv, t_device=None):
+        """
+        Adds one sample to the history. A sample far from where the history
+        predicts the board to be is held back until the next one: if that
+        agrees with it the board really moved and both are added, otherwise
+        it is dropped as an outlier. Returns False for rejected samples.
+        """
+        pose = np.zeros(4)
+        pose[:len(values)] = values
+        t_device = np.nan if t_device is None else t_device
+        if not np.isfinite(pose).all():
+            self.rejected += 1
+            return False
+        if(self.useQuat):
+            norm = np.linalg.norm(pose)
+            if abs(norm - 1.0) > NORM_TOLERANCE:
+                self.rejected += 1
+                return False
+            pose /= norm
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            if self._deviation(pose, t_recv, t_device, *pending) <= MAX_DEVIATION:
+                self._append(*pending)
+                self._append(pose, t_recv, t_device)
+                return True
+            self.rejected += 1
+        if self.count:
+            last_recv, last_device = self.t_recv[-1], self.t_device[-1]
+            has_device, had_device = t_device == t_device, last_device == last_device
+            device_jump = has_device and had_device and not 0.0 <= t_device - last_device <= MAX_GAP
+            if t_recv - last_recv > MAX_GAP or device_jump or has_device != had_device:
+                self.restarts += 1
+                self.count = 0
+                self._cache = None
+            elif self._deviation(pose, t_recv, t_device) > MAX_DEVIATION:
+                self._pending = (pose, t_recv, t_device)
+                return True
+        self._append(pose, t_recv, t_device)
+        return True
+
+    def _append(self, pose, t_recv, t_device):
+        self.t_recv[:-1] = self.t_recv[1:]
+        self.t_device[:-1] = self.t_device[1:]
+        self.poses[:-1] = self.poses[1:]
+        self.t_recv[-1] = t_recv
+        self.t_device[-1] = t_device
+        self.poses[-1] = pose
+        self.count = min(self.count + 1, len(self.poses))
+        self.accepted += 1
+        self._cache = None
+
+    def _deviation(self, pose, t_recv, t_device, last=None, last_recv=None, last_device=None):
+        """
+        Degrees pose is away from the prediction of the history, or of the
+        single sample last when given
+        """
+        if last is None:
+            last, last_recv, last_device = self.poses[-1], self.t_recv[-1], self.t_device[-1]
+            omega = self._stats()[2]
+        else:
+            omega = np.zeros(3)
+        dt = t_device - last_device if t_device == t_device else t_recv - last_recv
+        dt = min(max(dt, 0.0), self.max_extrapolation)
+        if(self.useQuat):
+            predicted = quat.multiply(quat.from_rotvec(omega * dt), last)
+            return float(quat.angle_between(predicted, pose))
+        return float(np.abs(_wrap(pose[:3] - last[:3] - omega * dt)).max())
+
+    def times(self):
+        """
+        Host times of the samples in the history. With device timestamps these
+        are the device times shifted by the smallest transport delay seen.
+        """
+        t_recv = self.t_recv[-self.count:]
+        t_device = self.t_device[-self.count:]
+        if np.isnan(t_device[-1]):
+            return t_recv
+        return t_device + np.min(t_recv - t_device)
+
+    def current_delay(self, times=None):
+        """
+        Seconds the rendered pose lags the newest sample's host time
+        """
+        if self.delay is not None:
+            return self.delay
+        if self.extrapolate:
+            return 0.0
+        if times is None:
+            times = self.times()
+        if len(times) < 2:
+            return 0.0
+        # np.median() and np.percentile() cost more than sorting a few dozen values
+        intervals = np.sort(np.diff(times))
+        lags = np.sort(self.t_recv[-len(times):] - times)
+        interval = float(intervals[len(intervals) // 2])
+        jitter = float(lags[int(0.9 * (len(lags) - 1))])
+        return min(DELAY_MARGIN * interval + jitter, MAX_DELAY)
+
+    def angular_velocity(self, times=None):
+        """
+        Rotation vector per second (quaternions) or (yaw, pitch, roll) degrees
+        per second over the last VELOCITY_SAMPLES samples
+        """
+        if times is None:
+            times = self.times()
+        n = min(len(times), VELOCITY_SAMPLES)
+        span = times[-1] - times[-n] if n > 1 else 0.0
+        if span <= 0.0:
+            return np.zeros(3)
+        poses = self.poses[-n:]
+        if(self.useQuat):
+            steps = quat.to_rotvec(quat.multiply(poses[1:], quat.conjugate(poses[:-1])))
+        else:
+            steps = _wrap(np.diff(poses[:, :3], axis=0))
+        return steps.sum(0) / span
+
+    def _stats(self):
+        if self._cache is None:
+            times = self.times()
+            self._cache = (times, self.current_delay(times), self.angular_velocity(times))
+        return self._cache
+
+    def pose(self, now=None):
+        """
+        The pose to draw at host time now (time.monotonic()), None before
+        the first sample
+        """
+        if not self.count:
+            return None
+        if now is None:
+            now = time.monotonic()
+        times, delay, omega = self._stats()
+        t = now - delay
+        i = int(np.searchsorted(times, t, side='right'))
+        poses = self.poses[-self.count:]
+        self.shown = min(max(t, times[0]), times[-1])
+        if i == 0:
+            pose = poses[0]
+        elif i < len(times):
+            u = (t - times[i - 1]) / (times[i] - times[i - 1])
+            pose = self._interpolate(poses[i - 1], poses[i], u)
+        elif self.extrapolate:
+            dt = min(t - times[-1], self.max_extrapolation)
+            self.shown = times[-1] + dt
+            if(self.useQuat):
+                pose = quat.normalize(quat.multiply(quat.from_rotvec(omega * dt), poses[-1]))
+            else:
+                pose = self._interpolate(poses[-1], np.append(poses[-1, :3] + omega * dt, 0.0), 1.0)
+        else:
+            pose = poses[-1]
+        return tuple(pose.tolist()) if self.useQuat else tuple(pose[:3].tolist())
+
+    def _interpolate(self, a, b, u):
+        if(self.useQuat):
+            return quat.slerp(a, b, u)
+        angles = a[:3] + _wrap(b[:3] - a[:3]) * u
+        # back into the range the sensor reports, yaw 0..360 or -180..180
+        angles = np.where(angles >= 360.0, angles - 360.0, np.where(angles < -180.0, angles + 360.0, angles))
+        return np.append(angles, 0.0)
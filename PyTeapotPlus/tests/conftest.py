@@ -0,0 +1,10 @@
+"""
+The PyTeapotPlus scripts import each other as siblings, so the tests import
+them the same way: python -m pytest PyTeapotPlus/tests
+"""
+
+import os
+import sys
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
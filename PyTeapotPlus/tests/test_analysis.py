@@ -0,0 +1,102 @@
+"""
+Known-answer checks of the session log analysis on a synthetic capture, and
+that the chunk size does not change its results
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+import quat
+from analysis import analyze
+from session import Recorder
+
+RATE = 100.0
+SAMPLES = 12000  # 120 s; the longest Allan cluster reported, 1000 samples, is the same for both chunk sizes
+GAP = range(5000, 5050)  # samples lost in transmission, 0.51 s between their neighbours
+DRIFT = 6.0  # yaw drift, deg/min
+NOISE = 0.01  # white angle noise, deg
+START = (179.0, 2.0, -1.0)  # yaw crosses +-180 degrees after 10 s
+
+
+def calibration(i):
+    if i < 1000:
+        return None  # not reported yet
+    if i < 3000:
+        return (1, 3, 2, 0)
+    return (3, 3, 3, 3)
+
+
+@pytest.fixture(scope='module', params=[False, True], ids=['ypr', 'quat'])
+def log(request, tmp_path_factory):
+    useQuat = request.param
+    path = str(tmp_path_factory.mktemp('analysis') / 'still.ptrec')
+    rng = np.random.default_rng(7)
+    t = np.arange(SAMPLES) / RATE
+    angles = np.array(START) + NOISE * rng.standard_normal((SAMPLES, 3))
+    angles[:, 0] += DRIFT * t / 60.0
+    angles[:, 0] = (angles[:, 0] + 180.0) % 360.0 - 180.0
+    values = quat.from_ypr(*angles.T) if useQuat else angles
+    with Recorder(path, useQuat) as recorder:
+        recorder.source_id('imu')
+        for i in range(SAMPLES):
+            if i not in GAP:
+                recorder.write(tuple(values[i]), 1000.0 + t[i], t[i], calibration(i))
+    return path
+
+
+def test_known_answers(log):
+    result = analyze(log)
+    assert result['samples'] == SAMPLES - len(GAP)
+    s, = result['sources']
+    assert s['name'] == 'imu'
+    assert s['rate_hz'] == pytest.approx(RATE)
+    assert s['restarts'] == 0
+    assert s['gaps']['count'] == 1
+    assert s['gaps']['missing_samples'] == len(GAP)
+    assert s['gaps']['longest_s'] == pytest.approx(0.51)
+    assert s['gaps']['first'] == [(pytest.approx(49.99), pytest.approx(0.51))]
+    drift = s['drift_deg_per_min']
+    assert drift['yaw'] == pytest.approx(DRIFT, abs=1e-3)  # across the wrap
+    assert drift['pitch'] == pytest.approx(0.0, abs=1e-3)
+    assert drift['roll'] == pytest.approx(0.0, abs=1e-3)
+    for axis in ('yaw', 'pitch', 'roll'):
+        assert s['noise_deg'][axis] == pytest.approx(NOISE, rel=0.05)
+        assert s['residual_rms_deg'][axis] == pytest.approx(NOISE, rel=0.05)
+    allan = s['allan_deg_per_s']
+    assert allan[0]['tau_s'] == pytest.approx(1.0 / RATE)
+    assert allan[-1]['tau_s'] == pytest.approx(10.0)
+    # white angle noise: sigma(tau) = sqrt(3) NOISE / tau, falling with every cluster size
+    assert allan[0]['pitch'] == pytest.approx(math.sqrt(3.0) * NOISE * RATE, rel=0.05)
+    assert all(a['pitch'] > b['pitch'] for a, b in zip(allan, allan[1:]))
+    cal = s['calibration']
+    assert cal['timeline'] == [(0.0, None), (pytest.approx(10.0), (1, 3, 2, 0)), (pytest.approx(30.0), (3, 3, 3, 3))]
+    assert cal['changes'] == 2
+    assert cal['unknown_seconds'] == pytest.approx(10.0)
+    assert cal['sys_seconds'] == pytest.approx([0.0, 20.0, 0.0, 89.99])
+    assert cal['sys3_after_s'] == pytest.approx(30.0)
+    assert cal['full_after_s'] == pytest.approx(30.0)
+    assert cal['full_fraction'] == pytest.approx(89.99 / 119.99)
+
+
+def same(a, b):
+    """
+    Whether two analysis results agree up to rounding
+    """
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(same(a[key], b[key]) for key in a)
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    if isinstance(a, float):
+        return a == pytest.approx(b, rel=1e-9, abs=1e-12)
+    return a == b
+
+
+def test_chunk_size_does_not_change_the_results(log):
+    whole = analyze(log)['sources']
+    chunked = analyze(log, chunk=3000)['sources']
+    assert len(whole[0]['allan_deg_per_s']) == len(chunked[0]['allan_deg_per_s'])
+    for key in ('drift_deg_per_min', 'residual_rms_deg', 'noise_deg', 'allan_deg_per_s',
+                'bias_instability_deg_per_s', 'gaps', 'calibration', 'rate_hz', 'restarts'):
+        assert same(whole[0][key], chunked[0][key]), key
@@ -0,0 +1,114 @@
+"""
+Checks of the viewer options: types, choices and ranges are enforced before
+any viewer module is imported
+"""
+
+import argparse
+import json
+import math
+import subprocess
+import sys
+
+import pytest
+
+import cli
+
+
+def changes(*argv, viewer='model'):
+    parser = argparse.ArgumentParser()
+    cli.add_options(parser, viewer)
+    return cli.overrides(parser.parse_args(argv), cli.defaults(cli.VIEWERS[viewer]))
+
+
+def test_coerce_types():
+    assert cli.coerce('FPS_LIMIT', 30, 60) == 30
+    assert cli.coerce('REPLAY_SPEED', 2, 1.0) == 2.0 and isinstance(cli.coerce('REPLAY_SPEED', 2, 1.0), float)
+    assert cli.coerce('DISPLAY_SIZE', [800, 600], (640, 480)) == (800, 600)
+    assert cli.coerce('SMOOTHING_DELAY', 1, None) == 1.0
+    assert cli.coerce('BUS_NAME', 'pyteapot', None) == 'pyteapot'
+    assert cli.coerce('RECORD_FILE', None, None) is None
+    assert cli.coerce('SMOOTHING', None, 'interpolate') is None
+    assert cli.coerce('LOG_LEVEL', 'warning', 'INFO') == 'warning'
+
+
+@pytest.mark.parametrize('name, value, default', [
+    ('useQuat', 1, True),
+    ('FPS_LIMIT', True, 60),
+    ('FPS_LIMIT', '30', 60),
+    ('DISPLAY_SIZE', (800, 600, 1), (640, 480)),
+    ('SERIAL_PORT', 19, 'COM19'),
+    ('BUS_NAME', 5, None),
+    ('METRICS_PORT', 9105.0, None),
+    ('SMOOTHING_DELAY', 'soon', None),
+])
+def test_coerce_rejects_types(name, value, default):
+    with pytest.raises(ValueError, match=name):
+        cli.coerce(name, value, default)
+
+
+@pytest.mark.parametrize('name, value, default', [
+    ('SMOOTHING', 'bogus', 'interpolate'),
+    ('LOG_LEVEL', 'bogus', 'INFO'),
+    ('LOG_LEVEL', None, 'INFO'),
+    ('FPS_LIMIT', -1, 60),
+    ('REPLAY_SPEED', math.nan, 1.0),
+    ('SMOOTHING_DELAY', -0.1, None),
+    ('UDP_PORT', 70000, 5555),
+    ('FORCE_LOD', -1, None),
+    ('DISPLAY_SIZE', (0, 480), (640, 480)),
+    ('COLOR', (0.1, 1.5, 0.1), (0.1, 0.3, 0.1)),
+    ('COLOR', ('red', 0.3, 0.1), (0.1, 0.3, 0.1)),
+])
+def test_coerce_rejects_values(name, value, default):
+    with pytest.raises(ValueError, match=name):
+        cli.coerce(name, value, default)
+
+
+def test_overrides_transports():
+    assert changes('--serial', '/dev/ttyUSB0', '--baud', '921600') == {
+        'REPLAY_FILE': None, 'BUS_NAME': None, 'RELAY_ADDRESS': None,
+        'useSerial': True, 'SERIAL_PORT': '/dev/ttyUSB0', 'SERIAL_BAUD': 921600}
+    udp = changes('--udp', '0.0.0.0:5556', '--binary', '--euler')
+    assert (udp['useSerial'], udp['UDP_IP'], udp['UDP_PORT']) == (False, '0.0.0.0', 5556)
+    assert udp['useBinary'] is True and udp['useQuat'] is False
+    assert changes('--udp', '5557')['UDP_IP'] == ''
+    assert changes('--relay', '/tmp/pyteapot.sock')['RELAY_ADDRESS'] == '/tmp/pyteapot.sock'
+
+
+def test_overrides_config_file_and_set(tmp_path):
+    path = tmp_path / 'desk.json'
+    path.write_text(json.dumps({'FPS_LIMIT': 30, 'SMOOTHING': 'extrapolate', 'OBJ_FILE': 'car.obj'}))
+    result = changes('--config', str(path), '--set', 'FPS_LIMIT=24', '--set', 'COLOR=(1, 0, 0)', '--obj', 'van.obj')
+    assert result == {'FPS_LIMIT': 24, 'SMOOTHING': 'extrapolate', 'OBJ_FILE': 'van.obj', 'COLOR': (1, 0, 0)}
+
+
+@pytest.mark.parametrize('argv', [
+    ('--set', 'SMOOTHING=bogus'),
+    ('--set', 'LOG_LEVEL=bogus'),
+    ('--set', 'FPS_LIMIT=-5'),
+    ('--fps', '-1'),
+    ('--set', 'NO_SUCH_NAME=1'),
+    ('--set', 'FPS_LIMIT'),
+    ('--udp', 'host:port'),
+    ('--udp', '70000'),
+    ('--serial', 'COM3', '--multi'),
+])
+def test_overrides_rejects(argv):
+    with pytest.raises(ValueError):
+        changes(*argv)
+
+
+def test_overrides_model_options_only_for_model():
+    with pytest.raises(ValueError, match='OBJ_FILE'):
+        changes('--set', 'OBJ_FILE=car.obj', viewer='cube')
+
+
+def test_checks_without_loading_the_viewers():
+    code = "import sys, cli; cli.main(['cube', '--set', 'FPS_LIMIT=-1'])"
+    proc = subprocess.run([sys.executable, '-c', code], cwd=cli.HERE, capture_output=True, text=True, timeout=60)
+    assert proc.returncode == 2
+    assert "FPS_LIMIT should be at least 0" in proc.stderr
+    code = ("import sys, cli; cli.main(['cube', '--print-config']); "
+            "print(sorted({'pygame', 'OpenGL', 'numpy', 'pyteapotplus'} & set(sys.modules)))")
+    proc = subprocess.run([sys.executable, '-c', code], cwd=cli.HERE, capture_output=True, text=True, timeout=60)
+    assert proc.stdout.splitlines()[-1] == '[]'
@@ -0,0 +1,56 @@
+"""
+Known-answer checks of the text frame parser
+"""
+
+import pytest
+
+from frameparser import FrameError, decode_log, parse_frame, parse_quat, parse_time, parse_ypr
+
+
+QUAT = b"w0.7071w a0.0000a b-0.7071b c1e-3c t123456t \r\n"
+YPR = b"y12.3456y p-1.2345p r.5r "
+
+
+def test_parse():
+    assert parse_quat(QUAT) == (0.7071, 0.0, -0.7071, 0.001)
+    assert parse_ypr(YPR) == (12.3456, -1.2345, 0.5)
+    assert parse_frame(bytearray(QUAT), True) == parse_quat(QUAT)
+    assert parse_frame(memoryview(YPR), False) == parse_ypr(YPR)
+
+
+def test_parse_time():
+    assert parse_time(QUAT) == 123.456
+    assert parse_time(YPR) is None
+
+
+@pytest.mark.parametrize('frame', [
+    b"",
+    b"w0.7071w a0.0000a b0.7071b",                     # a value missing
+    b"w0.7071w a0.0000a b0.7071b c0.0000",             # closing tag missing
+    b"w0.7071w a0.0000a bnanb c0.0000c",               # not a number
+    b"w0.70.71w a0.0000a b0.7071b c0.0000c",           # two decimal points
+    b"w0.7071w a0.0000a c0.0000c b0.7071b",            # fields out of order
+    b"Calibration: Sys=3 Gyro=3 Accel=3 Mag=3",
+])
+def test_malformed_quaternion(frame):
+    with pytest.raises(FrameError):
+        parse_quat(frame)
+
+
+@pytest.mark.parametrize('frame', [b"y12.3y p1.0p", b"y12.3y p-p r1.0r", QUAT])
+def test_malformed_ypr(frame):
+    with pytest.raises(FrameError):
+        parse_ypr(frame)
+
+
+def test_frame_error_is_value_error():
+    with pytest.raises(ValueError):
+        parse_frame(YPR, True)
+
+
+def test_decode_log_skips_junk():
+    dump = b"BNO055 ready\r\n" + QUAT + b"w1.0w a2.0a\r\n" + QUAT.replace(b"0.7071w", b"1.0w") + b"Sys=3\r\n"
+    values = decode_log(dump)
+    assert values.shape == (2, 4)
+    assert values.tolist() == [[0.7071, 0.0, -0.7071, 0.001], [1.0, 0.0, -0.7071, 0.001]]
+    assert decode_log(b"no frames here", useQuat=False).shape == (0, 3)
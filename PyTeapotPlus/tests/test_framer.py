@@ -0,0 +1,109 @@
+"""
+Checks of the serial line framer: partial lines, resynchronising, the framing
+policies and the firmware status lines
+"""
+
+import pytest
+
+from framer import KEEP_ALL, KEEP_LATEST, DeviceTiming, LineFramer, parse_calibration, parse_timing
+
+QUAT = b"w1.0000w a0.0000a b0.0000b c0.0000c t1000t"
+YPR = b"y10.00y p-5.00p r180.00r t1010t"
+
+
+def feed_all(framer, stream, size):
+    frames = []
+    for i in range(0, len(stream), size):
+        frames += framer.feed(stream[i:i + size])
+    return frames
+
+
+@pytest.mark.parametrize('size', [1, 3, 7, 64])
+def test_frames_split_across_reads(size):
+    framer = LineFramer()
+    stream = (QUAT + b" \r\n" + YPR + b" \r\n") * 3
+    assert feed_all(framer, stream, size) == [QUAT, YPR] * 3
+    assert framer.skipped == 0
+
+
+def test_partial_tail_waits_for_its_line_break():
+    framer = LineFramer()
+    assert framer.feed(QUAT[:10]) == []
+    assert framer.feed(QUAT[10:] + b" \r\n" + YPR[:5]) == [QUAT]
+    assert framer.feed(YPR[5:]) == []
+    assert framer.feed(b" \n") == [YPR]
+
+
+def test_resynchronises_on_garbage_without_line_break():
+    framer = LineFramer(max_line=32)
+    assert framer.feed(b"\x00\xff" * 20) == []  # 40 bytes, not a line
+    assert framer.skipped == 1
+    assert framer.feed(QUAT[:20]) == []  # the rest of the garbage went with it
+    assert framer.feed(QUAT[20:] + b" \r\n") == [QUAT]
+    framer.feed(b"\xa5" * 20)
+    framer.feed(b"\xa5" * 20)
+    assert framer.skipped == 2
+    assert framer.feed(b"\xa5" * 10 + b"\r\n" + QUAT + b"\r\n") == [QUAT]  # a short run ends at its line break
+    assert framer.skipped == 3
+
+
+def test_skips_text_lines():
+    framer = LineFramer()
+    stream = b"BNO055 setup\r\n\r\n" + QUAT + b"\r\nOrientation Sensor Test\r\n"
+    assert framer.feed(stream) == [QUAT]
+    assert framer.skipped == 2
+
+
+def test_policies():
+    stream = b"".join(QUAT.replace(b"t1000t", b"t%dt" % i) + b" \r\n" for i in range(5))
+    every = LineFramer(KEEP_ALL)
+    latest = LineFramer(KEEP_LATEST)
+    assert len(every.feed(stream)) == 5
+    assert latest.feed(stream) == [QUAT.replace(b"t1000t", b"t4t")]
+    assert latest.feed(QUAT[:8]) == []
+    assert latest.feed(QUAT[8:] + b"\n") == [QUAT]
+    with pytest.raises(ValueError):
+        LineFramer('newest')
+
+
+def test_status_lines_update_calibration_and_timing():
+    framer = LineFramer()
+    stream = (b"! \tSys:0 G:3 A:1 M:0\r\n" + QUAT + b"\r\n"
+              b"\tRate:99.50 Jitter:12 Max:85 Missed:3\r\n" + YPR + b"\r\n")
+    assert framer.feed(stream) == [QUAT, YPR]
+    assert framer.calibration == (0, 3, 1, 0)
+    assert framer.timing == DeviceTiming(99.5, 12.0, 85.0, 3)
+    assert framer.skipped == 0
+    framer.feed(b"\tSys:3 G:3 A:3 M:3\r\n")
+    assert framer.calibration == (3, 3, 3, 3)
+    framer.feed(b"\tRate:oops\r\n")  # malformed, counted and the last timing kept
+    assert framer.timing.missed == 3
+    assert framer.skipped == 1
+
+
+def test_status_parsers():
+    assert parse_calibration(b"Sys:2 G:3 A:0 M:1") == (2, 3, 0, 1)
+    assert parse_timing(b"Rate:100.00 Jitter:0 Max:0 Missed:0") == DeviceTiming(100.0, 0.0, 0.0, 0)
+
+
+class FakePort:
+    def __init__(self, data):
+        self.data = data
+        self.sizes = []
+
+    @property
+    def in_waiting(self):
+        return len(self.data)
+
+    def read(self, size):
+        self.sizes.append(size)
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+
+def test_read_from_takes_everything_waiting():
+    port = FakePort(QUAT + b"\r\n" + YPR + b"\r\n")
+    framer = LineFramer()
+    assert framer.read_from(port) == [QUAT, YPR]
+    assert framer.read_from(port) == []
+    assert port.sizes == [len(QUAT) + len(YPR) + 4, 1]
@@ -0,0 +1,85 @@
+"""
+Known-answer checks of the quaternion maths against the Euler angle and
+glRotatef code it replaced
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+import quat
+
+
+def gl_rotate(angle, x, y, z):
+    """
+    The matrix glRotatef(angle, x, y, z) multiplies by, as in the OpenGL
+    specification
+    """
+    x, y, z = np.array([x, y, z], np.float64) / math.sqrt(x * x + y * y + z * z)
+    c, s = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    return np.array([[x * x * (1 - c) + c, x * y * (1 - c) - z * s, x * z * (1 - c) + y * s],
+                     [y * x * (1 - c) + z * s, y * y * (1 - c) + c, y * z * (1 - c) - x * s],
+                     [x * z * (1 - c) - y * s, y * z * (1 - c) + x * s, z * z * (1 - c) + c]])
+
+
+def gl_applied(q):
+    """
+    The matrix glMultMatrixf(gl_matrix(q)) multiplies by
+    """
+    m = quat.gl_matrix(q)
+    assert m.dtype == np.float32 and m.shape == (4, 4)
+    assert m[3].tolist() == [0.0, 0.0, 0.0, 1.0] and m[:, 3].tolist() == [0.0, 0.0, 0.0, 1.0]
+    return m.T[:3, :3]  # OpenGL reads the array column by column
+
+
+ANGLES = [(0.0, 0.0, 0.0), (90.0, 0.0, 0.0), (0.0, 45.0, 0.0), (0.0, 0.0, -30.0),
+          (40.2381, -12.5, 170.0), (-135.0, 60.0, 25.0), (179.0, -89.0, -179.0)]
+
+
+def test_from_ypr_known_answers():
+    h = math.sqrt(0.5)
+    assert np.allclose(quat.from_ypr(90.0, 0.0, 0.0), [h, 0.0, 0.0, h])
+    assert np.allclose(quat.from_ypr(0.0, 90.0, 0.0), [h, 0.0, h, 0.0])
+    assert np.allclose(quat.from_ypr(0.0, 0.0, 90.0), [h, h, 0.0, 0.0])
+
+
+@pytest.mark.parametrize('yaw, pitch, roll', ANGLES)
+def test_from_ypr_is_z_y_x(yaw, pitch, roll):
+    expected = gl_rotate(yaw, 0, 0, 1) @ gl_rotate(pitch, 0, 1, 0) @ gl_rotate(roll, 1, 0, 0)
+    assert np.allclose(quat.ypr_to_matrix(yaw, pitch, roll), expected)
+
+
+def test_to_ypr_inverts_from_ypr():
+    rng = np.random.default_rng(1)
+    ypr = np.column_stack([rng.uniform(-180, 180, 1000), rng.uniform(-89, 89, 1000), rng.uniform(-180, 180, 1000)])
+    q = quat.from_ypr(ypr[:, 0], ypr[:, 1], ypr[:, 2])
+    assert q.shape == (1000, 4)
+    assert np.allclose(np.linalg.norm(q, axis=-1), 1.0)
+    assert np.allclose(quat.to_ypr(q), ypr, atol=1e-7)
+    assert np.allclose(quat.to_ypr(-q), ypr, atol=1e-7)  # q and -q are the same rotation
+
+
+def test_to_ypr_at_gimbal_lock():
+    ypr = quat.to_ypr(quat.from_ypr(30.0, 90.0, 10.0))
+    assert ypr[1] == pytest.approx(90.0)
+    assert ypr[2] == pytest.approx(0.0, abs=1e-6)  # the whole turn goes to yaw
+    assert np.allclose(quat.ypr_to_matrix(*ypr), quat.ypr_to_matrix(30.0, 90.0, 10.0))
+
+
+@pytest.mark.parametrize('yaw, pitch, roll', ANGLES)
+def test_gl_matrix_matches_car_rotations(yaw, pitch, roll):
+    # pyteapot_3dm.py: glRotatef(yaw, 0, 0, 1); glRotatef(pitch, 1, 0, 0); glRotatef(-roll, 0, 1, 0)
+    old = gl_rotate(yaw, 0, 0, 1) @ gl_rotate(pitch, 1, 0, 0) @ gl_rotate(-roll, 0, 1, 0)
+    rotation = quat.multiply(quat.multiply(quat.from_axis_angle(quat.Z_AXIS, yaw),
+                                           quat.from_axis_angle(quat.X_AXIS, pitch)),
+                             quat.from_axis_angle(quat.Y_AXIS, -roll))
+    assert np.allclose(gl_applied(rotation), old, atol=1e-6)
+
+
+@pytest.mark.parametrize('yaw, pitch, roll', ANGLES[1:])
+def test_gl_matrix_matches_board_rotation(yaw, pitch, roll):
+    # pyteapotplus.py: glRotatef(2 * acos(w) in degrees, -ny, nz, -nx)
+    w, nx, ny, nz = quat.from_ypr(yaw, pitch, roll)
+    old = gl_rotate(math.degrees(2 * math.acos(w)), -ny, nz, -nx)
+    assert np.allclose(gl_applied([w, -ny, nz, -nx]), old, atol=1e-6)
@@ -0,0 +1,210 @@
+"""
+Checks of the sample relay: what clients receive, slow clients, reconnecting
+and stopping with clients attached
+"""
+
+import asyncio
+import contextlib
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from ingest import IngestWorker, LatestSlot, UdpSource
+from relay import RelayClient, RelayServer, RelaySource
+from wire import BinaryFramer
+
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="the tests serve on a Unix socket")
+
+QUAT = (1.0, 0.0, 0.0, 0.0)
+
+
+def read_until(source, count, timeout=5.0):
+    """
+    Readings of source until count arrived or timeout passed
+    """
+    readings = []
+    deadline = time.monotonic() + timeout
+    while len(readings) < count and time.monotonic() < deadline:
+        readings += source.read()
+    return readings
+
+
+def connected(relay, count=1, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while len(relay.clients) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return len(relay.clients) >= count
+
+
+@contextlib.contextmanager
+def serving(address, **kwargs):
+    relay = RelayServer(address, **kwargs)
+    relay.start()
+    try:
+        yield relay
+    finally:
+        relay.close()
+
+
+@pytest.fixture
+def address(tmp_path):
+    return str(tmp_path / 'relay.sock')
+
+
+def test_unknown_time_and_calibration_stay_unknown(address):
+    udp = UdpSource('127.0.0.1', 0)
+    port = udp.sock.getsockname()[1]
+    relay = RelayServer(address)
+    relay.start()
+    worker = IngestWorker(udp, LatestSlot(), recorder=relay)
+    worker.start()
+    client = RelaySource(address)
+    client.connect()
+    assert connected(relay)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sender.sendto(b"w0.7071w a0.0000a b0.7071b c0.0000c ", ('127.0.0.1', port))
+        sender.sendto(b"w1.0000w a0.0000a b0.0000b c0.0000c t123456t ", ('127.0.0.1', port))
+        readings = read_until(client, 2)
+    finally:
+        sender.close()
+        worker.stop()
+        worker.join()
+        udp.close()
+        client.close()
+        relay.close()
+    assert len(readings) == 2
+    assert readings[0].values == pytest.approx((0.7071, 0.0, 0.7071, 0.0))  # float32 on the wire
+    assert readings[1].values == QUAT
+    assert readings[0].t_device is None  # not the relay's receive time
+    assert readings[0].cal is None  # not Sys:0
+    assert readings[1].t_device == 123.456
+    assert client.framer.calibration is None
+
+
+def test_known_time_and_calibration_pass_through(address):
+    with serving(address, useQuat=False) as relay:
+        client = RelaySource(address, useQuat=False)
+        client.connect()
+        assert connected(relay)
+        relay.write((10.0, 20.0, 30.0), 5.0, 1.25, (3, 2, 1, 0))
+        reading, = read_until(client, 1)
+        client.close()
+    assert reading == ((10.0, 20.0, 30.0), 1.25, (3, 2, 1, 0))
+
+
+class FakeWriter:
+    def get_extra_info(self, name):
+        return None
+
+
+def test_slow_client_queue_collapses_to_newest():
+    async def offer():
+        client = RelayClient(FakeWriter(), limit=4)
+        for frame in range(10):
+            client.offer(frame)
+        return client
+    client = asyncio.run(offer())
+    assert list(client.frames) == [8, 9]
+    assert client.coalesced == 8
+    assert client.ready.is_set()
+
+
+def test_stalled_client_skips_to_newest(address):
+    total = 5000
+    with serving(address, queue_frames=8) as relay:
+        stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        stalled.connect(address)
+        live = RelaySource(address)
+        live.connect()
+        assert connected(relay, 2)
+        newest = (total - 1) / 100.0
+        received = []
+
+        def follow():
+            deadline = time.monotonic() + 10.0
+            while not (received and received[-1].t_device == newest) and time.monotonic() < deadline:
+                received.extend(live.read())
+
+        reader = threading.Thread(target=follow, daemon=True)
+        reader.start()
+        for i in range(total):
+            relay.write(QUAT, float(i), i / 100.0)
+            if i % 100 == 99:
+                time.sleep(0.001)
+        reader.join()
+        live.close()
+        # the client that does not read holds up neither the relay nor the other client
+        assert received[-1].t_device == newest
+        skipped_first = round(received[0].t_device * 100)  # before its first frame, not a sequence gap
+        assert skipped_first + len(received) + live.dropped == total
+        framer = BinaryFramer()
+        frames = []
+        stalled.settimeout(0.5)
+        try:
+            while not (frames and frames[-1].seq == total):
+                data = stalled.recv(65536)
+                if not data:
+                    break
+                frames += framer.feed(data)
+        except TimeoutError:
+            pass
+        stalled.close()
+    assert frames[-1].seq == total  # once it reads again it gets the newest sample
+    assert framer.seq.dropped > 0  # and has skipped stale ones
+    assert frames[0].seq - 1 + len(frames) + framer.seq.dropped == total
+
+
+def test_source_reconnects_after_relay_restart(address):
+    client = RelaySource(address, timeout=0.05)
+    with pytest.raises(OSError):  # nothing listens yet
+        client.read()
+    relay = RelayServer(address)
+    relay.start()
+    assert read_until(client, 1, 0.2) == []
+    assert connected(relay)
+    for i in range(3):
+        relay.write(QUAT, float(i), float(i))
+    assert len(read_until(client, 3)) == 3
+    relay.close()
+    with pytest.raises(OSError):
+        read_until(client, 1)
+    relay = RelayServer(address)
+    relay.start()
+    try:
+        assert read_until(client, 1, 0.2) == []
+        assert connected(relay)
+        relay.write(QUAT, 10.0, 10.0)
+        reading, = read_until(client, 1)
+        assert reading.t_device == 10.0
+        assert client.dropped == 0  # numbering starts over with the new relay, that is not a loss
+    finally:
+        client.close()
+        relay.close()
+
+
+def test_close_with_clients_attached(address):
+    relay = RelayServer(address)
+    relay.start()
+    clients = [RelaySource(address) for _ in range(3)]
+    for client in clients:
+        client.connect()
+    assert connected(relay, 3)
+    closing = threading.Thread(target=relay.close, daemon=True)
+    started = time.monotonic()
+    closing.start()
+    closing.join(5.0)
+    assert not closing.is_alive(), "close() hangs while clients are connected"
+    assert time.monotonic() - started < 1.0
+    assert not relay.is_alive()
+    assert not os.path.exists(address)
+    for client in clients:
+        with pytest.raises(OSError):
+            read_until(client, 1)
+        client.close()
+    relay.close()  # a second close() is harmless
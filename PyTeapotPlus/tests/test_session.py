@@ -0,0 +1,139 @@
+"""
+Checks of the session log format (PTREC001), its reader and replay
+"""
+
+import math
+import time
+
+import pytest
+
+from session import HEADER_SIZE, RECORD, Recorder, ReplaySource, SessionLog
+
+
+def record(path, count=10, useQuat=True, interval=0.01):
+    """
+    Writes count samples alternately from two sources; odd samples carry a
+    device time and a calibration, even ones neither
+    """
+    with Recorder(path, useQuat, chunk=4) as recorder:
+        ids = [recorder.source_id('COM19'), recorder.source_id('192.168.1.7')]
+        for i in range(count):
+            values = (1.0, 0.0, 0.0, float(i)) if useQuat else (float(i), -1.0, 2.5)
+            known = i % 2 == 1
+            recorder.write(values, 100.0 + i * interval, i * interval if known else None,
+                           (3, 2, 1, i % 4) if known else None, ids[i % 2])
+    return path
+
+
+def test_round_trip(tmp_path):
+    log = SessionLog(record(tmp_path / 'quat.ptrec'))
+    assert len(log) == 10
+    assert log.useQuat is True
+    assert log.sources == ['COM19', '192.168.1.7']
+    assert log.header['records'] == 10
+    assert log.duration == pytest.approx(0.09)
+    assert log.records['source'].tolist() == [0, 1] * 5
+    assert log.reading(0) == ((1.0, 0.0, 0.0, 0.0), None, None)
+    assert log.reading(3) == ((1.0, 0.0, 0.0, 3.0), pytest.approx(0.03), (3, 2, 1, 3))
+    assert log.reading(5).cal == (3, 2, 1, 1)
+    assert math.isnan(log.records['t_device'][0])
+    log.close()
+
+
+def test_round_trip_euler(tmp_path):
+    log = SessionLog(record(tmp_path / 'ypr.ptrec', useQuat=False))
+    assert log.useQuat is False
+    assert log.reading(4) == ((4.0, -1.0, 2.5), None, None)
+    assert log.records['values'][4].tolist() == [4.0, -1.0, 2.5, 0.0]
+    log.close()
+
+
+def test_zero_calibration_is_not_unknown(tmp_path):
+    with Recorder(tmp_path / 'cal.ptrec') as recorder:
+        recorder.write((1.0, 0.0, 0.0, 0.0), 1.0, None, (0, 0, 0, 0))
+        recorder.write((1.0, 0.0, 0.0, 0.0), 1.1, None, None)
+    log = SessionLog(tmp_path / 'cal.ptrec')
+    assert [log.reading(i).cal for i in range(2)] == [(0, 0, 0, 0), None]
+    log.close()
+
+
+def test_truncated_final_record(tmp_path):
+    path = record(tmp_path / 'cut.ptrec')
+    with open(path, 'ab') as f:
+        f.write(bytes(RECORD.itemsize - 1))  # the recorder died in the middle of a record
+    log = SessionLog(path)
+    assert len(log) == 10
+    assert log.reading(9).values == (1.0, 0.0, 0.0, 9.0)
+    log.close()
+    with open(path, 'r+b') as f:
+        f.truncate(HEADER_SIZE + 3 * RECORD.itemsize + 5)
+    log = SessionLog(path)
+    assert len(log) == 3
+    log.close()
+
+
+def test_log_still_being_written(tmp_path):
+    path = tmp_path / 'live.ptrec'
+    recorder = Recorder(path, chunk=4)
+    for i in range(6):
+        recorder.write((1.0, 0.0, 0.0, 0.0), float(i))
+    log = SessionLog(path)
+    assert len(log) == 4  # the first chunk is on disk, the rest is buffered
+    log.close()
+    recorder.close()
+    assert len(SessionLog(path)) == 6
+
+
+def test_rejects_other_files_and_modes(tmp_path):
+    path = tmp_path / 'other.bin'
+    path.write_bytes(b'not a session log' * 300)
+    with pytest.raises(ValueError):
+        SessionLog(path)
+    with pytest.raises(ValueError, match='useQuat'):
+        ReplaySource(record(tmp_path / 'quat.ptrec'), useQuat=False)
+
+
+def drain(source, timeout=5.0):
+    readings = []
+    deadline = time.monotonic() + timeout
+    while not source.finished and time.monotonic() < deadline:
+        readings += source.read()
+    return readings
+
+
+def test_replay_as_fast_as_possible(tmp_path):
+    source = ReplaySource(record(tmp_path / 'fast.ptrec', count=200), speed=0, timeout=0.01, batch=64)
+    assert len(source.read()) == 64
+    readings = drain(source)
+    assert len(readings) == 200 - 64
+    assert readings[-1].values == (1.0, 0.0, 0.0, 199.0)
+    source.close()
+
+
+def test_replay_of_one_source(tmp_path):
+    path = record(tmp_path / 'one.ptrec')
+    by_name = drain(ReplaySource(path, speed=0, timeout=0.01, source='192.168.1.7'))
+    by_index = drain(ReplaySource(path, speed=0, timeout=0.01, source=1))
+    assert [reading.values[3] for reading in by_name] == [1.0, 3.0, 5.0, 7.0, 9.0]
+    assert by_index == by_name
+
+
+@pytest.mark.parametrize('speed', [2.0, 10.0])
+def test_replay_speed(tmp_path, speed):
+    source = ReplaySource(record(tmp_path / 'timed.ptrec', count=21, interval=0.02), speed=speed, timeout=0.005)
+    started = time.monotonic()
+    readings = drain(source)
+    elapsed = time.monotonic() - started
+    assert len(readings) == 21
+    assert 0.4 / speed * 0.9 <= elapsed <= 0.4 / speed + 0.15  # 0.4 s recorded
+    source.close()
+
+
+def test_replay_loop(tmp_path):
+    source = ReplaySource(record(tmp_path / 'loop.ptrec', count=5), speed=0, loop=True, timeout=0.01)
+    readings = []
+    for _ in range(3):
+        readings += source.read()  # one pass each, the whole log fits a batch
+    assert [reading.values[3] for reading in readings] == [0.0, 1.0, 2.0, 3.0, 4.0] * 3
+    assert not source.finished
+    source.close()
@@ -0,0 +1,168 @@
+"""
+Checks of the shared-memory bus: the seqlock slots, publisher restarts and
+takeovers
+"""
+
+import itertools
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from shmbus import BusReader, BusWriter
+
+
+_names = itertools.count()
+
+
+@pytest.fixture
+def name():
+    """
+    A bus name of its own for every test, its block removed afterwards
+    """
+    name = f'pt-test-{os.getpid()}-{next(_names)}'
+    yield name
+    try:
+        BusWriter(name, capacity=1).close()  # takes over whatever is left, then removes it
+    except FileExistsError:
+        pass
+
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+
+def publish(writer, count, start=0):
+    for i in range(start, start + count):
+        writer.write((float(i), 0.0, 0.0, 0.0), float(i), None, (3, 3, 3, 3) if i % 2 else None)
+
+
+def test_round_trip(name):
+    with BusWriter(name, capacity=16) as writer, BusReader(name) as reader:
+        writer.source_id('imu')
+        publish(writer, 5)
+        samples = reader.wait(1.0)
+        assert [sample.seq for sample in samples] == [1, 2, 3, 4, 5]
+        assert [sample.values[0] for sample in samples] == [0.0, 1.0, 2.0, 3.0, 4.0]
+        assert samples[0].cal is None and samples[1].cal == (3, 3, 3, 3)
+        assert samples[0].t_device is None
+        assert reader.sensors == ['imu']
+        assert reader.latest().seq == 5
+        assert reader.read().size == 0
+
+
+def test_skips_a_slot_being_written(name):
+    with BusWriter(name, capacity=16) as writer, BusReader(name) as reader:
+        publish(writer, 5)
+        writer._seqs[3] = 0  # sample 3 is half written
+        assert reader.records(1, 5)['seq'].tolist() == [1, 2, 4, 5]
+        assert reader.read()['seq'].tolist() == [1, 2, 4, 5]
+        assert reader.missed == 1
+        writer._seqs[5] = 0
+        assert reader.latest().seq == 4  # the newest consistent sample
+
+
+def test_skips_overwritten_slots(name):
+    with BusWriter(name, capacity=8) as writer, BusReader(name) as reader:
+        publish(writer, 20)
+        assert reader.records(1, 20)['seq'].tolist() == list(range(13, 21))  # slots 1..12 hold newer samples
+        records = reader.read()
+        assert records['seq'].tolist() == list(range(13, 21))
+        assert reader.missed == 12
+        publish(writer, 3, 20)
+        assert reader.read()['seq'].tolist() == [21, 22, 23]
+        assert reader.missed == 12
+
+
+def test_reader_starts_over_on_a_new_epoch(name):
+    writer = BusWriter(name, capacity=16)
+    reader = BusReader(name)
+    try:
+        publish(writer, 10)
+        assert len(reader.read()) == 10
+        epoch = int(writer.header['epoch'])
+        writer.header['pid'] = dead_pid()
+        writer.close(unlink=False)  # crashed, the block stays
+        writer = BusWriter(name, capacity=16)
+        assert int(writer.header['epoch']) == epoch + 1
+        publish(writer, 3, 100)
+        samples = reader.wait(1.0)  # head 3 is behind the 10 read before
+        assert [sample.seq for sample in samples] == [1, 2, 3]
+        assert [sample.values[0] for sample in samples] == [100.0, 101.0, 102.0]
+        assert reader.missed == 0
+    finally:
+        reader.close()
+        writer.close()
+
+
+@pytest.mark.skipif(os.name != 'posix', reason="tells a crashed publisher by its pid")
+def test_reader_reattaches_to_a_new_block(name):
+    writer = BusWriter(name, capacity=16)
+    reader = BusReader(name)
+    try:
+        publish(writer, 4)
+        assert len(reader.read()) == 4
+        writer.header['pid'] = dead_pid()
+        writer.close()  # crashed, and the block removed as the resource tracker does
+        assert reader.wait(0.01) == []
+        writer = BusWriter(name, capacity=16, useQuat=False)
+        publish(writer, 2, 50)
+        assert reader.reattach()
+        assert not reader.useQuat
+        samples = reader.wait(1.0)
+        assert [(sample.seq, sample.values) for sample in samples] == [(1, (50.0, 0.0, 0.0)), (2, (51.0, 0.0, 0.0))]
+        assert not reader.reattach()  # its publisher runs
+    finally:
+        reader.close()
+        writer.close()
+
+
+@pytest.mark.skipif(os.name != 'posix', reason="tells a crashed publisher by its pid")
+def test_wait_reattaches_on_timeout(name):
+    writer = BusWriter(name, capacity=16)
+    reader = BusReader(name)
+    try:
+        writer.header['pid'] = dead_pid()
+        writer.close()
+        writer = BusWriter(name, capacity=16)
+        assert reader.wait(0.01) == []  # times out on the old block, then switches
+        publish(writer, 1)
+        assert len(reader.wait(1.0)) == 1
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_refuses_a_running_publisher(name):
+    with BusWriter(name) as writer:
+        with pytest.raises(FileExistsError, match='running publisher'):
+            BusWriter(name)
+        publish(writer, 1)
+        assert int(writer.header['head']) == 1  # the refused writer left the bus alone
+
+
+@pytest.mark.skipif(os.name != 'posix', reason="tells a running publisher by its pid")
+def test_refuses_a_live_pid_and_takes_over_once_it_is_gone(name):
+    other = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+    try:
+        writer = BusWriter(name, capacity=16)
+        publish(writer, 3)
+        epoch = int(writer.header['epoch'])
+        writer.header['pid'] = other.pid  # the bus of another, running process
+        writer.close(unlink=False)
+        with pytest.raises(FileExistsError):
+            BusWriter(name, capacity=16)
+        with BusReader(name) as reader:
+            assert reader.head == 3  # still there
+    finally:
+        other.kill()
+        other.wait()
+    with BusWriter(name, capacity=16) as writer:
+        assert int(writer.header['epoch']) == epoch + 1
+        assert int(writer.header['pid']) == os.getpid()
+        assert int(writer.header['head']) == 0
+        assert np.all(writer.slots['seq'] == 0)
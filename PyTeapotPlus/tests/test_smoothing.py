@@ -0,0 +1,92 @@
+"""
+Known-answer checks of the pose smoother's outlier rejection and
+interpolation
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+import quat
+from smoothing import PoseSmoother
+
+
+RATE = 100.0  # Hz of the simulated sensor
+
+
+def steady(smoother, count=10, pose=(1.0, 0.0, 0.0, 0.0), start=0.0):
+    """
+    Feeds count samples of a board lying still, returns the time of the next
+    """
+    for i in range(count):
+        assert smoother.push(pose, start + i / RATE)
+    return start + count / RATE
+
+
+def newest(smoother):
+    return tuple(smoother.poses[-1])
+
+
+@pytest.mark.parametrize('values', [(2.0, 0.0, 0.0, 0.0), (0.0, 0.0, 0.0, 0.0), (0.5, 0.5, 0.0, 0.0),
+                                    (math.nan, 0.0, 0.0, 1.0), (math.inf, 0.0, 0.0, 0.0)])
+def test_rejects_non_unit_quaternions(values):
+    smoother = PoseSmoother(useQuat=True)
+    t = steady(smoother)
+    assert not smoother.push(values, t)
+    assert smoother.rejected == 1
+    assert smoother.accepted == 10
+    assert newest(smoother) == (1.0, 0.0, 0.0, 0.0)
+
+
+def test_normalises_near_unit_quaternions():
+    smoother = PoseSmoother(useQuat=True)
+    assert smoother.push((1.02, 0.0, 0.0, 0.0), 0.0)
+    assert newest(smoother) == (1.0, 0.0, 0.0, 0.0)
+
+
+def test_drops_a_stray_sample():
+    smoother = PoseSmoother(useQuat=True)
+    t = steady(smoother)
+    assert smoother.push((0.0, 0.0, 0.0, 1.0), t)  # 180 degrees off, held back
+    assert smoother.accepted == 10
+    assert smoother.push((1.0, 0.0, 0.0, 0.0), t + 1 / RATE)  # the board did not move
+    assert smoother.rejected == 1
+    assert smoother.accepted == 11
+    assert newest(smoother) == (1.0, 0.0, 0.0, 0.0)
+
+
+def test_confirms_a_real_jump():
+    smoother = PoseSmoother(useQuat=True)
+    t = steady(smoother)
+    turned = tuple(quat.from_ypr(120.0, 0.0, 0.0))
+    assert smoother.push(turned, t)
+    assert smoother.accepted == 10  # not drawn before it is confirmed
+    assert smoother.push(tuple(quat.from_ypr(121.0, 0.0, 0.0)), t + 1 / RATE)
+    assert smoother.rejected == 0
+    assert smoother.accepted == 12
+    assert np.allclose(smoother.poses[-2], turned)
+    assert np.allclose(quat.to_ypr(smoother.pose(t + 1.0)), (121.0, 0.0, 0.0))
+
+
+def test_drops_a_stray_euler_sample_and_confirms_a_jump():
+    smoother = PoseSmoother(useQuat=False)
+    t = steady(smoother, pose=(350.0, 0.0, 0.0))
+    assert smoother.push((170.0, 0.0, 0.0), t)
+    assert smoother.push((355.0, 0.0, 0.0), t + 1 / RATE)
+    assert smoother.rejected == 1
+    assert smoother.push((90.0, 0.0, 0.0), t + 2 / RATE)
+    assert smoother.push((91.0, 0.0, 0.0), t + 3 / RATE)
+    assert smoother.rejected == 1
+    assert newest(smoother)[:3] == (91.0, 0.0, 0.0)
+
+
+def test_interpolates_halfway():
+    smoother = PoseSmoother(useQuat=True, delay=0.05)
+    smoother.push((1.0, 0.0, 0.0, 0.0), 0.0)
+    smoother.push(tuple(quat.from_ypr(30.0, 0.0, 0.0)), 0.1)
+    assert np.allclose(quat.to_ypr(smoother.pose(now=0.1)), (15.0, 0.0, 0.0))
+    euler = PoseSmoother(useQuat=False, delay=0.05)
+    euler.push((350.0, 0.0, 0.0), 0.0)
+    euler.push((10.0, 0.0, 0.0), 0.1)
+    assert euler.pose(now=0.1) == pytest.approx((0.0, 0.0, 0.0), abs=1e-9)  # through north, not back round
@@ -0,0 +1,98 @@
+"""
+Known-answer checks of the binary wire protocol
+"""
+
+import struct
+
+import pytest
+
+from frameparser import FrameError
+from wire import (FLAG_NO_CAL, FLAG_NO_TIME, FRAME_SIZE, KIND_QUAT, KIND_YPR, MAGIC, SEQ_MOD, BinaryFramer,
+                  SeqTracker, crc16, decode, decode_batch, encode, encode_batch)
+
+
+def test_crc16_check_value():
+    assert crc16(b'123456789') == 0x29B1  # CRC-16/CCITT-FALSE check value
+
+
+def test_round_trip():
+    frame = encode(65537, 123456, (0.5, -0.5, 0.25, 1.0), cal=(3, 2, 1, 0))
+    assert len(frame) == FRAME_SIZE and frame[:2] == MAGIC
+    assert struct.unpack_from('<H', frame, 4)[0] == 1  # the sequence number wraps at 65536
+    decoded = decode(frame)
+    assert decoded.seq == 1
+    assert decoded.millis == 123456
+    assert decoded.cal == (3, 2, 1, 0)
+    assert decoded.values == (0.5, -0.5, 0.25, 1.0)
+
+
+def test_round_trip_ypr():
+    decoded = decode(encode(7, 0, (90.0, -45.0, 180.0), kind=KIND_YPR))
+    assert decoded.kind == KIND_YPR
+    assert decoded.values == (90.0, -45.0, 180.0)
+
+
+def test_unknown_time_and_calibration():
+    frame = encode(3, None, (1.0, 0.0, 0.0, 0.0), cal=None)
+    assert frame[2] == KIND_QUAT | FLAG_NO_TIME | FLAG_NO_CAL
+    decoded = decode(frame)
+    assert (decoded.kind, decoded.millis, decoded.cal) == (KIND_QUAT, None, None)
+    decoded = decode(encode(3, 0, (1.0, 2.0, 3.0), kind=KIND_YPR, cal=(0, 0, 0, 0)))
+    assert (decoded.kind, decoded.millis, decoded.cal, decoded.values) == (KIND_YPR, 0, (0, 0, 0, 0), (1.0, 2.0, 3.0))
+
+
+def test_batch_round_trip():
+    values = [(1.0, 0.0, 0.0, 0.0), (0.0, 1.0, 0.0, 0.0), (0.0, 0.0, 0.5, 0.5)]
+    batch = decode_batch(encode_batch(65535, [10, 20, 30], values))
+    assert batch.seq == 65535
+    assert batch.millis.tolist() == [10, 20, 30]
+    assert batch.values.tolist() == [list(row) for row in values]
+
+
+def test_corrupted_crc():
+    frame = bytearray(encode(1, 2, (1.0, 0.0, 0.0, 0.0)))
+    frame[12] ^= 0x01
+    with pytest.raises(FrameError, match="CRC"):
+        decode(frame)
+    batch = bytearray(encode_batch(1, [2], [(1.0, 0.0, 0.0, 0.0)]))
+    batch[-1] ^= 0xFF
+    with pytest.raises(FrameError, match="CRC"):
+        decode_batch(batch)
+
+
+def test_truncated_and_bad_magic():
+    frame = encode(1, 2, (1.0, 0.0, 0.0, 0.0))
+    with pytest.raises(FrameError, match="Truncated"):
+        decode(frame[:-1])
+    with pytest.raises(FrameError, match="magic"):
+        decode(b'\x00' + frame[1:])
+
+
+def test_resync_after_garbage():
+    framer = BinaryFramer()
+    good = [encode(seq, seq * 10, (1.0, 0.0, 0.0, 0.0)) for seq in range(3)]
+    corrupted = bytearray(encode(99, 0, (0.0, 1.0, 0.0, 0.0)))
+    corrupted[-1] ^= 0xFF
+    stream = b"BNO055 setup\r\n" + good[0] + b"\xa5\x00junk" + bytes(corrupted) + good[1] + good[2]
+    frames = []
+    for i in range(0, len(stream), 5):  # in pieces, as a serial port delivers it
+        frames += framer.feed(stream[i:i + 5])
+    assert [frame.seq for frame in frames] == [0, 1, 2]
+    assert framer.crc_errors == 1
+    assert framer.seq.dropped == 0
+
+
+def test_gap_count_across_wrap():
+    tracker = SeqTracker()
+    for seq in (65533, 65534, 65535, 0, 1):
+        tracker.update(seq)
+    assert tracker.dropped == 0
+    tracker.update(4)  # 2 and 3 lost
+    assert tracker.dropped == 2
+    tracker = SeqTracker()
+    tracker.update(65534)
+    tracker.update(1)  # 65535 and 0 lost across the wrap
+    assert tracker.dropped == 2
+    tracker.update(SEQ_MOD - 10, count=12)  # a jump backwards is a device reset
+    assert tracker.dropped == 2
+    assert tracker.last == 1
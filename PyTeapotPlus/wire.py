@@ -0,0 +1,247 @@
+"""
+Compact binary wire protocol of 'bno055_udp_miniC3.ino' (useBinary = true).
+
+Every sample is one fixed 28 byte little-endian frame, see bno055_frame_t in
+'tools.h':
+
+    offset  size  field
+    0       2     magic 0xA5 0x5A
+    2       1     kind, 0: quaternion w, x, y, z   1: yaw, pitch, roll, 0
+                  bits 6 and 7 are set by relay.py only, see FLAG_NO_TIME and FLAG_NO_CAL
+    3       1     calibration sys << 6 | gyro << 4 | accel << 2 | mag
+    4       2     sequence number, wraps at 65536
+    6       4     device millis() the sample was taken at
+    10      16    four float32 values
+    26      2     CRC-16/CCITT-FALSE of bytes 0..25
+
+Once a second the firmware also sends a frame of kind 2, the timing of its
+sampling loop: achieved rate in Hz, mean and maximum jitter in microseconds,
+and deadlines missed since boot (framer.DeviceTiming). It is not a sample and
+carries the sequence number of the next sample, so it is kept out of the
+loss count.
+
+Serial streams are resynchronised on the magic bytes, UDP datagrams carry one
+or more whole frames.
+
+For high sample rates over UDP the firmware can batch samples (udpBatchSize > 1
+in 'config.h'). A batch datagram shares the header and CRC between K samples,
+see bno055_batch_header_t and bno055_sample_t in 'tools.h':
+
+    offset  size    field
+    0       2       magic 0xA5 0x5B
+    2       1       kind
+    3       1       calibration at the time of the last sample
+    4       1       K, number of samples
+    5       2       sequence number of the first sample, the others follow it
+    7       20 * K  K times (uint32 millis, four float32 values)
+    7+20*K  2       CRC-16/CCITT-FALSE of all previous bytes
+"""
+
+import binascii
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from frameparser import FrameError
+from framer import KEEP_ALL, KEEP_LATEST, DeviceTiming
+
+
+MAGIC = b'\xa5\x5a'
+KIND_QUAT = 0
+KIND_YPR = 1
+KIND_TIMING = 2
+FRAME = struct.Struct('<2sBBHI4fH')
+FRAME_SIZE = FRAME.size
+SEQ_MOD = 1 << 16
+FLAG_NO_TIME = 0x40  # or'ed into kind: the sample has no device time, decode() gives millis None
+FLAG_NO_CAL = 0x80  # or'ed into kind: the calibration is unknown, decode() gives cal None
+
+BATCH_MAGIC = b'\xa5\x5b'
+BATCH_HEADER = struct.Struct('<2sBBBH')
+BATCH_SAMPLE = np.dtype([('millis', '<u4'), ('values', '<f4', (4,))])
+BATCH_MAX = 32  # UDP_BATCH_MAX in 'tools.h'
+
+BinaryFrame = namedtuple('BinaryFrame', ['seq', 'millis', 'kind', 'cal', 'values'])
+Batch = namedtuple('Batch', ['seq', 'kind', 'cal', 'millis', 'values'])
+Batch.__doc__ = """
+Decoded batch datagram, millis is a (K,) uint32 array and values a (K, 4) or
+(K, 3) float32 array, sample i has sequence number (seq + i) % SEQ_MOD
+"""
+
+
+def crc16(data):
+    """
+    CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF), same as crc16() in 'utils.ino'
+    """
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def pack_cal(cal):
+    sys, gyro, accel, mag = cal
+    return (sys & 3) << 6 | (gyro & 3) << 4 | (accel & 3) << 2 | (mag & 3)
+
+
+def unpack_cal(byte):
+    return (byte >> 6 & 3, byte >> 4 & 3, byte >> 2 & 3, byte & 3)
+
+
+def encode(seq, millis, values, kind=KIND_QUAT, cal=(3, 3, 3, 3)):
+    """
+    Builds one frame, used by the simulated device and the relay. millis or
+    cal None are sent as unknown (FLAG_NO_TIME, FLAG_NO_CAL).
+    """
+    if len(values) == 3:
+        values = (*values, 0.0)
+    if millis is None:
+        kind, millis = kind | FLAG_NO_TIME, 0
+    if cal is None:
+        kind, cal = kind | FLAG_NO_CAL, (0, 0, 0, 0)
+    body = FRAME.pack(MAGIC, kind, pack_cal(cal), seq % SEQ_MOD, millis & 0xFFFFFFFF, *values, 0)
+    return body[:-2] + struct.pack('<H', crc16(body[:-2]))
+
+
+def decode(buf, offset=0):
+    """
+    Decodes the frame starting at buf[offset], buf being any bytes-like object
+    """
+    if len(buf) - offset < FRAME_SIZE:
+        raise FrameError(f"Truncated binary frame: {len(buf) - offset} of {FRAME_SIZE} bytes")
+    magic, kind, cal, seq, millis, a, b, c, d, crc = FRAME.unpack_from(buf, offset)
+    if magic != MAGIC:
+        raise FrameError(f"Bad binary frame magic: {magic!r}")
+    # released right away so a bytearray buffer can still be resized by the caller
+    with memoryview(buf) as view, view[offset:offset + FRAME_SIZE - 2] as body:
+        valid = crc16(body) == crc
+    if not valid:
+        raise FrameError(f"Binary frame CRC mismatch (seq {seq})")
+    flags = kind & (FLAG_NO_TIME | FLAG_NO_CAL)
+    kind ^= flags
+    values = (a, b, c) if kind == KIND_YPR else (a, b, c, d)
+    return BinaryFrame(seq, None if flags & FLAG_NO_TIME else millis, kind,
+                       None if flags & FLAG_NO_CAL else unpack_cal(cal), values)
+
+
+def device_timing(frame):
+    """
+    DeviceTiming of a KIND_TIMING frame
+    """
+    rate, jitter, jitter_max, missed = frame.values
+    return DeviceTiming(rate, jitter, jitter_max, int(missed))
+
+
+def encode_batch(seq, millis, values, kind=KIND_QUAT, cal=(3, 3, 3, 3)):
+    """
+    Builds one batch datagram from K millis and K value rows, used by the
+    simulated device
+    """
+    samples = np.zeros(len(millis), BATCH_SAMPLE)
+    samples['millis'] = millis
+    samples['values'][:, :len(values[0])] = values
+    body = BATCH_HEADER.pack(BATCH_MAGIC, kind, pack_cal(cal), len(samples), seq % SEQ_MOD) + samples.tobytes()
+    return body + struct.pack('<H', crc16(body))
+
+
+def decode_batch(data):
+    """
+    Decodes a whole batch datagram into arrays in one step
+    """
+    if len(data) < BATCH_HEADER.size + 2:
+        raise FrameError(f"Truncated batch datagram: {len(data)} bytes")
+    magic, kind, cal, count, seq = BATCH_HEADER.unpack_from(data)
+    if magic != BATCH_MAGIC:
+        raise FrameError(f"Bad batch datagram magic: {magic!r}")
+    if len(data) != BATCH_HEADER.size + count * BATCH_SAMPLE.itemsize + 2:
+        raise FrameError(f"Batch datagram of {len(data)} bytes does not hold {count} samples")
+    with memoryview(data) as view, view[:-2] as body:
+        valid = crc16(body) == struct.unpack_from('<H', data, len(data) - 2)[0]
+    if not valid:
+        raise FrameError(f"Batch datagram CRC mismatch (seq {seq})")
+    samples = np.frombuffer(data, BATCH_SAMPLE, count, BATCH_HEADER.size)
+    values = samples['values'] if kind == KIND_QUAT else samples['values'][:, :3]
+    return Batch(seq, kind, unpack_cal(cal), samples['millis'], values)
+
+
+def decode_datagram(data):
+    """
+    Decodes all frames of a UDP datagram made of whole single frames
+    """
+    if len(data) % FRAME_SIZE:
+        raise FrameError(f"Datagram of {len(data)} bytes is not a whole number of frames")
+    return [decode(data, offset) for offset in range(0, len(data), FRAME_SIZE)]
+
+
+class SeqTracker:
+    """
+    Counts frames lost in transit from gaps in the 16 bit sequence numbers
+    """
+    def __init__(self):
+        self.last = None
+        self.dropped = 0
+
+    def update(self, seq, count=1):
+        """
+        Registers count consecutive frames starting at seq
+        """
+        if self.last is not None:
+            gap = (seq - self.last - 1) % SEQ_MOD
+            if gap < SEQ_MOD // 2:  # larger gaps are a device reset, not a loss
+                self.dropped += gap
+        self.last = (seq + count - 1) % SEQ_MOD
+
+
+class BinaryFramer:
+    """
+    Streaming counterpart of framer.LineFramer for binary frames. Text printed
+    before the stream starts (setup banner, calibration prompts) and corrupted
+    frames are skipped by searching for the next magic.
+    """
+    def __init__(self, policy=KEEP_ALL):
+        if policy not in (KEEP_ALL, KEEP_LATEST):
+            raise ValueError(f"Unknown framing policy: {policy!r}")
+        self.policy = policy
+        self.calibration = None
+        self.timing = None  # last DeviceTiming received
+        self.crc_errors = 0
+        self.skipped = 0  # bytes discarded while searching for a frame
+        self.seq = SeqTracker()
+        self._buf = bytearray()
+
+    def feed(self, data):
+        buf = self._buf
+        buf += data
+        frames = []
+        start = 0
+        while True:
+            i = buf.find(MAGIC, start)
+            if i < 0:
+                # a trailing 0xA5 may be the first half of the next magic
+                keep = 1 if start < len(buf) and buf[-1:] == MAGIC[:1] else 0
+                self.skipped += len(buf) - start - keep
+                start = len(buf) - keep
+                break
+            self.skipped += i - start
+            if len(buf) - i < FRAME_SIZE:
+                start = i
+                break
+            try:
+                frame = decode(buf, i)
+            except FrameError:
+                self.crc_errors += 1
+                start = i + 1
+                continue
+            if frame.kind == KIND_TIMING:
+                self.timing = device_timing(frame)
+            else:
+                frames.append(frame)
+                self.seq.update(frame.seq)
+            if frame.cal is not None:
+                self.calibration = frame.cal
+            start = i + FRAME_SIZE
+        del buf[:start]
+        if self.policy == KEEP_LATEST:
+            return frames[-1:]
+        return frames
+
+    def read_from(self, ser):
+        return self.feed(ser.read(ser.in_waiting or 1))
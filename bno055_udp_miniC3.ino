@@ -128,19 +128,53 @@ void setup() {
       Serial.println(WiFi.softAPIP()); // The default IP is often 192.168.4.1
       broadcastIP = WiFi.softAPIP();
       broadcastIP[3] = 255; // Set the last octet to 255 for broadcast on the local subnet
+      Serial.printf("Broadcasting samples to %s:%u\n", broadcastIP.toString().c_str(), localPort);
     }
   }
+  /* Start the sampling schedule */
+  nextSampleUs = micros();
+  timingStartMs = millis();
 }
 
 void loop() {
   sensors_event_t event; // Get a new sensor event
-  String broadcastString; // Sensor data to broadcast
-  uint8_t sys = displayCalStatus(); // Calibration status
+  char text[80]; // Text frame to send
+  int len;
+  uint8_t sys, gyro, accel, mag; // Calibration status
   float yaw, pitch, roll;
   imu::Quaternion quat;
   imu::Vector<3> euler;
-  
-  Serial.println("");
+  uint32_t sampleUs, sampleMs, late, missed;
+
+  /* Deadline scheduling: samples are due every SAMPLE_PERIOD_US after the first,
+     whatever the time spent reading and sending, so the rate does not drift */
+  int32_t early = (int32_t)(nextSampleUs - micros());
+  if (early > 0) {
+    if (useBinary && !useSerial) {
+      flushUdpBatch(false); // Do not hold a partial batch back when samples stop
+    }
+    if (early > SLEEP_MARGIN_US) {
+      delay(1); // Let WiFi and the idle task run, spin only for the last SLEEP_MARGIN_US
+    }
+    return;
+  }
+  sampleUs = micros();
+  sampleMs = millis();
+  late = sampleUs - nextSampleUs;
+  nextSampleUs += SAMPLE_PERIOD_US;
+  if ((int32_t)(sampleUs - nextSampleUs) >= 0) {
+    /* A whole period late (e.g. a WiFi stall): skip the missed samples instead of bursting them */
+    missed = (sampleUs - nextSampleUs) / SAMPLE_PERIOD_US + 1;
+    missedDeadlines += missed;
+    nextSampleUs += missed * SAMPLE_PERIOD_US;
+  }
+  timingSamples++;
+  jitterSumUs += late;
+  if (late > jitterMaxUs) {
+    jitterMaxUs = late;
+  }
+
+  bno.getCalibration(&sys, &gyro, &accel, &mag);
   if (useQuat) {
     /* Quaternion mode */
     quat = bno.getQuat();
@@ -159,36 +193,25 @@ void loop() {
     pitch = (float)event.orientation.y;
     roll = -(float)event.orientation.z;
   }
-  if (sys) {
+  reportCalStatus(sys, gyro, accel, mag, sampleMs);
+  if (sys && useBinary) {
     if (!useQuat || (useQuat && quat2euler)) {
-      broadcastString = "y" + String(yaw, 4) + "y "
-                      + "p" + String(pitch, 4) + "p "
-                      + "r" + String(roll, 4) + "r ";
-      if (!useSerial) {
-        Serial.printf(" Broadcasting XYZ angles to %s\n", broadcastIP.toString().c_str());
-        Udp.beginPacket(broadcastIP, localPort);
-        Udp.write((uint8_t*)(broadcastString.c_str()), broadcastString.length());
-        Udp.endPacket();
-      }
-      else {
-        Serial.printf("%s\n", broadcastString.c_str());
-      }
+      sendBinaryFrame(FRAME_KIND_YPR, yaw, pitch, roll, 0, sys, gyro, accel, mag, sampleMs);
     }
     else {
-      broadcastString = "w" + String(quat.w(), 4) + "w "
-                      + "a" + String(quat.x(), 4) + "a "
-                      + "b" + String(quat.y(), 4) + "b "
-                      + "c" + String(quat.z(), 4) + "c ";
-      if (!useSerial) {
-        Serial.printf("\nBroadcasting WXYZ quaternion to %s\n", broadcastIP.toString().c_str());
-        Udp.beginPacket(broadcastIP, localPort);
-        Udp.write((uint8_t*)(broadcastString.c_str()), broadcastString.length());
-        Udp.endPacket();
-      }
-      else {
-        Serial.printf("%s\n", broadcastString.c_str());
-      }
+      sendBinaryFrame(FRAME_KIND_QUAT, quat.w(), quat.x(), quat.y(), quat.z(), sys, gyro, accel, mag, sampleMs);
+    }
+  }
+  else if (sys) {
+    /* Text frames end with the sample time, "t<millis>t" */
+    if (!useQuat || (useQuat && quat2euler)) {
+      len = snprintf(text, sizeof(text), "y%.4fy p%.4fp r%.4fr t%lut ", yaw, pitch, roll, (unsigned long)sampleMs);
+    }
+    else {
+      len = snprintf(text, sizeof(text), "w%.4fw a%.4fa b%.4fb c%.4fc t%lut ",
+                     quat.w(), quat.x(), quat.y(), quat.z(), (unsigned long)sampleMs);
     }
+    sendText(text, len);
   }
-  delay(BNO055_MEASURE_SAMPLERATE_DELAY_MS); // Wait the specified delay before requesting new data
+  reportTiming(sys, gyro, accel, mag, sampleMs);
 }
@@ -13,7 +13,9 @@
 #define SDA 4                                      // I2C bus data pin
 #define SCL 3                                      // I2C bus clock pin
 #define BNO055_CALIB_SAMPLERATE_DELAY_MS (100)     // Calibration ODR: 10Hz
-#define BNO055_MEASURE_SAMPLERATE_DELAY_MS (200)   // Continuous ODR: 5Hz
+#define BNO055_MEASURE_RATE_HZ (5)                 // Continuous ODR in Hz, kept exactly by a micros() deadline, up to 100 (the fusion rate)
+#define CAL_STATUS_INTERVAL_MS (1000)              // Calibration status is sent when it changes, and at least this often
+#define TIMING_INTERVAL_MS (1000)                  // Achieved sample rate and loop jitter are sent this often
 #define BNO055_I2C_ADDR 0x28                       // ADR-GND: 0x28,ADR-VCC: 0x29, ADR: 0x29, HID-I2C:0x40
 
 /* User setting*/
@@ -22,11 +24,14 @@
  bool useSerial = true;                            // true to enable serial port communication, must be consistent with PyTeapot setting
  bool useQuat = true;                             // true to enable serial port communication, must be consistent with PyTeapot setting
  bool quat2euler = false;                          // true to transfrom quaternion to Euler angles, effective only when useQuat is true
+ bool useBinary = false;                           // true to send compact binary frames (28 bytes, seq + millis + CRC16), must be consistent with PyTeapot setting
+ uint8_t udpBatchSize = 1;                         // >1 packs that many samples (max UDP_BATCH_MAX) into one datagram, effective only for binary UDP
 
 /* UDP setting*/
 #define AID "bno055"                               // Access Point credentials: WiFi name
 #define PWD ""                                     // Password must be at least 8 characters long, or NULL for an open WiFi
 #define APPORT 5555                                // Local port to broadcast
+#define UDP_BATCH_TIMEOUT_MS (50)                  // Send an incomplete batch once its first sample is this old
 
 IPAddress local_ip(192,168,1,1);                   // Set IP address for AP
 IPAddress gateway(192,168,1,0);                    // Set Gateway for AP
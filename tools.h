@@ -29,6 +29,67 @@ unsigned int localPort = APPORT;
 IPAddress broadcastIP;
 WiFiUDP Udp;
 
+/* Binary frame, decoded by 'PyTeapotPlus/wire.py' */
+#define FRAME_MAGIC0 0xA5
+#define FRAME_MAGIC1 0x5A
+#define FRAME_KIND_QUAT 0                          // v = w, x, y, z
+#define FRAME_KIND_YPR 1                           // v = yaw, pitch, roll, 0
+#define FRAME_KIND_TIMING 2                        // v = rate Hz, mean and max jitter us, missed deadlines; seq of the next sample
+
+typedef struct __attribute__((packed)) {
+  uint8_t magic[2];
+  uint8_t kind;
+  uint8_t cal;                                     // sys << 6 | gyro << 4 | accel << 2 | mag
+  uint16_t seq;
+  uint32_t millis;
+  float v[4];
+  uint16_t crc;                                    // CRC-16/CCITT-FALSE of all previous bytes
+} bno055_frame_t;
+
+/* Batched UDP datagram: header, udpBatchSize samples, CRC16 */
+#define FRAME_BATCH_MAGIC1 0x5B
+#define UDP_BATCH_MAX 32
+
+typedef struct __attribute__((packed)) {
+  uint8_t magic[2];
+  uint8_t kind;
+  uint8_t cal;                                     // calibration at the time of the last sample
+  uint8_t count;
+  uint16_t seq;                                    // sequence number of the first sample
+} bno055_batch_header_t;
+
+typedef struct __attribute__((packed)) {
+  uint32_t millis;
+  float v[4];
+} bno055_sample_t;
+
+/* Deadline scheduled sampling loop */
+#if BNO055_MEASURE_RATE_HZ < 1 || BNO055_MEASURE_RATE_HZ > 100
+#error "BNO055_MEASURE_RATE_HZ must be 1..100, the BNO055 fuses at 100Hz"
+#endif
+#define SAMPLE_PERIOD_US (1000000UL / BNO055_MEASURE_RATE_HZ)
+#define SLEEP_MARGIN_US 2000                       // Closer to the deadline than this, loop() spins instead of sleeping
+
+uint32_t nextSampleUs = 0;                         // micros() deadline of the next sample
+uint8_t lastCal = 0xFF;                            // Packed calibration status last sent, 0xFF before the first
+uint32_t lastCalMs = 0;
+uint32_t timingStartMs = 0;                        // Start of the current timing interval
+uint32_t timingSamples = 0;                        // Samples taken in the current timing interval
+uint32_t jitterSumUs = 0;                          // Lateness of those samples behind their deadlines
+uint32_t jitterMaxUs = 0;
+uint32_t missedDeadlines = 0;                      // Samples skipped since boot because the loop fell a whole period behind
+
+uint16_t frameSeq = 0;
+uint8_t batchBuf[sizeof(bno055_batch_header_t) + UDP_BATCH_MAX * sizeof(bno055_sample_t) + sizeof(uint16_t)];
+uint8_t batchCount = 0;
+uint32_t batchStart = 0;
+
 extern imu::Vector<3> quat2Deg(imu::Quaternion&);
+extern uint16_t crc16(const uint8_t*, size_t);
+extern void sendBinaryFrame(uint8_t, float, float, float, float, uint8_t, uint8_t, uint8_t, uint8_t, uint32_t);
+extern void sendText(const char*, int);
+extern void reportCalStatus(uint8_t, uint8_t, uint8_t, uint8_t, uint32_t);
+extern void reportTiming(uint8_t, uint8_t, uint8_t, uint8_t, uint32_t);
+extern void flushUdpBatch(bool);
 
 #endif
\ No newline at end of file
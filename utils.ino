@@ -111,4 +111,162 @@ imu::Vector<3> quat2Deg(imu::Quaternion& quat) {
     euler.y() *= scaler;
     euler.z() *= scaler;
     return euler;
-}
\ No newline at end of file
+}
+/**************************************************************************/
+/*
+    CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF) for the binary frames
+    */
+/**************************************************************************/
+uint16_t crc16(const uint8_t* data, size_t len) {
+    uint16_t crc = 0xFFFF;
+    while (len--) {
+        crc ^= (uint16_t)(*data++) << 8;
+        for (uint8_t i = 0; i < 8; i++) {
+            crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : (crc << 1);
+        }
+    }
+    return crc;
+}
+/**************************************************************************/
+/*
+    Send one binary frame over UDP or serial, no heap allocation. sampleMs
+    is the millis() the sample was taken at.
+    */
+/**************************************************************************/
+void sendBinaryFrame(uint8_t kind, float a, float b, float c, float d,
+                     uint8_t system, uint8_t gyro, uint8_t accel, uint8_t mag, uint32_t sampleMs) {
+    if (!useSerial && udpBatchSize > 1 && kind != FRAME_KIND_TIMING) {
+        queueBatchSample(kind, a, b, c, d, system, gyro, accel, mag, sampleMs);
+        return;
+    }
+    bno055_frame_t frame;
+    frame.magic[0] = FRAME_MAGIC0;
+    frame.magic[1] = FRAME_MAGIC1;
+    frame.kind = kind;
+    frame.cal = (system & 3) << 6 | (gyro & 3) << 4 | (accel & 3) << 2 | (mag & 3);
+    frame.seq = kind == FRAME_KIND_TIMING ? frameSeq : frameSeq++; // Timing frames are not samples
+    frame.millis = sampleMs;
+    frame.v[0] = a;
+    frame.v[1] = b;
+    frame.v[2] = c;
+    frame.v[3] = d;
+    frame.crc = crc16((const uint8_t*)&frame, sizeof(frame) - sizeof(frame.crc));
+    if (!useSerial) {
+        Udp.beginPacket(broadcastIP, localPort);
+        Udp.write((const uint8_t*)&frame, sizeof(frame));
+        Udp.endPacket();
+    }
+    else {
+        Serial.write((const uint8_t*)&frame, sizeof(frame));
+    }
+}
+/**************************************************************************/
+/*
+    Append one sample to the UDP batch, send it once udpBatchSize samples
+    are collected
+    */
+/**************************************************************************/
+void queueBatchSample(uint8_t kind, float a, float b, float c, float d,
+                      uint8_t system, uint8_t gyro, uint8_t accel, uint8_t mag, uint32_t sampleMs) {
+    bno055_batch_header_t* header = (bno055_batch_header_t*)batchBuf;
+    bno055_sample_t* samples = (bno055_sample_t*)(batchBuf + sizeof(bno055_batch_header_t));
+    if (batchCount == 0) {
+        header->magic[0] = FRAME_MAGIC0;
+        header->magic[1] = FRAME_BATCH_MAGIC1;
+        header->kind = kind;
+        header->seq = frameSeq;
+        batchStart = millis();
+    }
+    header->cal = (system & 3) << 6 | (gyro & 3) << 4 | (accel & 3) << 2 | (mag & 3);
+    samples[batchCount].millis = sampleMs;
+    samples[batchCount].v[0] = a;
+    samples[batchCount].v[1] = b;
+    samples[batchCount].v[2] = c;
+    samples[batchCount].v[3] = d;
+    batchCount++;
+    frameSeq++;
+    flushUdpBatch(batchCount >= udpBatchSize || batchCount >= UDP_BATCH_MAX);
+}
+/**************************************************************************/
+/*
+    Send the pending UDP batch if forced or older than UDP_BATCH_TIMEOUT_MS
+    */
+/**************************************************************************/
+void flushUdpBatch(bool force) {
+    if (batchCount == 0 || (!force && millis() - batchStart < UDP_BATCH_TIMEOUT_MS)) {
+        return;
+    }
+    bno055_batch_header_t* header = (bno055_batch_header_t*)batchBuf;
+    header->count = batchCount;
+    size_t len = sizeof(bno055_batch_header_t) + batchCount * sizeof(bno055_sample_t);
+    uint16_t crc = crc16(batchBuf, len);
+    memcpy(batchBuf + len, &crc, sizeof(crc));
+    Udp.beginPacket(broadcastIP, localPort);
+    Udp.write(batchBuf, len + sizeof(crc));
+    Udp.endPacket();
+    batchCount = 0;
+}
+/**************************************************************************/
+/*
+    Send one line of text: a UDP datagram, or a line on the serial port
+    */
+/**************************************************************************/
+void sendText(const char* text, int len) {
+    if (!useSerial) {
+        Udp.beginPacket(broadcastIP, localPort);
+        Udp.write((const uint8_t*)text, len);
+        Udp.endPacket();
+    }
+    else {
+        Serial.write((const uint8_t*)text, len);
+        Serial.write('\n');
+    }
+}
+/**************************************************************************/
+/*
+    Send the calibration status when it changed or CAL_STATUS_INTERVAL_MS
+    passed, instead of on every sample. Binary frames carry it anyway.
+    */
+/**************************************************************************/
+void reportCalStatus(uint8_t system, uint8_t gyro, uint8_t accel, uint8_t mag, uint32_t now) {
+    uint8_t cal = (system & 3) << 6 | (gyro & 3) << 4 | (accel & 3) << 2 | (mag & 3);
+    if (cal == lastCal && now - lastCalMs < CAL_STATUS_INTERVAL_MS) {
+        return;
+    }
+    lastCal = cal;
+    lastCalMs = now;
+    if (useBinary) {
+        return;
+    }
+    char line[32];
+    int len = snprintf(line, sizeof(line), "\t%sSys:%d G:%d A:%d M:%d", system ? "" : "! ", system, gyro, accel, mag);
+    sendText(line, len);
+}
+/**************************************************************************/
+/*
+    Send the achieved sample rate and the loop jitter (how late samples were
+    taken behind their deadlines) every TIMING_INTERVAL_MS, then start over
+    */
+/**************************************************************************/
+void reportTiming(uint8_t system, uint8_t gyro, uint8_t accel, uint8_t mag, uint32_t now) {
+    uint32_t elapsed = now - timingStartMs;
+    if (elapsed < TIMING_INTERVAL_MS) {
+        return;
+    }
+    float rate = timingSamples * 1000.0f / elapsed;
+    float jitter = timingSamples ? (float)jitterSumUs / timingSamples : 0.0f;
+    if (useBinary) {
+        sendBinaryFrame(FRAME_KIND_TIMING, rate, jitter, (float)jitterMaxUs, (float)missedDeadlines,
+                        system, gyro, accel, mag, now);
+    }
+    else {
+        char line[64];
+        int len = snprintf(line, sizeof(line), "\tRate:%.2f Jitter:%.0f Max:%lu Missed:%lu",
+                           rate, jitter, (unsigned long)jitterMaxUs, (unsigned long)missedDeadlines);
+        sendText(line, len);
+    }
+    timingStartMs = now;
+    timingSamples = 0;
+    jitterSumUs = 0;
+    jitterMaxUs = 0;
+}